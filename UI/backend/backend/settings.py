@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "felchat.middleware.RequestMetricsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
 
     "django.middleware.security.SecurityMiddleware",
@@ -142,3 +143,42 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# FELChat bot replies
+# User messages are answered asynchronously by `python manage.py run_bot_worker`,
+# which claims pending bot messages from the database queue.
+
+FELCHAT_RAG_QUERY_URL = os.environ.get("RAG_QUERY_URL", "http://host.docker.internal:5000/query")
+FELCHAT_BOT_WORKERS = int(os.environ.get("FELCHAT_BOT_WORKERS", "4"))
+FELCHAT_BOT_POLL_INTERVAL = float(os.environ.get("FELCHAT_BOT_POLL_INTERVAL", "0.5"))
+# Replies stuck in "processing" longer than this (e.g. a crashed worker) are re-queued.
+FELCHAT_BOT_CLAIM_TIMEOUT = int(os.environ.get("FELCHAT_BOT_CLAIM_TIMEOUT", "600"))
+# A reply not finished this long after the user's message is given up on; the RAG
+# service and the LLM server get whatever remains of it as their deadline.
+FELCHAT_REPLY_DEADLINE_SEC = float(os.environ.get("FELCHAT_REPLY_DEADLINE_SEC", "120"))
+# New user messages are refused with 503 + Retry-After while this many replies are queued.
+FELCHAT_MAX_PENDING_REPLIES = int(os.environ.get("FELCHAT_MAX_PENDING_REPLIES", "200"))
+# Cached message lists of a conversation; a change to the conversation replaces them at once,
+# this only bounds how long superseded entries stay on disk.
+FELCHAT_MESSAGE_LIST_CACHE_SEC = int(os.environ.get("FELCHAT_MESSAGE_LIST_CACHE_SEC", "600"))
+# archive_conversations moves conversations idle this long out of the message tables;
+# they are restored the next time they are opened (see felchat/archive.py).
+FELCHAT_ARCHIVE_IDLE_DAYS = int(os.environ.get("FELCHAT_ARCHIVE_IDLE_DAYS", "90"))
+FELCHAT_ARCHIVE_BATCH_SIZE = int(os.environ.get("FELCHAT_ARCHIVE_BATCH_SIZE", "200"))
+
+# HTTP client used for Django -> RAG service calls (see felchat/http_client.py).
+FELCHAT_RAG_CONNECT_TIMEOUT = float(os.environ.get("RAG_CONNECT_TIMEOUT", "3"))
+FELCHAT_RAG_READ_TIMEOUT = float(os.environ.get("RAG_READ_TIMEOUT", "300"))
+FELCHAT_RAG_RETRIES = int(os.environ.get("RAG_RETRIES", "2"))
+FELCHAT_RAG_BREAKER_THRESHOLD = int(os.environ.get("RAG_BREAKER_THRESHOLD", "5"))
+FELCHAT_RAG_BREAKER_RESET_SEC = float(os.environ.get("RAG_BREAKER_RESET_SEC", "30"))
+
+# Shared between the web process and the bot worker, so it must not be process-local.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("FELCHAT_CACHE_DIR", str(BASE_DIR / "cache")),
+        "TIMEOUT": 60 * 60 * 24,
+    }
+}
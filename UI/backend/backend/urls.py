@@ -27,7 +27,7 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from felchat.views import (
-    UserViewSet, ConversationViewSet, MessageViewSet, AnswerRatingViewSet, conversation_messages
+    UserViewSet, ConversationViewSet, MessageViewSet, AnswerRatingViewSet, conversation_messages, metrics
 )
 
 # router = DefaultRouter()
@@ -49,6 +49,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
     path('conversations/<int:conversation_id>/messages/', conversation_messages),
+    path('metrics', metrics, name='metrics'),
 ]
 
 
@@ -2,9 +2,10 @@ from django.contrib import admin
 
 # Register your models here.
 from django.contrib import admin
-from .models import User, Conversation, Message, AnswerRating
+from .models import User, Conversation, Message, AnswerRating, ArchivedConversation
 
 admin.site.register(User)
 admin.site.register(Conversation)
 admin.site.register(Message)
 admin.site.register(AnswerRating)
+admin.site.register(ArchivedConversation)
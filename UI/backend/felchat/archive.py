@@ -0,0 +1,162 @@
+import json
+import zlib
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .metrics import span
+from .models import AnswerRating, ArchivedConversation, Conversation, Message
+from .read_cache import touch_conversations
+
+MESSAGE_FIELDS = ("id", "sender", "text", "timestamp", "status", "reply_to_id", "claimed_at", "request_id")
+RATING_FIELDS = ("id", "message_id", "rating", "comment", "rated_at")
+DATETIME_FIELDS = ("timestamp", "claimed_at", "rated_at")
+
+
+def _encode(rows) -> list[dict]:
+    return [
+        {key: value.isoformat() if key in DATETIME_FIELDS and value is not None else value for key, value in row.items()}
+        for row in rows
+    ]
+
+
+def _decode(row: dict) -> dict:
+    return {key: parse_datetime(value) if key in DATETIME_FIELDS and value is not None else value
+            for key, value in row.items()}
+
+
+def idle_conversation_ids(idle_days: int, after_id: int, limit: int) -> tuple[list[int], int]:
+    """
+    Scans the next `limit` not yet archived conversations with id > `after_id` and
+    returns (ids of those whose newest message is older than `idle_days` and that
+    have no reply in flight, the last id scanned). A last id of None ends the scan.
+    """
+    cutoff = timezone.now() - timedelta(days=idle_days)
+    page = list(
+        Conversation.objects.filter(id__gt=after_id, archive__isnull=True)
+        .order_by("id")
+        .values_list("id", flat=True)[:limit]
+    )
+    if not page:
+        return [], None
+    idle = (
+        Conversation.objects.filter(id__in=page)
+        .annotate(last_message_at=Max("messages__timestamp"))
+        .filter(last_message_at__lt=cutoff)
+        .exclude(messages__status__in=("pending", "processing"))
+        .values_list("id", flat=True)
+    )
+    return sorted(idle), page[-1]
+
+
+def archive_conversations(conversation_ids, idle_days: int) -> int:
+    """
+    Moves the messages and ratings of the given conversations into one
+    ArchivedConversation each, in a single transaction. Conversations that got a
+    new message since they were selected are left alone. Returns how many were archived.
+    """
+    cutoff = timezone.now() - timedelta(days=idle_days)
+    with transaction.atomic():
+        # Locks the conversations against restores running at the same time
+        locked = list(
+            Conversation.objects.select_for_update()
+            .filter(id__in=conversation_ids, archive__isnull=True)
+            .values_list("id", flat=True)
+        )
+        messages = {}
+        rows = Message.objects.filter(conversation_id__in=locked).order_by("id").values("conversation_id", *MESSAGE_FIELDS)
+        for row in rows:
+            messages.setdefault(row.pop("conversation_id"), []).append(row)
+        ratings = {}
+        for row in (AnswerRating.objects.filter(message__conversation_id__in=locked).order_by("id")
+                    .values("message__conversation_id", *RATING_FIELDS)):
+            ratings.setdefault(row.pop("message__conversation_id"), []).append(row)
+
+        archives = []
+        for conversation_id, rows in messages.items():
+            last_message_at = max(row["timestamp"] for row in rows)
+            if last_message_at >= cutoff or any(row["status"] in ("pending", "processing") for row in rows):
+                continue
+            document = {"messages": _encode(rows), "ratings": _encode(ratings.get(conversation_id, []))}
+            archives.append(ArchivedConversation(
+                conversation_id=conversation_id,
+                payload=zlib.compress(json.dumps(document, separators=(",", ":")).encode("utf-8"), 9),
+                message_count=len(rows),
+                first_message_id=rows[0]["id"],
+                last_message_id=rows[-1]["id"],
+                last_message_at=last_message_at,
+            ))
+        if not archives:
+            return 0
+
+        archived_ids = [archive.conversation_id for archive in archives]
+        ArchivedConversation.objects.bulk_create(archives)
+        # Only the rows read above (a message posted meanwhile stays, and is merged on
+        # restore); cascades to the ratings.
+        Message.objects.filter(id__in=[row["id"] for cid in archived_ids for row in messages[cid]]).delete()
+        touch_conversations(archived_ids)
+    return len(archives)
+
+
+def restore_conversation(conversation_id: int) -> int:
+    """
+    Moves an archived conversation's messages and ratings back into the hot
+    tables with their original ids and timestamps. Returns the number of
+    messages restored (0 if the conversation was not archived).
+    """
+    with transaction.atomic():
+        archive = ArchivedConversation.objects.select_for_update().filter(conversation_id=conversation_id).first()
+        if archive is None:
+            return 0
+        with span("archive_restore"):
+            document = json.loads(zlib.decompress(bytes(archive.payload)).decode("utf-8"))
+            messages = [Message(conversation_id=conversation_id, **_decode(row)) for row in document["messages"]]
+            ratings = [AnswerRating(**_decode(row)) for row in document["ratings"]]
+            # auto_now_add overwrites the timestamps on insert; put the archived ones back afterwards
+            timestamps = [m.timestamp for m in messages]
+            rated_at = [r.rated_at for r in ratings]
+            Message.objects.bulk_create(messages)
+            AnswerRating.objects.bulk_create(ratings)
+            for message, timestamp in zip(messages, timestamps):
+                message.timestamp = timestamp
+            for rating, value in zip(ratings, rated_at):
+                rating.rated_at = value
+            Message.objects.bulk_update(messages, ["timestamp"], batch_size=500)
+            AnswerRating.objects.bulk_update(ratings, ["rated_at"], batch_size=500)
+            archive.delete()
+        touch_conversations([conversation_id])
+    return len(messages)
+
+
+def ensure_restored(conversation_id) -> None:
+    """
+    Restores the conversation if it is archived; one indexed lookup otherwise.
+    Called wherever a conversation's messages are read or added.
+    """
+    if ArchivedConversation.objects.filter(conversation_id=conversation_id).exists():
+        restore_conversation(conversation_id)
+
+
+def ensure_message_restored(message_id) -> bool:
+    """
+    Restores the archived conversation holding message `message_id`, for requests
+    that name a message but not its conversation (message detail, rating).
+    Returns True if a conversation was restored.
+    """
+    try:
+        message_id = int(message_id)
+    except (TypeError, ValueError):
+        return False
+    if Message.objects.filter(pk=message_id).exists():
+        return False
+    candidates = ArchivedConversation.objects.filter(
+        first_message_id__lte=message_id, last_message_id__gte=message_id
+    ).only("conversation_id", "payload")
+    for archive in candidates:
+        document = json.loads(zlib.decompress(bytes(archive.payload)).decode("utf-8"))
+        if any(row["id"] == message_id for row in document["messages"]):
+            return restore_conversation(archive.conversation_id) > 0
+    return False
@@ -0,0 +1,86 @@
+from django.core.cache import cache
+
+from .models import Message
+
+UNSETTLED_STATUSES = ("pending", "processing")
+
+
+def _history_key(conversation_id: int) -> str:
+    return f"felchat:history:{conversation_id}"
+
+
+def _rag_sync_key(conversation_id: int) -> str:
+    return f"felchat:rag_sync:{conversation_id}"
+
+
+def conversation_history(conversation_id: int, upto_message_id: int) -> list[dict]:
+    """
+    Returns the messages of a conversation up to and including `upto_message_id`
+    as the [{"id", "sender", "text"}] payload expected by the RAG service.
+
+    The settled prefix of the history is cached, so each turn only reads the
+    rows added since the previous turn instead of the whole conversation.
+    """
+    key = _history_key(conversation_id)
+    cached = cache.get(key) or {"last_id": 0, "messages": []}
+
+    rows = (
+        Message.objects.filter(
+            conversation_id=conversation_id,
+            id__gt=cached["last_id"],
+            id__lte=upto_message_id,
+        )
+        .order_by("id")
+        .values("id", "sender", "text", "status")
+    )
+
+    settled = cached["messages"]
+    tail = []
+    for row in rows:
+        if row["status"] in UNSETTLED_STATUSES:
+            tail.append(None)
+            continue
+        entry = {"id": row["id"], "sender": row["sender"], "text": row["text"]}
+        if tail:
+            # Something before this row is still being generated; don't cache past it.
+            tail.append(entry)
+        else:
+            settled = settled + [entry]
+
+    if len(settled) != len(cached["messages"]):
+        cache.set(key, {"last_id": settled[-1]["id"], "messages": settled})
+
+    return settled + [entry for entry in tail if entry is not None]
+
+
+def invalidate_history(message: Message):
+    """
+    Drops the cached history when an already cached message is edited or deleted.
+    """
+    key = _history_key(message.conversation_id)
+    cached = cache.get(key)
+    if cached and message.id <= cached["last_id"]:
+        cache.delete_many([key, _rag_sync_key(message.conversation_id)])
+
+
+def rag_query_payload(conversation_id: int, history: list[dict], full: bool = False) -> dict:
+    """
+    Builds the session-delta request for the RAG service: only the messages the
+    RAG service has not seen yet, plus the number of messages it already holds.
+    Falls back to the full transcript when we don't know what it holds.
+    """
+    sync = None if full else cache.get(_rag_sync_key(conversation_id))
+    version = 0
+    if sync and sync["version"] <= len(history) and history[sync["version"] - 1]["id"] == sync["last_id"]:
+        version = sync["version"]
+
+    return {
+        "conversation_id": conversation_id,
+        "version": version,
+        "messages": [{"sender": m["sender"], "text": m["text"]} for m in history[version:]],
+        "full": version == 0,
+    }
+
+
+def mark_rag_synced(conversation_id: int, history: list[dict]):
+    cache.set(_rag_sync_key(conversation_id), {"version": len(history), "last_id": history[-1]["id"]})
@@ -0,0 +1,250 @@
+# Kept in sync by hand with rag_service/http_client.py (the two services do not
+# share a package); change both together.
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, InvalidHeader
+from urllib3.util.retry import Retry
+
+# Statuses that mean "the downstream is overloaded or down" rather than "bad request".
+RETRY_STATUSES = (502, 503, 504)
+# A POST (/query, /generate, /chat) is not idempotent and costly: only retried on
+# answers showing it was never processed. A 504 may come after the work was done.
+POST_RETRY_STATUSES = (502, 503)
+BREAKER_FAILURE_STATUSES = (429, 500, 502, 503, 504)
+
+# Remaining time budget of the request in milliseconds, recomputed at every hop.
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+# Set on a 503 that a healthy service sent on purpose because it is full.
+LOAD_SHED_HEADER = "X-Load-Shed"
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker rejects a call without contacting the downstream."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds. After that a single probe call is let through
+    (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = "half_open"
+                self.probe_in_flight = False
+            if self.state == "half_open":
+                if self.probe_in_flight:
+                    self.rejected += 1
+                    return False
+                self.probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            self.probe_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.trips += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+            }
+
+
+def _cap(timeout, left):
+    return left if timeout is None else min(timeout, left)
+
+
+def _not_sent(error) -> bool:
+    """
+    True if the request failed before reaching the downstream (no connection).
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, ConnectTimeoutError)
+
+
+class ResilientClient:
+    """
+    A requests.Session with keep-alive connection pools, connect/read timeouts,
+    bounded retries with exponential backoff and a circuit breaker in front of it.
+
+    Retries only happen when the request is known not to have been processed:
+    connection failures and 502/503 responses (honouring Retry-After); a GET is
+    also retried on 504, a POST is not.
+    Read timeouts are never retried, since the downstream may still be working.
+    Load-shed 503s are neither retried nor counted against the breaker.
+
+    `budget=<seconds>` on a call caps each attempt's timeout at what is left of
+    the caller's deadline and forwards that in the DEADLINE_HEADER. With a budget
+    504 (the downstream's own deadline miss) is never retried, a POST is only
+    retried on connection failures, and no retry is started that would not fit.
+    """
+
+    def __init__(self, name, connect_timeout=3.0, read_timeout=120.0, retries=2,
+                 backoff_factor=0.5, pool_maxsize=10, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = retries
+        self.backoff_factor = backoff_factor
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        # Retries are done in request(), where every attempt gets its own budget;
+        # urllib3 would resend the first attempt's DEADLINE_HEADER.
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=Retry(0, read=False))
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name}: circuit open, not calling {url}")
+
+        budget = kwargs.pop("budget", None)
+        deadline = time.monotonic() + budget if budget is not None else None
+        headers = dict(kwargs.pop("headers", None) or {})
+        timeout = kwargs.pop("timeout", self.timeout)
+        # Like requests: one number (or None) for both, or a (connect, read) pair
+        connect_timeout, read_timeout = timeout if isinstance(timeout, (tuple, list)) else (timeout, timeout)
+        with self.lock:
+            self.requests += 1
+
+        attempt = 0
+        while True:
+            timeout = (connect_timeout, read_timeout)
+            if deadline is not None:
+                left = max(deadline - time.monotonic(), 0.001)
+                timeout = (_cap(connect_timeout, left), _cap(read_timeout, left))
+                headers[DEADLINE_HEADER] = str(int(left * 1000))
+            try:
+                response = self.session.request(method, url, headers=headers, timeout=timeout, **kwargs)
+            except requests.RequestException as e:
+                if attempt < self.max_retries and _not_sent(e) and self._backoff(attempt, deadline):
+                    attempt += 1
+                    continue
+                self._record(ok=False, retries=attempt)
+                raise
+
+            if (attempt < self.max_retries and self._should_retry(method, response, deadline is not None)
+                    and self._backoff(attempt, deadline, response)):
+                response.close()
+                attempt += 1
+                continue
+            shed = bool(response.headers.get(LOAD_SHED_HEADER))
+            self._record(ok=shed or response.status_code not in BREAKER_FAILURE_STATUSES, retries=attempt)
+            return response
+
+    @staticmethod
+    def _should_retry(method, response, budgeted) -> bool:
+        # Sending a load-shed request again straight away only adds to the overload
+        if response.headers.get(LOAD_SHED_HEADER):
+            return False
+        if method == "POST":
+            return not budgeted and response.status_code in POST_RETRY_STATUSES
+        if budgeted:
+            return response.status_code in POST_RETRY_STATUSES
+        return response.status_code in RETRY_STATUSES
+
+    def _backoff(self, attempt, deadline, response=None) -> bool:
+        """
+        Sleeps before retry `attempt + 1` (Retry-After if the response has one);
+        False if the retry would start after the deadline.
+        """
+        delay = self.backoff_factor * 2 ** attempt
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                delay = Retry.DEFAULT.parse_retry_after(retry_after)
+            except InvalidHeader:
+                pass
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return False
+        time.sleep(delay)
+        return True
+
+    def _record(self, ok, retries):
+        with self.lock:
+            self.retries += retries
+            if not ok:
+                self.failures += 1
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def pool_metrics(self) -> list:
+        pools = []
+        manager = self.adapter.poolmanager
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                "host": pool.host,
+                "port": pool.port,
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                "available_slots": pool.pool.qsize() if pool.pool is not None else 0,
+                "maxsize": pool.pool.maxsize if pool.pool is not None else 0,
+            })
+        return pools
+
+    def metrics(self) -> dict:
+        with self.lock:
+            counters = {
+                "requests": self.requests,
+                "failures": self.failures,
+                "retries": self.retries,
+            }
+        return {
+            "name": self.name,
+            **counters,
+            "breaker": self.breaker.metrics(),
+            "pools": self.pool_metrics(),
+        }
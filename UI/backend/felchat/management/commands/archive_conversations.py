@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from felchat.archive import archive_conversations, idle_conversation_ids
+
+
+class Command(BaseCommand):
+    help = 'Archives the messages of idle conversations in bounded batches, one transaction per batch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-days', type=int, default=settings.FELCHAT_ARCHIVE_IDLE_DAYS)
+        parser.add_argument('--batch-size', type=int, default=settings.FELCHAT_ARCHIVE_BATCH_SIZE,
+                            help='Conversations scanned (and at most archived) per transaction.')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches.')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches, to leave the database room for live traffic.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the conversations that would be archived.')
+
+    def handle(self, *args, **options):
+        after_id, batches, scanned_idle, archived = 0, 0, 0, 0
+        started = time.monotonic()
+        while options['max_batches'] is None or batches < options['max_batches']:
+            ids, after_id = idle_conversation_ids(options['idle_days'], after_id, options['batch_size'])
+            if after_id is None:
+                break
+            batches += 1
+            scanned_idle += len(ids)
+            if ids and not options['dry_run']:
+                archived += archive_conversations(ids, options['idle_days'])
+            if options['verbosity'] > 1:
+                self.stdout.write(f"batch {batches}: up to conversation {after_id}, {len(ids)} idle")
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        action = 'would archive' if options['dry_run'] else 'archived'
+        count = scanned_idle if options['dry_run'] else archived
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {count} conversations idle for {options['idle_days']}+ days "
+            f"in {batches} batches ({time.monotonic() - started:.1f}s)"
+        ))
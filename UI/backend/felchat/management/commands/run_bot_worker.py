@@ -0,0 +1,50 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from felchat.metrics import REGISTRY, client_metrics_collector
+from felchat.tasks import BotReplyWorker, get_rag_client
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics/http":
+            body = json.dumps(get_rag_client().metrics()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            body = REGISTRY.render().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Answers pending bot messages by querying the RAG service on a worker pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.FELCHAT_BOT_WORKERS)
+        parser.add_argument('--poll-interval', type=float, default=settings.FELCHAT_BOT_POLL_INTERVAL)
+        parser.add_argument(
+            '--metrics-port', type=int, default=None,
+            help='Serve Prometheus metrics on /metrics (and client pool/breaker JSON on /metrics/http).',
+        )
+
+    def handle(self, *args, **options):
+        REGISTRY.register_collector(client_metrics_collector(get_rag_client()))
+        if options['metrics_port']:
+            server = ThreadingHTTPServer(("0.0.0.0", options['metrics_port']), MetricsHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Bot worker started with {options['workers']} workers."
+        ))
+        BotReplyWorker(options['workers'], options['poll_interval']).run_forever()
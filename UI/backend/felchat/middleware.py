@@ -0,0 +1,30 @@
+import time
+
+from django.urls import resolve
+from django.urls.exceptions import Resolver404
+
+from .metrics import REQUEST_ID_HEADER, REQUEST_SECONDS, current_request_id, start_request
+
+
+class RequestMetricsMiddleware:
+    """
+    Assigns every request an id (or keeps the caller's X-Request-ID), collects
+    its stage timings and records the total request time per view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        request.request_id = start_request(request.headers.get(REQUEST_ID_HEADER))
+        response = self.get_response(request)
+
+        try:
+            endpoint = resolve(request.path_info).view_name
+        except Resolver404:
+            endpoint = "unknown"
+        if endpoint != "metrics":
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, status=response.status_code)
+        response[REQUEST_ID_HEADER] = current_request_id()
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('felchat', '0003_message_conversation_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='request_id',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('felchat', '0004_message_request_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['status', 'timestamp'], name='felchat_msg_status_ts_idx'),
+        ),
+    ]
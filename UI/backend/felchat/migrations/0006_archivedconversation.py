@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('felchat', '0005_message_status_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedConversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.BinaryField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('last_message_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archive', to='felchat.conversation')),
+            ],
+        ),
+    ]
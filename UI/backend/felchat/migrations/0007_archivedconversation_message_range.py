@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 20:06
+
+import json
+import zlib
+
+from django.db import migrations, models
+
+
+def fill_message_range(apps, schema_editor):
+    ArchivedConversation = apps.get_model('felchat', 'ArchivedConversation')
+    for archive in ArchivedConversation.objects.iterator():
+        document = json.loads(zlib.decompress(bytes(archive.payload)).decode('utf-8'))
+        ids = [row['id'] for row in document['messages']]
+        if ids:
+            archive.first_message_id, archive.last_message_id = min(ids), max(ids)
+            archive.save(update_fields=['first_message_id', 'last_message_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('felchat', '0006_archivedconversation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedconversation',
+            name='first_message_id',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedconversation',
+            name='last_message_id',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='archivedconversation',
+            index=models.Index(fields=['first_message_id', 'last_message_id'], name='felchat_arch_msg_range_idx'),
+        ),
+        migrations.RunPython(fill_message_range, migrations.RunPython.noop),
+    ]
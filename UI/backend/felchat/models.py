@@ -25,11 +25,32 @@ class Message(models.Model):
         ("user", "User"),
         ("bot", "Bot"),
     )
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("processing", "Processing"),
+        ("done", "Done"),
+        ("error", "Error"),
+    )
 
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="messages")
     sender = models.CharField(max_length=10, choices=SENDER_CHOICES)
     text = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Bot replies are created as "pending" and filled in by the bot worker.
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default="done")
+    reply_to = models.OneToOneField(
+        "self", null=True, blank=True, on_delete=models.CASCADE, related_name="reply"
+    )
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    # X-Request-ID of the POST that queued this reply, forwarded to the rag service.
+    request_id = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["conversation", "timestamp"], name="felchat_msg_conv_ts_idx"),
+            # Bot reply queue: claiming, expiring and counting pending replies.
+            models.Index(fields=["status", "timestamp"], name="felchat_msg_status_ts_idx"),
+        ]
 
     def __str__(self):
         return f"{self.sender.capitalize()} @ {self.timestamp}: {self.text[:50]}"
@@ -43,3 +64,28 @@ class AnswerRating(models.Model):
 
     def __str__(self):
         return f"Rating {self.rating} for message {self.message.id}"
+
+
+class ArchivedConversation(models.Model):
+    """
+    Messages and ratings of a conversation that has been idle for a long time,
+    moved out of the hot tables as one compressed JSON document (see archive.py).
+    The Conversation row itself stays, so links and ids keep working.
+    """
+    conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE, related_name="archive")
+    # zlib-compressed JSON: {"messages": [...], "ratings": [...]}
+    payload = models.BinaryField()
+    message_count = models.PositiveIntegerField()
+    # Lowest and highest archived message id, to find the archive holding a message
+    first_message_id = models.BigIntegerField(null=True)
+    last_message_id = models.BigIntegerField(null=True)
+    last_message_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["first_message_id", "last_message_id"], name="felchat_arch_msg_range_idx"),
+        ]
+
+    def __str__(self):
+        return f"Archive of conversation {self.conversation_id} ({self.message_count} messages)"
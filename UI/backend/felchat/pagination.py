@@ -0,0 +1,19 @@
+from rest_framework.pagination import CursorPagination
+
+
+class MessageCursorPagination(CursorPagination):
+    """
+    Cursor pagination over a conversation, oldest message first.
+    Only used when the client asks for it with `?page_size=` or `?cursor=`;
+    otherwise the full list is returned as before.
+    """
+    ordering = ("timestamp", "id")
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if "page_size" not in params and self.cursor_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
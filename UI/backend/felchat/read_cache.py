@@ -0,0 +1,74 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .metrics import span
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def _version_key(conversation_id: int) -> str:
+    return f"felchat:conversation_version:{conversation_id}"
+
+
+def _new_version() -> dict:
+    return {"token": uuid.uuid4().hex, "modified": time.time()}
+
+
+def conversation_version(conversation_id: int) -> dict:
+    """
+    The current {"token", "modified"} of a conversation's messages. Every change
+    to a message or rating of the conversation replaces it (see touch_conversations).
+    """
+    key = _version_key(conversation_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version())
+        version = cache.get(key)
+    return version
+
+
+def touch_conversations(conversation_ids):
+    """
+    Gives the conversations a new version once the current transaction commits,
+    so readers never cache rows from before the commit under the new version.
+    """
+    keys = {_version_key(conversation_id) for conversation_id in conversation_ids}
+    if keys:
+        transaction.on_commit(lambda: cache.set_many({key: _new_version() for key in keys}))
+
+
+def cached_message_list(request, conversation_id: int, build):
+    """
+    Serves a message list of one conversation from the cache, keyed by the
+    conversation's version and the exact URL; `build()` produces the response
+    data on a miss. Requests whose If-None-Match / If-Modified-Since still match
+    get a 304 without touching the database.
+    """
+    version = conversation_version(conversation_id)
+    variant = f"{conversation_id}:{version['token']}:{request.get_full_path()}:{request.accepted_renderer.format}"
+    digest = hashlib.sha1(variant.encode("utf-8")).hexdigest()
+    etag = f'"{digest}"'
+    last_modified = int(version["modified"])
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        key = f"felchat:messages:{digest}"
+        with span("cache_message_list"):
+            data = cache.get(key)
+        if data is None:
+            data = build()
+            cache.set(key, data, settings.FELCHAT_MESSAGE_LIST_CACHE_SEC)
+        response = Response(data)
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = CACHE_CONTROL
+    return response
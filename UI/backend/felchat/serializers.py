@@ -20,7 +20,8 @@ class MessageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Message
-        fields = ['id', 'conversation', 'sender', 'text', 'timestamp', 'rating']
+        fields = ['id', 'conversation', 'sender', 'text', 'timestamp', 'rating', 'status', 'reply_to']
+        read_only_fields = ['status', 'reply_to']
 
     def get_rating(self, obj):
         if hasattr(obj, 'rating') and obj.rating:
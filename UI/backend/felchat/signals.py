@@ -0,0 +1,32 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .history import invalidate_history
+from .models import AnswerRating, Conversation, Message
+from .read_cache import touch_conversations
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_history(instance)
+    touch_conversations([instance.conversation_id])
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, **kwargs):
+    invalidate_history(instance)
+    touch_conversations([instance.conversation_id])
+
+
+@receiver(post_save, sender=AnswerRating)
+@receiver(post_delete, sender=AnswerRating)
+def rating_changed(sender, instance, **kwargs):
+    touch_conversations(
+        Message.objects.filter(pk=instance.message_id).values_list("conversation_id", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Conversation)
+def conversation_deleted(sender, instance, **kwargs):
+    touch_conversations([instance.pk])
@@ -0,0 +1,185 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .history import conversation_history, mark_rag_synced, rag_query_payload
+from .http_client import LOAD_SHED_HEADER, ResilientClient
+from .metrics import REQUEST_ID_HEADER, current_request_id, span, start_request
+from .models import Message
+from .read_cache import touch_conversations
+
+
+EXPIRED_REPLY_TEXT = "(bot error: no answer within the time limit, please ask again)"
+OVERLOADED_REPLY_TEXT = "(bot error: the assistant is overloaded, please ask again in a moment)"
+
+_rag_client = None
+_rag_client_lock = threading.Lock()
+
+
+def get_rag_client() -> ResilientClient:
+    """
+    One pooled client per process, shared by all bot worker threads.
+    """
+    global _rag_client
+    with _rag_client_lock:
+        if _rag_client is None:
+            _rag_client = ResilientClient(
+                "rag",
+                connect_timeout=settings.FELCHAT_RAG_CONNECT_TIMEOUT,
+                read_timeout=settings.FELCHAT_RAG_READ_TIMEOUT,
+                retries=settings.FELCHAT_RAG_RETRIES,
+                pool_maxsize=settings.FELCHAT_BOT_WORKERS,
+                failure_threshold=settings.FELCHAT_RAG_BREAKER_THRESHOLD,
+                reset_timeout=settings.FELCHAT_RAG_BREAKER_RESET_SEC,
+            )
+        return _rag_client
+
+
+def enqueue_bot_reply(user_message: Message, request_id: str = "") -> Message:
+    """
+    Creates the pending bot message that answers `user_message`.
+    The bot worker picks it up from the database and fills in the text.
+    """
+    return Message.objects.create(
+        conversation=user_message.conversation,
+        sender="bot",
+        text="",
+        status="pending",
+        reply_to=user_message,
+        request_id=request_id or "",
+    )
+
+
+def pending_reply_count() -> int:
+    return Message.objects.filter(status__in=("pending", "processing")).count()
+
+
+def reply_time_left(bot_message: Message) -> float:
+    """
+    Seconds left of the reply's deadline, counted from when it was queued.
+    """
+    deadline = bot_message.timestamp + timedelta(seconds=settings.FELCHAT_REPLY_DEADLINE_SEC)
+    return (deadline - timezone.now()).total_seconds()
+
+
+def claim_pending_replies(limit: int) -> list[int]:
+    """
+    Marks up to `limit` pending bot messages as processing and returns their ids.
+    Rows locked by another worker are skipped, so several workers can share the queue.
+    Replies whose deadline passed while they were queued are failed instead of claimed.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.FELCHAT_BOT_CLAIM_TIMEOUT)
+    overdue = now - timedelta(seconds=settings.FELCHAT_REPLY_DEADLINE_SEC)
+    with transaction.atomic():
+        expired = dict(
+            Message.objects.select_for_update(skip_locked=True)
+            .filter(sender="bot", status="pending", timestamp__lt=overdue)
+            .values_list("id", "conversation_id")
+        )
+        if expired:
+            Message.objects.filter(id__in=expired).update(status="error", text=EXPIRED_REPLY_TEXT)
+        claimed = dict(
+            Message.objects.select_for_update(skip_locked=True)
+            .filter(sender="bot")
+            .filter(Q(status="pending") | Q(status="processing", claimed_at__lt=stale))
+            .order_by("timestamp")
+            .values_list("id", "conversation_id")[:limit]
+        )
+        if claimed:
+            Message.objects.filter(id__in=claimed).update(status="processing", claimed_at=now)
+        # Bulk updates send no post_save, so cached message lists are invalidated here.
+        touch_conversations(set(expired.values()) | set(claimed.values()))
+    return list(claimed)
+
+
+def generate_bot_reply(bot_message_id: int) -> Message:
+    bot_message = Message.objects.select_related("reply_to").get(pk=bot_message_id)
+    user_message = bot_message.reply_to
+    start_request(bot_message.request_id or None)
+    headers = {REQUEST_ID_HEADER: current_request_id()}
+
+    try:
+        with span("db_read_history"):
+            history = conversation_history(bot_message.conversation_id, user_message.id)
+
+        client = get_rag_client()
+        with span("rag_http"):
+            response = None
+            for full in (False, True):
+                time_left = reply_time_left(bot_message)
+                if time_left <= 0:
+                    response = None
+                    break
+                response = client.post(
+                    settings.FELCHAT_RAG_QUERY_URL,
+                    # message_id lets the rag service's trace log be joined with AnswerRating
+                    json={**rag_query_payload(bot_message.conversation_id, history, full=full),
+                          "message_id": bot_message.id},
+                    headers=headers,
+                    budget=time_left,
+                )
+                # 409: the RAG service lost or never had this conversation; send everything.
+                if response.status_code != 409:
+                    break
+
+        if response is None or response.status_code == 504:
+            bot_message.text = EXPIRED_REPLY_TEXT
+            bot_message.status = "error"
+        elif response.status_code == 503 and response.headers.get(LOAD_SHED_HEADER):
+            bot_message.text = OVERLOADED_REPLY_TEXT
+            bot_message.status = "error"
+        else:
+            if response.status_code == 200:
+                mark_rag_synced(bot_message.conversation_id, history)
+            bot_message.text = response.json().get("answer", "Sorry, I didn't understand that.")
+            bot_message.status = "done"
+    except requests.Timeout:
+        bot_message.text = EXPIRED_REPLY_TEXT
+        bot_message.status = "error"
+    except Exception as e:
+        bot_message.text = f"(bot error: {str(e)})"
+        bot_message.status = "error"
+        print("bot error reply_text", bot_message.text)
+
+    with span("db_write_reply"):
+        bot_message.save(update_fields=["text", "status"])
+    return bot_message
+
+
+class BotReplyWorker:
+    """
+    Polls the database for pending bot messages and answers them on a thread pool,
+    so the latency of the RAG service never blocks a Django request.
+    """
+
+    def __init__(self, workers: int, poll_interval: float):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bot-reply")
+        self.in_flight = set()
+
+    def _run_one(self, bot_message_id: int):
+        try:
+            generate_bot_reply(bot_message_id)
+        finally:
+            connection.close()
+
+    def run_forever(self):
+        while True:
+            self.in_flight = {f for f in self.in_flight if not f.done()}
+            free_slots = self.workers - len(self.in_flight)
+
+            claimed = claim_pending_replies(free_slots) if free_slots > 0 else []
+            for bot_message_id in claimed:
+                self.in_flight.add(self.executor.submit(self._run_one, bot_message_id))
+
+            if not claimed:
+                time.sleep(self.poll_interval)
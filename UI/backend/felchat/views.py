@@ -1,17 +1,29 @@
 import random
 
-from django.contrib.sites import requests
+from django.conf import settings
 from django.forms import model_to_dict
 from django.shortcuts import render
-from django.utils import timezone
+from django.http import Http404, HttpResponse
 from rest_framework import viewsets, status
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import APIException, NotFound
 from rest_framework.response import Response
 
+from .archive import ensure_message_restored, ensure_restored
 from .models import User, Conversation, Message, AnswerRating
+from .metrics import REGISTRY, span
+from .pagination import MessageCursorPagination
+from .read_cache import cached_message_list
 from .serializers import UserSerializer, ConversationSerializer, MessageSerializer, AnswerRatingSerializer
+from .tasks import enqueue_bot_reply, pending_reply_count
 
-import requests
+
+class RepliesOverloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many questions are waiting for an answer, please try again shortly."
+    default_code = "overloaded"
+    # DRF's exception handler turns this into a Retry-After header.
+    wait = 5
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -27,44 +39,62 @@ class ConversationViewSet(viewsets.ModelViewSet):
 class MessageViewSet(viewsets.ModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
+    pagination_class = MessageCursorPagination
 
     def get_queryset(self):
+        if self.action != "list":
+            return Message.objects.select_related("rating")
         conversation_id = self.request.query_params.get("conversation")
         if conversation_id:
-            return Message.objects.filter(conversation_id=conversation_id).order_by("timestamp")
+            return (
+                Message.objects.filter(conversation_id=conversation_id)
+                .select_related("rating")
+                .order_by("timestamp", "id")
+            )
         return Message.objects.none()
 
-    def perform_create(self, serializer):
-        message = serializer.save()
-
-        print("\nmessage\n", message)
-        if message.sender == "user":
-
-            try:
-
-                messages = Message.objects.filter(conversation_id=message.conversation_id).order_by("timestamp")
-                print("messages ", messages)
-
-                serialized_messages = MessageSerializer(messages, many=True).data
-
-                response = requests.post(
-                    "http://host.docker.internal:5000/query",
-                    json=serialized_messages
-                )
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            # The message may belong to an archived conversation
+            if not ensure_message_restored(self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)):
+                raise
+            return super().get_object()
+
+    def list(self, request, *args, **kwargs):
+        conversation_id = request.query_params.get("conversation")
+        if not conversation_id or not conversation_id.isdigit():
+            return super().list(request, *args, **kwargs)
+        # Polled by the frontend for new replies; unchanged lists are answered from the cache or with a 304.
+        def build():
+            ensure_restored(conversation_id)
+            return super(MessageViewSet, self).list(request).data
+
+        return cached_message_list(request, int(conversation_id), build)
 
+    def create(self, request, *args, **kwargs):
+        # Refuse new questions up front rather than queueing replies that would expire anyway.
+        if request.data.get("sender") == "user" and pending_reply_count() >= settings.FELCHAT_MAX_PENDING_REPLIES:
+            raise RepliesOverloaded()
+        self.pending_reply = None
+        response = super().create(request, *args, **kwargs)
+        if self.pending_reply is not None:
+            # Clients poll /api/messages/<reply.id>/ until its status leaves "pending".
+            response.data["reply"] = MessageSerializer(self.pending_reply).data
+        return response
 
-                reply_text = response.json().get("answer", "Sorry, I didn't understand that.")
-                print("reply_text", reply_text)
-            except Exception as e:
-                reply_text = f"(bot error: {str(e)})"
-                print("bot error reply_text", reply_text)
+    def perform_create(self, serializer):
+        conversation = serializer.validated_data.get("conversation")
+        if conversation is not None:
+            # The bot's history and the client's list must include the archived turns
+            ensure_restored(conversation.pk)
+        with span("db_write_message"):
+            message = serializer.save()
 
-            Message.objects.create(
-                conversation=message.conversation,
-                sender="bot",
-                text=reply_text,
-                timestamp=timezone.now()
-            )
+        if message.sender == "user":
+            with span("db_write_enqueue_reply"):
+                self.pending_reply = enqueue_bot_reply(message, self.request.request_id)
 
 
 class AnswerRatingViewSet(viewsets.ModelViewSet):
@@ -75,6 +105,7 @@ class AnswerRatingViewSet(viewsets.ModelViewSet):
         message = request.data.get("message")
         value = request.data.get("value")
         comment = request.data.get("comment", "")
+        ensure_message_restored(message)
 
         rating, created = AnswerRating.objects.update_or_create(
             message_id=message,
@@ -87,12 +118,31 @@ class AnswerRatingViewSet(viewsets.ModelViewSet):
 
 @api_view(['GET'])
 def conversation_messages(request, conversation_id):
+    def build():
+        try:
+            conversation = Conversation.objects.get(pk=conversation_id)
+        except Conversation.DoesNotExist:
+            raise NotFound('Conversation not found')
+        ensure_restored(conversation.pk)
+
+        messages = (
+            Message.objects.filter(conversation=conversation)
+            .select_related('rating')
+            .order_by('timestamp', 'id')
+        )
+        paginator = MessageCursorPagination()
+        page = paginator.paginate_queryset(messages, request)
+        if page is not None:
+            return paginator.get_paginated_response(MessageSerializer(page, many=True).data).data
+
+        serializer = MessageSerializer(messages, many=True)
+        return serializer.data
+
     try:
-        conversation = Conversation.objects.get(pk=conversation_id)
-    except Conversation.DoesNotExist:
-        return Response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
+        return cached_message_list(request, conversation_id, build)
+    except NotFound as e:
+        return Response({'error': e.detail}, status=status.HTTP_404_NOT_FOUND)
 
-    messages = Message.objects.filter(conversation=conversation).order_by('timestamp')
-    serializer = MessageSerializer(messages, many=True)
-    return Response(serializer.data)
 
+def metrics(request):
+    return HttpResponse(REGISTRY.render(), content_type="text/plain; version=0.0.4")
@@ -262,6 +262,22 @@ const ChatUI: React.FC = () => {
     }, [currentConversation?.messages, isBotLoading, isFetchingMessages]);
 
 
+    // The backend answers asynchronously: poll the pending bot message until the worker is done.
+    const waitForBotReply = async (replyId: number) => {
+        while (true) {
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+            const replyRes = await fetch(`http://localhost:8000/api/messages/${replyId}/`);
+            if (!replyRes.ok) {
+                console.error("Failed to fetch bot reply:", replyRes.status, await replyRes.text());
+                return;
+            }
+            const reply = await replyRes.json();
+            if (reply.status !== 'pending' && reply.status !== 'processing') {
+                return;
+            }
+        }
+    };
+
     const handleSend = async () => {
         if (!newMessage.trim() || currentConvId === null) return;
         const textToSend = newMessage;
@@ -299,6 +315,11 @@ const ChatUI: React.FC = () => {
                 throw new Error(errorText || 'Failed to send message');
             }
 
+            const sendData = await sendRes.json();
+            if (sendData.reply) {
+                await waitForBotReply(sendData.reply.id);
+            }
+
             const updatedMessages = await fetchMessagesForConversation(currentConvId);
             setConversations((prevConvs) =>
                 prevConvs.map((conv) =>
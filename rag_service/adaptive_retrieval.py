@@ -0,0 +1,81 @@
+# rag_service/adaptive_retrieval.py
+#
+# Per-query retrieval policy driven by the raw dense (cosine) scores of the first
+# vector search. Tuned on the benchmark questions by benchmarks/tune_adaptive_retrieval.py.
+
+import threading
+from collections import namedtuple
+
+DEFAULT_ADAPTIVE_CONFIG = {
+    "enabled": True,
+    # Best dense score below this: out of scope, no rerank and no LLM call. None disables.
+    "out_of_scope_score": None,
+    # Margin between the best and second-best dense score at which the dense order is trusted as is.
+    "skip_rerank_margin": 0.08,
+    # Margin at which only the first short_rerank_candidates go through the cross-encoder.
+    "short_rerank_margin": 0.04,
+    "short_rerank_candidates": 6,
+    # Best minus k-th dense score at or below this counts as flat: search widen_factor times deeper.
+    "flat_spread": 0.01,
+    "widen_factor": 2,
+}
+
+# action: "out_of_scope", "widen", "skip_rerank", "short_rerank" or "full"
+# top_k_factor: multiplier of each index's similarity_top_k for the search
+# rerank_candidates: how many merged candidates the cross-encoder sees (None: all, 0: none)
+Decision = namedtuple("Decision", ["action", "top_k_factor", "rerank_candidates"])
+
+FULL = Decision("full", 1, None)
+
+
+class AdaptiveRetrievalPolicy:
+    """
+    Decides, from the sorted raw dense scores of a query's first search, how much
+    work the rest of retrieval gets:
+
+      best < out_of_scope_score          -> out_of_scope (return nothing)
+      best - k-th <= flat_spread         -> widen (search deeper, full rerank)
+      best - second >= skip_rerank_margin  -> skip_rerank (keep the dense order)
+      best - second >= short_rerank_margin -> short_rerank (rerank the head only)
+      otherwise                          -> full
+    """
+
+    def __init__(self, config=None):
+        self.config = {**DEFAULT_ADAPTIVE_CONFIG, **(config or {})}
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.config["enabled"])
+
+    def decide(self, scores) -> Decision:
+        """
+        `scores`: raw dense scores of the first search, best first.
+        """
+        decision = self._decide(scores)
+        with self.lock:
+            self.counts[decision.action] = self.counts.get(decision.action, 0) + 1
+        return decision
+
+    def _decide(self, scores) -> Decision:
+        c = self.config
+        if not c["enabled"]:
+            return FULL
+        if not scores:
+            return Decision("out_of_scope", 1, 0)
+        best = scores[0]
+        if c["out_of_scope_score"] is not None and best < c["out_of_scope_score"]:
+            return Decision("out_of_scope", 1, 0)
+        if len(scores) > 1 and c["flat_spread"] is not None and best - scores[-1] <= c["flat_spread"]:
+            return Decision("widen", c["widen_factor"], None)
+        margin = best - scores[1] if len(scores) > 1 else float("inf")
+        if c["skip_rerank_margin"] is not None and margin >= c["skip_rerank_margin"]:
+            return Decision("skip_rerank", 1, 0)
+        if c["short_rerank_margin"] is not None and margin >= c["short_rerank_margin"]:
+            return Decision("short_rerank", 1, c["short_rerank_candidates"])
+        return FULL
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return dict(self.counts)
@@ -0,0 +1,187 @@
+# rag_service/admission.py
+
+import math
+import threading
+import time
+
+from http_client import DEADLINE_HEADER, LOAD_SHED_HEADER
+from metrics import REGISTRY, record_stage
+
+_deadline_state = threading.local()
+
+
+class Overloaded(Exception):
+    """The request was rejected before doing any work; the client may retry after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out while it was being processed."""
+
+
+def set_deadline(budget_sec=None):
+    """
+    Starts the deadline of the request handled by this thread; None means no deadline.
+    """
+    _deadline_state.deadline = time.monotonic() + budget_sec if budget_sec is not None else None
+
+
+def remaining():
+    """
+    Seconds left until the current request's deadline, or None without a deadline.
+    """
+    deadline = getattr(_deadline_state, "deadline", None)
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline(stage, reserve=0.0):
+    """
+    Raises DeadlineExceeded unless more than `reserve` seconds are left before `stage` starts.
+    """
+    left = remaining()
+    if left is not None and left <= reserve:
+        raise DeadlineExceeded(f"Deadline exceeded before {stage} ({left:.3f}s left)")
+
+
+def budget_from_headers(headers, default=None):
+    try:
+        return int(headers[DEADLINE_HEADER]) / 1000.0
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+class AdmissionController:
+    """
+    Bounds the work a service accepts: at most `max_in_flight` requests run at a
+    time and at most `max_queue` wait for a slot. Everything beyond that is
+    rejected at once, as is a request whose deadline would expire while it waits
+    (predicted from a moving average of service times), so a backlog can never
+    grow past what the service can finish in time.
+    """
+
+    def __init__(self, name, max_in_flight, max_queue, smoothing=0.2):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.smoothing = smoothing
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+        self.avg_service_sec = None
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_deadline = 0
+
+    def _expected_wait(self, position) -> float:
+        # Requests ahead of us drain `max_in_flight` at a time.
+        return math.ceil(position / self.max_in_flight) * (self.avg_service_sec or 0.0)
+
+    def retry_after(self) -> int:
+        with self.condition:
+            return self._retry_after_locked()
+
+    def _retry_after_locked(self) -> int:
+        return max(1, math.ceil(self._expected_wait(self.queued + 1)))
+
+    def acquire(self):
+        wait_start = time.perf_counter()
+        with self.condition:
+            if self.in_flight >= self.max_in_flight or self.queued:
+                if self.queued >= self.max_queue:
+                    self.rejected_queue_full += 1
+                    raise Overloaded(f"{self.name}: queue full", self._retry_after_locked())
+                left = remaining()
+                if left is not None and self._expected_wait(self.queued + 1) >= left:
+                    self.rejected_deadline += 1
+                    raise Overloaded(f"{self.name}: cannot start before the deadline", self._retry_after_locked())
+
+                self.queued += 1
+                try:
+                    while self.in_flight >= self.max_in_flight:
+                        left = remaining()
+                        if left is not None and left <= 0:
+                            self.rejected_deadline += 1
+                            raise Overloaded(f"{self.name}: deadline expired in queue", self._retry_after_locked())
+                        self.condition.wait(timeout=left)
+                finally:
+                    self.queued -= 1
+            self.in_flight += 1
+            self.admitted += 1
+        record_stage("admission_wait", time.perf_counter() - wait_start)
+
+    def release(self, service_sec):
+        with self.condition:
+            self.in_flight -= 1
+            if self.avg_service_sec is None:
+                self.avg_service_sec = service_sec
+            else:
+                self.avg_service_sec += self.smoothing * (service_sec - self.avg_service_sec)
+            self.condition.notify()
+
+    def metrics(self) -> dict:
+        with self.condition:
+            return {
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "avg_service_sec": self.avg_service_sec or 0.0,
+                "admitted": self.admitted,
+                "rejected_queue_full": self.rejected_queue_full,
+                "rejected_deadline": self.rejected_deadline,
+            }
+
+
+def install_flask_admission(app, controller, endpoints, default_budget=None):
+    """
+    Reads the caller's remaining budget from DEADLINE_HEADER (or uses `default_budget`)
+    for every request, and runs the given endpoints through `controller`.
+    Overloaded becomes a 503 with Retry-After and LOAD_SHED_HEADER, DeadlineExceeded a 504.
+    """
+    from flask import g, jsonify, request
+
+    def shed_response(e):
+        response = jsonify({"error": str(e), "retry_after": e.retry_after})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(int(math.ceil(e.retry_after)))
+        response.headers[LOAD_SHED_HEADER] = "1"
+        return response
+
+    def deadline_response(e):
+        return jsonify({"error": str(e)}), 504
+
+    app.register_error_handler(Overloaded, shed_response)
+    app.register_error_handler(DeadlineExceeded, deadline_response)
+
+    @app.before_request
+    def _admit_request():
+        set_deadline(budget_from_headers(request.headers, default_budget))
+        if request.endpoint not in endpoints:
+            return None
+        left = remaining()
+        if left is not None and left <= 0:
+            return shed_response(Overloaded("Deadline already expired", controller.retry_after()))
+        try:
+            controller.acquire()
+        except Overloaded as e:
+            return shed_response(e)
+        g.admission_start = time.perf_counter()
+        return None
+
+    @app.teardown_request
+    def _release_request(exc):
+        start = g.pop("admission_start", None)
+        if start is not None:
+            controller.release(time.perf_counter() - start)
+
+    def collect():
+        labels = {"service": controller.name}
+        for name, value in controller.metrics().items():
+            yield f"felchat_admission_{name}", labels, value
+
+    REGISTRY.register_collector(collect)
@@ -0,0 +1,176 @@
+# rag_service/benchmarks/index_scaling.py
+#
+# Measures how IndexManager operations scale with corpus size on a deterministic
+# synthetic corpus. Each size runs in a fresh process so peak RSS is per size.
+#
+#   python benchmarks/index_scaling.py --sizes 10000,100000 --output data/benchmarks/index_scaling.json
+#   python benchmarks/index_scaling.py --sizes 10000 --embedder hf   # real bge-small-en, slow
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RAG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAG_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+OPERATIONS = ["add_documents", "query", "remove_by_email_id", "persist", "load", "rebuild_index"]
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Not Linux: fall back to the process high-water mark.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakRss:
+    """
+    Samples RSS on a background thread while the block runs.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self.stop = threading.Event()
+
+    def _sample(self):
+        while not self.stop.is_set():
+            self.peak = max(self.peak, current_rss_bytes())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.start = current_rss_bytes()
+        self.peak = self.start
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+
+
+def measure(results, name, fn, repeat=1):
+    # IndexManager prints the whole docstore on some paths; keep that out of the timing output.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), PeakRss() as rss:
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        seconds = (time.perf_counter() - t0) / repeat
+    results[name] = {
+        "seconds": seconds,
+        "rss_start_mb": rss.start / 2**20,
+        "rss_peak_mb": rss.peak / 2**20,
+    }
+    print(f"  {name:20} {seconds:10.3f} s   peak RSS {rss.peak / 2**20:9.1f} MB", file=sys.stderr)
+
+
+def run_single_size(n_sentences, embedder, n_queries, workdir):
+    from index_manager import IndexManager
+    from synthetic import HashEmbedding, synthetic_documents, synthetic_queries, synthetic_records
+
+    embed_model = HashEmbedding() if embedder == "hash" else None
+    documents = synthetic_documents(n_sentences)
+    queries = synthetic_queries(n_queries)
+
+    in_database = os.path.join(workdir, "in_database")
+    os.makedirs(in_database)
+    for i, record in enumerate(synthetic_records(n_sentences)):
+        with open(os.path.join(in_database, f"{i}.json"), "w", encoding="utf-8") as f:
+            json.dump(record, f)
+
+    index_dir = os.path.join(workdir, "index")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        manager = IndexManager("scaling", index_dir, window_size=3, embed_model=embed_model, rerank_model=None)
+
+    results = {"nodes": None}
+    measure(results, "add_documents", lambda: manager.add_documents(documents))
+    results["nodes"] = len(manager.index.docstore.docs)
+
+    query_iter = iter(queries * 2)
+    measure(results, "query", lambda: manager.retrieve_nodes(next(query_iter)), repeat=n_queries)
+    measure(results, "remove_by_email_id", lambda: manager.remove_by_email_id("synthetic-0"))
+    measure(results, "persist", lambda: manager.index.storage_context.persist(manager.index_path))
+    measure(results, "load", lambda: IndexManager("scaling", index_dir, window_size=3,
+                                                  embed_model=embed_model, rerank_model=None))
+    measure(results, "rebuild_index", lambda: manager.rebuild_index(in_database))
+
+    results["index_size_mb"] = sum(
+        os.path.getsize(os.path.join(manager.index_path, f)) for f in os.listdir(manager.index_path)
+    ) / 2**20
+    return results
+
+
+def scaling_exponents(runs):
+    """
+    Log-log slope between the smallest and largest size: ~1 is linear, >1 scales badly.
+    """
+    exponents = {}
+    sizes = sorted(runs, key=int)
+    if len(sizes) < 2:
+        return exponents
+    small, large = runs[sizes[0]], runs[sizes[-1]]
+    for op in OPERATIONS:
+        if op in small and op in large and small[op]["seconds"] > 0 and small["nodes"] and large["nodes"]:
+            exponents[op] = math.log(large[op]["seconds"] / small[op]["seconds"]) / math.log(large["nodes"] / small["nodes"])
+    return exponents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IndexManager scaling benchmark on a synthetic corpus.")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma separated sentence-node counts.")
+    parser.add_argument("--embedder", choices=["hash", "hf"], default="hash")
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--single-size", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single_size:
+        with tempfile.TemporaryDirectory() as workdir:
+            print(json.dumps(run_single_size(args.single_size, args.embedder, args.queries, workdir)))
+        return
+
+    runs = {}
+    for size in [int(s) for s in args.sizes.split(",")]:
+        print(f"{size} sentence nodes:", file=sys.stderr)
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--single-size", str(size),
+             "--embedder", args.embedder, "--queries", str(args.queries)],
+            stdout=subprocess.PIPE, text=True, cwd=RAG_DIR,
+        )
+        if proc.returncode != 0:
+            print(f"  size {size} failed with exit code {proc.returncode}", file=sys.stderr)
+            continue
+        runs[str(size)] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    report = {"embedder": args.embedder, "runs": runs, "scaling_exponent": scaling_exponents(runs)}
+
+    print(f"{'operation':20}" + "".join(f"{s + ' nodes':>22}" for s in runs))
+    for op in OPERATIONS:
+        row = f"{op:20}"
+        for size in runs:
+            r = runs[size].get(op)
+            row += f"{r['seconds']:>11.3f}s {r['rss_peak_mb']:>7.0f}MB" if r else f"{'-':>22}"
+        exponent = report["scaling_exponent"].get(op)
+        print(row + (f"   exponent {exponent:.2f}" if exponent is not None else ""))
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
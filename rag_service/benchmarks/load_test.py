@@ -0,0 +1,311 @@
+# rag_service/benchmarks/load_test.py
+#
+# Replays the benchmark questions against the rag service /query endpoint (or
+# end-to-end through Django /api/messages/) and reports throughput, error rate
+# and p50/p95/p99 latency per stage.
+#
+#   python benchmarks/stub_llm_server.py --latency 2 &
+#   LLM_CHAT_SERVER_URL=http://localhost:8003/chat python main.py &
+#   python benchmarks/load_test.py --concurrency 8 --requests 200 --output data/benchmarks/run.json
+#   python benchmarks/load_test.py --rate 2 --duration 120 --baseline data/benchmarks/run.json
+#   python benchmarks/load_test.py --rate 4 --duration 120 --deadline 30   # overload: goodput vs shedding
+#   python benchmarks/load_test.py --questions data/traces/trace.jsonl      # replay recorded traffic
+
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_QUESTIONS = "data/evaluation/20250505_FELchat_benchmark_questions_v3.json"
+# Upper bound on client threads in open loop; arrivals beyond it wait and show up as send lag
+MAX_IN_FLIGHT = 256
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+def load_workload(path):
+    """
+    Accepts the benchmark question list or a JSON-lines file of {"question": ...} records,
+    such as the rag service's trace log (trace_log.py).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = json.load(f)
+    return [
+        {"id": r.get("id", r.get("request_id", i)), "question": r["question"]}
+        for i, r in enumerate(records) if r.get("question")
+    ]
+
+
+class RagTarget:
+    def __init__(self, url, timeout, deadline=None, pool_maxsize=10):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.deadline = deadline
+        self.session = requests.Session()
+        # One keep-alive connection per request in flight
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=pool_maxsize))
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=pool_maxsize))
+
+    def send(self, question):
+        headers = {"X-Request-ID": uuid.uuid4().hex}
+        if self.deadline:
+            headers["X-Request-Timeout-Ms"] = str(int(self.deadline * 1000))
+        response = self.session.post(
+            f"{self.url}/query",
+            json=[{"sender": "user", "text": question}],
+            headers=headers,
+            timeout=self.timeout,
+        )
+        timings = {}
+        if response.ok:
+            timings = response.json().get("timings", {})
+        return response.status_code, timings
+
+
+class DjangoTarget:
+    """
+    Posts to /api/messages/ and polls the pending bot reply until the worker finishes it.
+    """
+
+    def __init__(self, url, timeout, user_id, poll_interval=0.25):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.user_id = user_id
+        self.poll_interval = poll_interval
+        self.local = threading.local()
+
+    def _conversation(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+            response = self.local.session.post(
+                f"{self.url}/api/conversations/", json={"title": "load test", "user": self.user_id}, timeout=self.timeout
+            )
+            response.raise_for_status()
+            self.local.conversation_id = response.json()["id"]
+        return self.local.session, self.local.conversation_id
+
+    def send(self, question):
+        session, conversation_id = self._conversation()
+        start = time.perf_counter()
+        response = session.post(
+            f"{self.url}/api/messages/",
+            json={"conversation": conversation_id, "sender": "user", "text": question},
+            timeout=self.timeout,
+        )
+        if response.status_code != 201:
+            return response.status_code, {}
+        timings = {"django_post_sec": time.perf_counter() - start}
+
+        reply_id = response.json()["reply"]["id"]
+        deadline = start + self.timeout
+        while time.perf_counter() < deadline:
+            reply = session.get(f"{self.url}/api/messages/{reply_id}/", timeout=self.timeout).json()
+            if reply["status"] == "done":
+                return 200, timings
+            if reply["status"] == "error":
+                return 500, timings
+            time.sleep(self.poll_interval)
+        return 504, timings
+
+
+def max_in_flight(concurrency, rate, lifetime, cap=MAX_IN_FLIGHT):
+    """
+    Client threads needed: `concurrency` in closed loop. In open loop every arrival
+    should be sent on time however slow the server gets, and a request lives at most
+    `lifetime` seconds, so rate x lifetime (doubled for bursts) are enough, up to `cap`.
+    """
+    if rate <= 0:
+        return concurrency
+    return max(concurrency, min(cap, math.ceil(2 * rate * lifetime) + 1))
+
+
+def run(target, workload, concurrency, total_requests, rate, duration, threads):
+    """
+    Closed loop (rate == 0): `concurrency` clients send back to back.
+    Open loop (rate > 0): Poisson arrivals at `rate` req/s, each sent at its arrival
+    time whatever is still in flight, so the server sees the offered rate;
+    `concurrency` does not apply. latency_sec includes the server's queueing, and
+    send_lag_sec shows any delay on the client side (all `threads` busy).
+    """
+    results = []
+    lock = threading.Lock()
+
+    def one(question, scheduled_at):
+        started = time.perf_counter()
+        try:
+            status, timings = target.send(question["question"])
+            error = None
+        except Exception as e:
+            status, timings, error = 0, {}, str(e)
+        finished = time.perf_counter()
+        with lock:
+            results.append({
+                "id": question["id"],
+                "status": status,
+                "error": error,
+                "latency_sec": finished - scheduled_at,
+                "send_lag_sec": started - scheduled_at,
+                "service_sec": finished - started,
+                "timings": timings,
+            })
+
+    start = time.perf_counter()
+    # Threads are started on demand and reused once idle
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        sent = 0
+        next_arrival = start
+        while sent < total_requests and time.perf_counter() - start < duration:
+            question = workload[sent % len(workload)]
+            if rate > 0:
+                next_arrival += random.expovariate(rate)
+                time.sleep(max(0.0, next_arrival - time.perf_counter()))
+                pool.submit(one, question, next_arrival)
+            else:
+                # Keep at most `concurrency` requests outstanding.
+                while True:
+                    with lock:
+                        outstanding = sent - len(results)
+                    if outstanding < concurrency:
+                        break
+                    time.sleep(0.001)
+                pool.submit(one, question, time.perf_counter())
+            sent += 1
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def build_report(results, elapsed, config):
+    ok = [r for r in results if r["status"] == 200]
+    # Answers the user actually got in time; with no deadline every success counts.
+    in_time = [r for r in ok if not config.get("deadline") or r["latency_sec"] <= config["deadline"]]
+    stages = {}
+    for r in ok:
+        for stage, seconds in r["timings"].items():
+            stages.setdefault(stage, []).append(seconds)
+    return {
+        "config": config,
+        "summary": {
+            "requests": len(results),
+            "succeeded": len(ok),
+            "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+            "elapsed_sec": elapsed,
+            "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+            "goodput_rps": len(in_time) / elapsed if elapsed else 0.0,
+            "shed": sum(1 for r in results if r["status"] == 503),
+            "latency_sec": summarize([r["latency_sec"] for r in ok]),
+            "max_send_lag_sec": max((r["send_lag_sec"] for r in results), default=0.0),
+        },
+        "stages": {stage: summarize(values) for stage, values in sorted(stages.items())},
+        "status_counts": {str(s): sum(1 for r in results if r["status"] == s) for s in {r["status"] for r in results}},
+        "requests": results,
+    }
+
+
+def print_report(report, baseline=None):
+    summary = report["summary"]
+    print(f"requests={summary['requests']} ok={summary['succeeded']} "
+          f"error_rate={summary['error_rate']:.2%} throughput={summary['throughput_rps']:.2f} req/s "
+          f"goodput={summary['goodput_rps']:.2f} req/s shed={summary['shed']}")
+
+    rows = [("total", summary["latency_sec"])] + list(report["stages"].items())
+    base_rows = {}
+    if baseline:
+        base_rows = {"total": baseline["summary"]["latency_sec"], **baseline["stages"]}
+    print(f"{'stage':32} {'p50':>9} {'p95':>9} {'p99':>9}" + ("   p99 vs baseline" if baseline else ""))
+    for name, stats in rows:
+        if not stats["count"]:
+            continue
+        line = f"{name:32} {stats['p50']:9.3f} {stats['p95']:9.3f} {stats['p99']:9.3f}"
+        base = base_rows.get(name)
+        if base and base.get("p99"):
+            line += f"   {(stats['p99'] - base['p99']) / base['p99']:+.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load and latency benchmark for the FELChat pipeline.")
+    parser.add_argument("--target", choices=["rag", "django"], default="rag")
+    parser.add_argument("--url", default=None, help="Defaults to http://localhost:5000 (rag) or :8000 (django).")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS,
+                        help="Benchmark question JSON, or a JSON-lines workload such as a trace log.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Clients of the closed loop (--rate 0).")
+    parser.add_argument("--rate", type=float, default=0.0, help="Open-loop arrival rate in req/s (0 = closed loop).")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=float("inf"), help="Stop sending after this many seconds.")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="Seconds of budget sent as X-Request-Timeout-Ms (rag target); also the goodput cut-off.")
+    parser.add_argument("--max-in-flight", type=int, default=MAX_IN_FLIGHT,
+                        help="Cap on open-loop client threads; later arrivals are sent late (send lag).")
+    parser.add_argument("--user-id", type=int, default=1,
+                        help="Id of the Django user that owns the load-test conversations (django target).")
+    parser.add_argument("--shuffle", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the machine-readable result JSON here.")
+    parser.add_argument("--baseline", default=None, help="A previous result JSON to compare p99 against.")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    workload = load_workload(args.questions)
+    if args.shuffle:
+        random.shuffle(workload)
+
+    url = args.url or ("http://localhost:5000" if args.target == "rag" else "http://localhost:8000")
+    # With a deadline the rag service gives up on a request by then, not after --timeout
+    lifetime = args.deadline if args.deadline and args.target == "rag" else args.timeout
+    threads = max_in_flight(args.concurrency, args.rate, lifetime, args.max_in_flight)
+    if args.target == "rag":
+        target = RagTarget(url, args.timeout, args.deadline, pool_maxsize=threads)
+    else:
+        target = DjangoTarget(url, args.timeout, args.user_id)
+
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "baseline")}
+    config.update({"url": url, "duration": None if args.duration == float("inf") else args.duration,
+                   "started_at": time.strftime("%Y-%m-%dT%H:%M:%S")})
+
+    results, elapsed = run(target, workload, args.concurrency, args.requests, args.rate, args.duration, threads)
+    report = build_report(results, elapsed, config)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# rag_service/benchmarks/reduced_index_report.py
+#
+# Memory / latency versus recall@6 of the reduced-dimension scan (reduced_index.py)
+# on the benchmark questions, for a grid of projection sizes and candidate factors.
+#
+#   python benchmarks/reduced_index_report.py --output data/benchmarks/reduced_index.json
+#   python benchmarks/reduced_index_report.py --embedder hash --build-from data/PDF --synthetic 200000
+#
+# recall@6 is measured against the exact full-dimension search: the share of each
+# question's top-6 that the reduced scan + re-scoring returns as well; a node tied
+# with the exact 6th-best score counts as a hit (duplicate sentences tie exactly).
+# --synthetic pads the corpus with generated regulation sentences, to see the
+# trade-off at sizes where the scan dominates.
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+RAG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAG_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_QUESTIONS = "data/evaluation/20250505_FELchat_benchmark_questions_v3.json"
+CONFIG_PATH = "data/configuration/config.json"
+TOP_K = 6
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def build_managers(args, config):
+    from index_manager import IndexManager
+
+    embed_model = None
+    if args.embedder == "hash":
+        from synthetic import HashEmbedding
+        embed_model = HashEmbedding()
+
+    if not args.build_from and not args.synthetic:
+        from index_federation import FederatedIndex
+        indexes = FederatedIndex.from_config(config, embed_model=embed_model, rerank_model=None)
+        return indexes.managers, None
+
+    from synthetic import synthetic_documents
+
+    workdir = tempfile.mkdtemp(prefix="reduced-index-")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        manager = IndexManager("report", workdir, window_size=3, embed_model=embed_model, rerank_model=None)
+        if args.build_from:
+            source = os.path.join(workdir, "in")
+            shutil.copytree(args.build_from, source)
+            manager.add_pdfs_to_index(source, os.path.join(workdir, "done"))
+        if args.synthetic:
+            manager.add_documents(synthetic_documents(args.synthetic), persist=False)
+    return {"report": manager}, workdir
+
+
+def exact_kth_score(matrix, queries, k):
+    scores = queries @ matrix.T
+    return np.partition(-scores, k - 1, axis=1)[:, k - 1] * -1
+
+
+def timed_per_query(fn, queries):
+    latencies, results = [], []
+    for query in queries:
+        t0 = time.perf_counter()
+        results.append(fn(query[None, :]))
+        latencies.append(time.perf_counter() - t0)
+    return latencies, results
+
+
+def report_index(manager, questions, dimensions, factors):
+    from reduced_index import ReducedIndex
+
+    embedding_dict = manager.index.vector_store.data.embedding_dict
+    node_ids = list(embedding_dict.keys())
+    matrix = np.asarray([embedding_dict[n] for n in node_ids], dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    queries = np.asarray(manager._embed_queries(questions), dtype=np.float32)
+    queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    k = min(TOP_K, len(node_ids))
+
+    latencies, kth_scores = timed_per_query(lambda q: exact_kth_score(matrix, q, k)[0], queries)
+    full = {
+        "scan_matrix_mb": matrix.nbytes / 2**20,
+        "search_p50_ms": 1000 * percentile(latencies, 50),
+        "search_p95_ms": 1000 * percentile(latencies, 95),
+    }
+    print(f"{manager.index_name}: {len(node_ids)} nodes, {matrix.shape[1]} dims, "
+          f"full scan {full['scan_matrix_mb']:.1f} MB, p50 {full['search_p50_ms']:.2f} ms", file=sys.stderr)
+
+    runs = []
+    lock = threading.RLock()
+    for dims in dimensions:
+        if dims >= matrix.shape[1] or dims >= len(node_ids):
+            continue
+        for factor in factors:
+            with tempfile.TemporaryDirectory() as projection_dir:
+                reduced = ReducedIndex(projection_dir, {"dimensions": dims, "candidate_factor": factor,
+                                                        "min_candidates": 0, "min_nodes": 0})
+                t0 = time.perf_counter()
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    reduced.get_matrix(embedding_dict, lock)
+                fit_sec = time.perf_counter() - t0
+                latencies, hits = timed_per_query(lambda q: reduced.search(embedding_dict, lock, q, k)[0], queries)
+            # Re-scored scores are exact cosines, so a hit is a node scoring at least the exact k-th best
+            recalls = [
+                sum(score >= kth - 1e-5 for _, score in found) / k
+                for kth, found in zip(kth_scores, hits)
+            ]
+            run = {
+                "dimensions": dims,
+                "candidate_factor": factor,
+                "candidates": max(k * factor, k),
+                "explained_variance": reduced.projection["explained"],
+                "scan_matrix_mb": reduced.matrix[1].nbytes / 2**20,
+                "fit_and_project_sec": fit_sec,
+                "search_p50_ms": 1000 * percentile(latencies, 50),
+                "search_p95_ms": 1000 * percentile(latencies, 95),
+                "recall_at_6": statistics.mean(recalls),
+                "min_recall_at_6": min(recalls),
+            }
+            runs.append(run)
+            print(f"  {dims:4d} dims x{factor:<2d} recall@6 {run['recall_at_6']:.3f} "
+                  f"(min {run['min_recall_at_6']:.2f})  {run['scan_matrix_mb']:8.1f} MB  "
+                  f"p50 {run['search_p50_ms']:7.2f} ms  explained {run['explained_variance']:.1%}", file=sys.stderr)
+    return {"nodes": len(node_ids), "full_dimensions": int(matrix.shape[1]), "full": full, "reduced": runs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reduced-dimension scan: memory/latency vs recall@6.")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS)
+    parser.add_argument("--embedder", choices=["config", "hash"], default="config")
+    parser.add_argument("--build-from", default=None, help="Build a throwaway index from this PDF folder.")
+    parser.add_argument("--synthetic", type=int, default=0, help="Add this many synthetic sentence nodes.")
+    parser.add_argument("--dimensions", default="32,64,96,128")
+    parser.add_argument("--candidate-factors", default="2,4,8",
+                        help="Candidates re-scored with full vectors, as multiples of top-k.")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    os.chdir(RAG_DIR)
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    with open(args.questions, "r", encoding="utf-8") as f:
+        questions = [q["question"] for q in json.load(f) if not q.get("out_of_scope")]
+    dimensions = [int(d) for d in args.dimensions.split(",")]
+    factors = [int(f) for f in args.candidate_factors.split(",")]
+
+    managers, workdir = build_managers(args, config)
+    try:
+        report = {
+            "embedder": args.embedder,
+            "questions": len(questions),
+            "indexes": {name: report_index(m, questions, dimensions, factors) for name, m in managers.items()},
+        }
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# rag_service/benchmarks/replica_scaling.py
+#
+# Measures retrieval throughput with 1, 2, 4... read replicas fed by one writer,
+# and how long a write takes to become visible on every replica. Runs locally:
+# the writer lives in this process, each replica is a subprocess serving
+# POST /retrieve and GET /replication. Uses the synthetic corpus and embedder.
+#
+#   python benchmarks/replica_scaling.py --replicas 1,2,4 --sentences 20000 --duration 20
+
+import argparse
+import contextlib
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+RAG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAG_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+INDEX_NAME = "replica_bench"
+WINDOW_SIZE = 3
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_replica(port, replication_dir, local_dir, poll_interval):
+    from flask import Flask, jsonify, request
+
+    from replication import IndexFollower, ReplicaSync
+    from synthetic import HashEmbedding
+
+    follower = IndexFollower(
+        {"name": INDEX_NAME, "window_size": WINDOW_SIZE}, replication_dir, local_dir,
+        embed_model=HashEmbedding(), rerank_model=None,
+    )
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        while not follower.load_latest():
+            time.sleep(poll_interval)
+    sync = ReplicaSync([follower], poll_interval).start()
+
+    app = Flask(__name__)
+
+    @app.route("/retrieve", methods=["POST"])
+    def retrieve():
+        nodes = follower.manager.retrieve_nodes(request.get_json()["query"])
+        return jsonify({"hits": len(nodes)})
+
+    @app.route("/replication", methods=["GET"])
+    def status():
+        return jsonify(sync.status()[0])
+
+    app.run(host="127.0.0.1", port=port, threaded=True)
+
+
+def start_replicas(n, replication_dir, workdir, poll_interval):
+    replicas = []
+    for i in range(n):
+        port = free_port()
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve-replica", str(port),
+             "--replication-dir", replication_dir, "--local-dir", os.path.join(workdir, f"replica-{n}-{i}"),
+             "--poll-interval", str(poll_interval)],
+            cwd=RAG_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        replicas.append((proc, f"http://127.0.0.1:{port}"))
+    for proc, url in replicas:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"Replica {url} exited with code {proc.returncode}")
+            try:
+                requests.get(url + "/replication", timeout=1).raise_for_status()
+                break
+            except requests.RequestException:
+                time.sleep(0.2)
+    return replicas
+
+
+def replica_seqs(urls):
+    seqs = []
+    for url in urls:
+        try:
+            seqs.append(requests.get(url + "/replication", timeout=1).json()["seq"])
+        except (requests.RequestException, ValueError, KeyError):
+            seqs.append(-1)
+    return seqs
+
+
+def run_load(urls, queries, concurrency, duration, publisher, manager, write_interval):
+    """
+    Closed-loop load spread round-robin over the replicas while the writer adds one
+    document every `write_interval` seconds. Returns throughput, latencies and the
+    time each write took to show up on all replicas.
+    """
+    from synthetic import synthetic_documents
+
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+    session = threading.local()
+
+    def client(worker):
+        s = session.__dict__.setdefault("s", requests.Session())
+        i = worker
+        while time.perf_counter() < stop_at:
+            url = urls[i % len(urls)]
+            start = time.perf_counter()
+            try:
+                s.post(url + "/retrieve", json={"query": queries[i % len(queries)]}, timeout=30).raise_for_status()
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+            except requests.RequestException:
+                with lock:
+                    errors[0] += 1
+            i += concurrency
+
+    staleness = []
+
+    def writer():
+        doc_no = 0
+        while time.perf_counter() + write_interval < stop_at:
+            time.sleep(write_interval)
+            doc = synthetic_documents(10, sentences_per_doc=10, seed=10_000 + doc_no)[0]
+            doc.metadata["email_id"] = f"replica-bench-{doc_no}"
+            doc_no += 1
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                manager.add_documents([doc])
+            written_seq, written_at = publisher.seq, time.perf_counter()
+            while time.perf_counter() < stop_at + 10:
+                if min(replica_seqs(urls)) >= written_seq:
+                    staleness.append(time.perf_counter() - written_at)
+                    break
+                time.sleep(0.02)
+
+    started = time.perf_counter()
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    writer_thread.start()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    writer_thread.join()
+
+    latencies.sort()
+    return {
+        "replicas": len(urls),
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput_rps": len(latencies) / elapsed,
+        "latency_p50_ms": 1000 * latencies[len(latencies) // 2] if latencies else None,
+        "latency_p95_ms": 1000 * latencies[int(len(latencies) * 0.95)] if latencies else None,
+        "writes": len(staleness),
+        "staleness_median_ms": 1000 * statistics.median(staleness) if staleness else None,
+        "staleness_max_ms": 1000 * max(staleness) if staleness else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read-replica throughput and staleness benchmark.")
+    parser.add_argument("--replicas", default="1,2,4", help="Comma separated replica counts.")
+    parser.add_argument("--sentences", type=int, default=20000, help="Sentence nodes in the writer's index.")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of load per replica count.")
+    parser.add_argument("--write-interval", type=float, default=1.0, help="Seconds between writes during the load.")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="Replica change-log poll interval.")
+    parser.add_argument("--snapshot-every", type=int, default=200)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--serve-replica", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--replication-dir", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--local-dir", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_replica:
+        serve_replica(args.serve_replica, args.replication_dir, args.local_dir, args.poll_interval)
+        return
+
+    from index_manager import IndexManager
+    from replication import IndexPublisher
+    from synthetic import HashEmbedding, synthetic_documents, synthetic_queries
+
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        replication_dir = os.path.join(workdir, "replication")
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            manager = IndexManager(INDEX_NAME, os.path.join(workdir, "writer"), window_size=WINDOW_SIZE,
+                                   embed_model=HashEmbedding(), rerank_model=None)
+            manager.add_documents(synthetic_documents(args.sentences))
+            publisher = IndexPublisher(manager, replication_dir, snapshot_every=args.snapshot_every)
+        queries = synthetic_queries(500)
+
+        for n in [int(s) for s in args.replicas.split(",")]:
+            print(f"{n} replica(s):", file=sys.stderr)
+            replicas = start_replicas(n, replication_dir, workdir, args.poll_interval)
+            try:
+                runs.append(run_load([url for _, url in replicas], queries, args.concurrency, args.duration,
+                                     publisher, manager, args.write_interval))
+            finally:
+                for proc, _ in replicas:
+                    proc.terminate()
+                    proc.wait()
+
+    print(f"{'replicas':>8} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'errors':>7} {'stale p50 ms':>13} {'stale max ms':>13}")
+    for r in runs:
+        print(f"{r['replicas']:>8} {r['throughput_rps']:>9.1f} {r['latency_p50_ms'] or 0:>9.1f} "
+              f"{r['latency_p95_ms'] or 0:>9.1f} {r['errors']:>7} {r['staleness_median_ms'] or 0:>13.1f} "
+              f"{r['staleness_max_ms'] or 0:>13.1f}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"sentences": args.sentences, "concurrency": args.concurrency, "runs": runs}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
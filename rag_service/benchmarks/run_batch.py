@@ -0,0 +1,75 @@
+# rag_service/benchmarks/run_batch.py
+#
+# Answers the benchmark questions through /query_batch and stores the results in
+# the evaluated_questions_* format. Re-running with the same --output resumes:
+# questions already in the JSON-lines file are not sent again.
+#
+#   python benchmarks/run_batch.py --output data/evaluation/batch_falcon.jsonl \
+#       --evaluated-dir data/evaluation/evaluated_questions_falcon_batch
+
+import argparse
+import json
+import os
+
+import requests
+
+DEFAULT_QUESTIONS = "data/evaluation/20250505_FELchat_benchmark_questions_v3.json"
+
+
+def completed_ids(output_path):
+    done = set()
+    if os.path.exists(output_path):
+        with open(output_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    done.add(str(json.loads(line)["id"]))
+                except (ValueError, KeyError):
+                    # A line cut short by a crash; the question is simply asked again.
+                    continue
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk question answering through /query_batch.")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS)
+    parser.add_argument("--output", required=True, help="JSON-lines result file (appended to, used for resume).")
+    parser.add_argument("--evaluated-dir", default=None, help="Also write one <id>.json per answer here.")
+    parser.add_argument("--max-workers", type=int, default=4, help="Concurrent LLM generations.")
+    parser.add_argument("--timeout", type=float, default=3600.0)
+    args = parser.parse_args()
+
+    with open(args.questions, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    done = completed_ids(args.output)
+    print(f"{len(done)} of {len(questions)} questions already answered")
+    if len(done) >= len(questions):
+        return
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    if args.evaluated_dir:
+        os.makedirs(args.evaluated_dir, exist_ok=True)
+
+    response = requests.post(
+        f"{args.url.rstrip('/')}/query_batch",
+        json={"questions": questions, "max_workers": args.max_workers, "completed_ids": sorted(done)},
+        stream=True,
+        timeout=args.timeout,
+    )
+    response.raise_for_status()
+
+    with open(args.output, "a", encoding="utf-8") as out:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            result = json.loads(line)
+            out.write(line + "\n")
+            out.flush()
+            if args.evaluated_dir:
+                with open(os.path.join(args.evaluated_dir, f"{result['id']}.json"), "w", encoding="utf-8") as f:
+                    json.dump(result, f, indent=4, ensure_ascii=False)
+            print(f"[{result['id']}] {result['timing']['rag_total_time_sec']:.2f}s {result['answer_generated'][:80]!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# rag_service/benchmarks/stub_llm_server.py
+#
+# Stand-in for server.py that answers /chat after a configurable delay, so the rag
+# service can be load tested without a GPU or model weights.
+#
+#   python benchmarks/stub_llm_server.py --latency 2.0
+#   python benchmarks/stub_llm_server.py --latency-from data/evaluation/evaluated_questions_llama
+#   python benchmarks/stub_llm_server.py --latency 2.0 --max-in-flight 1 --max-queue 4   # like server.py
+
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import time
+
+from flask import Flask, jsonify, request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from admission import AdmissionController, install_flask_admission, remaining  # noqa: E402
+from metrics import install_flask_metrics, record_stage  # noqa: E402
+
+
+def load_latency_samples(folder):
+    """
+    Uses the measured generation times of an evaluation run as the latency distribution.
+    """
+    samples = []
+    for path in glob.glob(os.path.join(folder, "*.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            timing = json.load(f).get("timing", {})
+        if "generation_time_sec" in timing:
+            samples.append(timing["generation_time_sec"])
+    if not samples:
+        raise SystemExit(f"No generation_time_sec samples found in {folder}")
+    return samples
+
+
+def create_app(latency, jitter, samples, prefill_fraction, max_in_flight=None, max_queue=0, generation_margin=0.5):
+    app = Flask(__name__)
+    install_flask_metrics(app)
+    if max_in_flight:
+        install_flask_admission(app, AdmissionController("llm", max_in_flight, max_queue), endpoints=("chat",))
+
+    @app.route("/chat", methods=["POST"])
+    def chat():
+        messages = request.get_json().get("prompt", [])
+        delay = random.choice(samples) if samples else max(0.0, random.gauss(latency, jitter))
+        # server.py stops generating when the caller's deadline is close
+        left = remaining()
+        truncated = left is not None and delay > left - generation_margin
+        if truncated:
+            delay = max(0.0, left - generation_margin)
+        time.sleep(delay)
+
+        record_stage("prefill", delay * prefill_fraction)
+        record_stage("decode", delay * (1 - prefill_fraction))
+        text = "".join(f"<|{m['role']}|>\n{m['content']}\n" for m in messages)
+        answer = text + "<|assistant|>\nYes, this is a stub answer (Article 1)(1)."
+        return jsonify({
+            "response": answer,
+            "truncated": truncated,
+            "timings": {"prefill_sec": delay * prefill_fraction, "decode_sec": delay * (1 - prefill_fraction)},
+        })
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in /chat server with configurable latency.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8003)
+    parser.add_argument("--latency", type=float, default=1.0, help="Mean fixed latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Std-dev of a normal jitter in seconds.")
+    parser.add_argument("--latency-from", default=None,
+                        help="Folder of evaluated_questions_* JSON files to sample latencies from.")
+    parser.add_argument("--prefill-fraction", type=float, default=0.1,
+                        help="Share of the delay reported as prefill time.")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="Admission control: concurrent /chat requests (default: unlimited).")
+    parser.add_argument("--max-queue", type=int, default=8, help="Admission control: waiting requests.")
+    args = parser.parse_args()
+
+    samples = load_latency_samples(args.latency_from) if args.latency_from else None
+    app = create_app(args.latency, args.jitter, samples, args.prefill_fraction, args.max_in_flight, args.max_queue)
+    print(f"Stub LLM server on {args.host}:{args.port}")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# rag_service/benchmarks/synthetic.py
+#
+# Deterministic synthetic corpus and embedder for offline benchmarks.
+
+import hashlib
+import random
+import re
+
+import numpy as np
+from llama_index.core import Document
+from llama_index.core.embeddings import BaseEmbedding
+
+SUBJECTS = [
+    "The student", "The Dean", "The examiner", "The faculty", "The Rector", "The supervisor",
+    "The study department", "The Academic Senate", "The guarantor of the programme", "The applicant",
+]
+VERBS = [
+    "shall submit", "may request", "is entitled to", "must complete", "shall decide on",
+    "may postpone", "shall announce", "is obliged to register", "may repeat", "shall evaluate",
+]
+OBJECTS = [
+    "the final state examination", "an individual study plan", "the recognition of credits",
+    "the enrolment in the next semester", "a written application", "the doctoral thesis",
+    "the assessment of the subject", "an interruption of studies", "the scholarship payment",
+    "the timetable of the examination period", "a complaint against the decision",
+]
+CONDITIONS = [
+    "within 30 days of the decision", "no later than the end of the examination period",
+    "in accordance with Article {article}", "after consulting the supervisor",
+    "unless the internal regulation stipulates otherwise", "in the form of a written request",
+    "at the latest by 31 October", "during the standard period of study",
+]
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def regulation_sentence(rng: random.Random, article: int) -> str:
+    condition = rng.choice(CONDITIONS).format(article=rng.randint(1, article + 1))
+    return f"{rng.choice(SUBJECTS)} {rng.choice(VERBS)} {rng.choice(OBJECTS)} {condition}."
+
+
+def synthetic_records(n_sentences: int, sentences_per_doc: int = 50, seed: int = 0):
+    """
+    Yields Q/A records shaped like the JSON files load_json_documents expects,
+    whose answers add up to `n_sentences` regulation-like sentences.
+    """
+    rng = random.Random(seed)
+    n_docs = max(1, n_sentences // sentences_per_doc)
+    for doc_no in range(n_docs):
+        article = doc_no + 1
+        sentences = [f"({i + 1}) {regulation_sentence(rng, article)}" for i in range(sentences_per_doc)]
+        yield {
+            "question": f"What does Article {article} of the synthetic code regulate?",
+            "answer": " ".join(sentences),
+            "email_id": f"synthetic-{doc_no}",
+            "timestamp": f"2025-01-01T00:00:{doc_no % 60:02d}",
+        }
+
+
+def synthetic_documents(n_sentences: int, sentences_per_doc: int = 50, seed: int = 0):
+    return [
+        Document(
+            text=f"Q: {r['question']}\nA: {r['answer']}",
+            metadata={"email_id": r["email_id"], "timestamp": r["timestamp"]},
+        )
+        for r in synthetic_records(n_sentences, sentences_per_doc, seed)
+    ]
+
+
+def synthetic_queries(n: int, seed: int = 1):
+    rng = random.Random(seed)
+    return [regulation_sentence(rng, rng.randint(1, 100)) for _ in range(n)]
+
+
+class HashEmbedding(BaseEmbedding):
+    """
+    Deterministic bag-of-hashed-words embedder. Similar texts get similar vectors,
+    which is enough to exercise retrieval without downloading a model.
+    """
+
+    dim: int = 384
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashEmbedding"
+
+    def _embed(self, text: str) -> list:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in _TOKEN_RE.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def _get_query_embedding(self, query: str) -> list:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> list:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> list:
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts: list) -> list:
+        return [self._embed(text) for text in texts]
@@ -0,0 +1,277 @@
+# rag_service/benchmarks/tune_adaptive_retrieval.py
+#
+# Tunes the "adaptive_retrieval" thresholds on the benchmark questions and checks
+# the tuned policy for latency and accuracy.
+#
+#   python benchmarks/tune_adaptive_retrieval.py --output data/benchmarks/adaptive_retrieval.json
+#   python benchmarks/tune_adaptive_retrieval.py --write-config
+#   python benchmarks/tune_adaptive_retrieval.py --embedder hash --build-from data/PDF   # offline smoke run
+#
+# Every question is first profiled once: the dense scores of the normal search and
+# the timing and resulting top-n of each variant (no rerank, short rerank, full
+# rerank, widened search + full rerank). A grid of thresholds is then evaluated on
+# those profiles, and the fastest setting that stays within the accuracy limits is
+# run for real. Without an LLM in the loop, accuracy means (1) agreement of the
+# final top-n context with the fixed pipeline (top-k search + full rerank) and
+# (2) out-of-scope detection against the questions' out_of_scope labels.
+
+import argparse
+import contextlib
+import glob
+import itertools
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+RAG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAG_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_QUESTIONS = "data/evaluation/20250505_FELchat_benchmark_questions_v3.json"
+DEFAULT_EVALUATED = "data/evaluation/evaluated_questions_falcon"
+CONFIG_PATH = "data/configuration/config.json"
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def median_generation_sec(folder):
+    times = []
+    for path in glob.glob(os.path.join(folder, "*.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            timing = json.load(f).get("timing") or {}
+        if "generation_time_sec" in timing:
+            times.append(timing["generation_time_sec"])
+    return statistics.median(times) if times else 0.0
+
+
+def build_indexes(args, config):
+    from index_federation import FederatedIndex
+    from index_manager import RERANK_MODEL_NAME, IndexManager
+
+    rerank_model = None if args.rerank_model == "none" else (args.rerank_model or RERANK_MODEL_NAME)
+    if args.embedder == "hash" and args.rerank_model is None:
+        rerank_model = None  # the offline mode must not download the cross-encoder either
+    embed_model = None
+    if args.embedder == "hash":
+        from synthetic import HashEmbedding
+        embed_model = HashEmbedding()
+
+    if not args.build_from:
+        indexes = FederatedIndex.from_config(config, embed_model=embed_model, rerank_model=rerank_model)
+        return indexes, None
+
+    workdir = tempfile.mkdtemp(prefix="tune-adaptive-")
+    source = os.path.join(workdir, "in")
+    shutil.copytree(args.build_from, source)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        manager = IndexManager("tune", workdir, window_size=3, embed_model=embed_model, rerank_model=None,
+                               dedup=config.get("dedup"))
+        manager.add_pdfs_to_index(source, os.path.join(workdir, "done"))
+    retrieval = config.get("retrieval", {})
+    indexes = FederatedIndex({"tune": manager}, rerank_model=rerank_model,
+                             rerank_top_n=retrieval.get("rerank_top_n", 4),
+                             max_candidates=retrieval.get("max_candidates"))
+    return indexes, workdir
+
+
+def _ids(nodes):
+    return [n.node.node_id for n in nodes]
+
+
+def profile(indexes, question, widen_factor, short_candidates):
+    """
+    Times every retrieval variant of one question and records its top-n node ids.
+    """
+    from llama_index.core.schema import QueryBundle
+
+    bundle = QueryBundle(query_str=question)
+    top_n = indexes.reranker.top_n if indexes.reranker is not None else None
+    timing, ids = {}, {}
+
+    t0 = time.perf_counter()
+    embeddings = indexes._query_embeddings([question])
+    timing["embed"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    per_index = indexes._search(question, embeddings)
+    timing["search"] = time.perf_counter() - t0
+    scores = indexes.raw_scores(per_index)
+    merged = indexes._merge(per_index)
+    timing["skip_rerank"], ids["skip_rerank"] = 0.0, _ids(merged[:top_n])
+
+    for variant, candidates in (("full", merged), ("short_rerank", merged[:short_candidates])):
+        t0 = time.perf_counter()
+        reranked = indexes.reranker.postprocess_nodes(list(candidates), query_bundle=bundle) if top_n else merged
+        timing[variant] = time.perf_counter() - t0
+        ids[variant] = _ids(reranked)
+
+    t0 = time.perf_counter()
+    wide = indexes._merge(indexes._search(question, embeddings, widen_factor), widen_factor)
+    reranked = indexes.reranker.postprocess_nodes(wide, query_bundle=bundle) if top_n else wide
+    timing["widen"] = time.perf_counter() - t0
+    ids["widen"] = _ids(reranked)
+    return {"scores": scores, "timing": timing, "ids": ids}
+
+
+def simulate(policy, profiles, questions, llm_sec):
+    """
+    Expected latency and accuracy of `policy` from the recorded profiles.
+    """
+    latencies, overlaps, top1, actions = [], [], [], {}
+    false_rejects = oos_hits = 0
+    for p, q in zip(profiles, questions):
+        decision = policy._decide(p["scores"])
+        actions[decision.action] = actions.get(decision.action, 0) + 1
+        t = p["timing"]
+        latency = t["embed"] + t["search"]
+        if decision.action == "out_of_scope":
+            if q.get("out_of_scope"):
+                oos_hits += 1
+            else:
+                false_rejects += 1
+            latencies.append(latency)
+            continue
+        latency += t[decision.action] + llm_sec
+        latencies.append(latency)
+        if not q.get("out_of_scope"):
+            base, got = p["ids"]["full"], p["ids"][decision.action]
+            overlaps.append(len(set(base) & set(got)) / max(1, len(base)))
+            top1.append(bool(base) and bool(got) and base[0] == got[0])
+
+    in_scope = sum(1 for q in questions if not q.get("out_of_scope"))
+    out_of_scope = len(questions) - in_scope
+    return {
+        "mean_latency_sec": statistics.mean(latencies),
+        "context_agreement": statistics.mean(overlaps) if overlaps else 1.0,
+        "top1_agreement": statistics.mean(top1) if top1 else 1.0,
+        "false_reject_rate": false_rejects / in_scope if in_scope else 0.0,
+        "out_of_scope_recall": oos_hits / out_of_scope if out_of_scope else 0.0,
+        "actions": actions,
+    }
+
+
+def candidate_grid(profiles, base_config):
+    best = [p["scores"][0] for p in profiles if p["scores"]]
+    margins = [p["scores"][0] - p["scores"][1] for p in profiles if len(p["scores"]) > 1]
+    spreads = [p["scores"][0] - p["scores"][-1] for p in profiles if len(p["scores"]) > 1]
+
+    def levels(values, pcts):
+        return [None] + sorted({round(percentile(values, pct), 4) for pct in pcts}) if values else [None]
+
+    for oos, skip, short, flat in itertools.product(
+        levels(best, (2, 5, 8, 10, 15)),
+        levels(margins, (50, 70, 80, 90, 95)),
+        levels(margins, (30, 40, 50, 60, 70)),
+        levels(spreads, (2, 5, 10)),
+    ):
+        if skip is not None and short is not None and short >= skip:
+            continue
+        yield {**base_config, "enabled": True, "out_of_scope_score": oos, "skip_rerank_margin": skip,
+               "short_rerank_margin": short, "flat_spread": flat}
+
+
+def validate(indexes, questions, profiles):
+    """
+    Runs the installed policy for real and compares with the fixed pipeline.
+    """
+    latencies, overlaps = [], []
+    for q, p in zip(questions, profiles):
+        t0 = time.perf_counter()
+        nodes, decision = indexes.retrieve_nodes_explained(q["question"])
+        latencies.append(time.perf_counter() - t0)
+        if decision.action != "out_of_scope" and not q.get("out_of_scope"):
+            base = p["ids"]["full"]
+            overlaps.append(len(set(base) & set(_ids(nodes))) / max(1, len(base)))
+    baseline = [p["timing"]["embed"] + p["timing"]["search"] + p["timing"]["full"] for p in profiles]
+    return {
+        "retrieval_p50_ms": 1000 * percentile(latencies, 50),
+        "retrieval_p95_ms": 1000 * percentile(latencies, 95),
+        "baseline_retrieval_p50_ms": 1000 * percentile(baseline, 50),
+        "baseline_retrieval_p95_ms": 1000 * percentile(baseline, 95),
+        "context_agreement": statistics.mean(overlaps) if overlaps else 1.0,
+        "actions": indexes.policy.metrics(),
+    }
+
+
+def main():
+    from adaptive_retrieval import DEFAULT_ADAPTIVE_CONFIG, AdaptiveRetrievalPolicy
+
+    parser = argparse.ArgumentParser(description="Tune the adaptive retrieval policy on the benchmark questions.")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS)
+    parser.add_argument("--embedder", choices=["config", "hash"], default="config")
+    parser.add_argument("--rerank-model", default=None, help="Cross-encoder name, or 'none'.")
+    parser.add_argument("--build-from", default=None, help="Build a throwaway index from this PDF folder.")
+    parser.add_argument("--llm-sec", type=float, default=None,
+                        help="LLM time saved by an out-of-scope answer (default: median of the falcon evaluation).")
+    parser.add_argument("--min-context-agreement", type=float, default=0.9)
+    parser.add_argument("--max-false-reject", type=float, default=0.02)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--write-config", action="store_true", help=f"Store the tuned thresholds in {CONFIG_PATH}.")
+    args = parser.parse_args()
+
+    os.chdir(RAG_DIR)
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    with open(args.questions, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    llm_sec = args.llm_sec if args.llm_sec is not None else median_generation_sec(DEFAULT_EVALUATED)
+    base_config = {**DEFAULT_ADAPTIVE_CONFIG, **config.get("adaptive_retrieval", {})}
+
+    indexes, workdir = build_indexes(args, config)
+    indexes.policy = None
+    try:
+        indexes.retrieve_nodes(questions[0]["question"])  # warm-up
+        profiles = [
+            profile(indexes, q["question"], base_config["widen_factor"], base_config["short_rerank_candidates"])
+            for q in questions
+        ]
+
+        fixed = simulate(AdaptiveRetrievalPolicy({"enabled": False}), profiles, questions, llm_sec)
+        best = None
+        for candidate in candidate_grid(profiles, base_config):
+            result = simulate(AdaptiveRetrievalPolicy(candidate), profiles, questions, llm_sec)
+            if (result["context_agreement"] < args.min_context_agreement
+                    or result["false_reject_rate"] > args.max_false_reject):
+                continue
+            key = (result["mean_latency_sec"], -result["out_of_scope_recall"])
+            if best is None or key < best[0]:
+                best = (key, candidate, result)
+        if best is None:
+            print("No setting meets the accuracy limits; keeping the current configuration.", file=sys.stderr)
+            tuned, expected = base_config, simulate(AdaptiveRetrievalPolicy(base_config), profiles, questions, llm_sec)
+        else:
+            _, tuned, expected = best
+
+        indexes.policy = AdaptiveRetrievalPolicy(tuned)
+        measured = validate(indexes, questions, profiles)
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"llm_sec": llm_sec, "fixed_pipeline": fixed, "tuned": tuned, "expected": expected, "measured": measured}
+    print(json.dumps({"tuned": tuned, "expected": expected, "measured": measured}, indent=2))
+    print(f"mean latency incl. LLM: {fixed['mean_latency_sec']:.3f}s fixed -> {expected['mean_latency_sec']:.3f}s adaptive; "
+          f"retrieval p50 {measured['baseline_retrieval_p50_ms']:.1f} -> {measured['retrieval_p50_ms']:.1f} ms")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.write_config:
+        config["adaptive_retrieval"] = tuned
+        with open(CONFIG_PATH, "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
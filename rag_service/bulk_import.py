@@ -0,0 +1,217 @@
+# rag_service/bulk_import.py
+#
+# Streaming import of large Q/A and email corpora: one record per line of a JSONL
+# file (optionally gzip-compressed), each shaped like the JSON files in in_database
+# ("question" + "answer" or "information", plus "email_id" and "timestamp").
+#
+#   python bulk_import.py mailbox.jsonl.gz --index index_email
+#
+# Lines are read one at a time and added in fixed-size batches, so memory does not
+# grow with the file (only the index does). Progress is checkpointed next to the
+# source each time the index is persisted; running the same command again after a
+# crash resumes from the last checkpoint. Do not run this against an index the rag
+# service has open - use POST /indexes/<name>/import on the running service instead.
+
+import argparse
+import gzip
+import json
+import os
+import threading
+import time
+
+from index_manager import record_to_document
+
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+REJECTS_SUFFIX = ".rejects.jsonl"
+
+
+def open_source(path):
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+    return gzip.open(path, "rb") if compressed else open(path, "rb")
+
+
+def _write_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class BulkImport:
+    """
+    Imports one JSONL source into an IndexManager in batches of `batch_size`
+    documents, persisting the index and writing a checkpoint (offset into the
+    uncompressed stream, line number, counters) every `persist_every` documents.
+
+    Documents get the id "<source file name>#<line number>", so on resume the nodes
+    of lines after the checkpoint - persisted just before a crash, without their
+    checkpoint - are found and removed before those lines are imported again (and
+    importing a file again from scratch replaces what its earlier import added).
+    Invalid lines are skipped and written, with the reason, to the rejects file.
+    """
+
+    def __init__(self, manager, source, batch_size=256, persist_every=4096, checkpoint_path=None,
+                 rejects_path=None):
+        self.manager = manager
+        self.source = os.path.abspath(source)
+        self.import_id = os.path.basename(source)
+        self.batch_size = batch_size
+        self.persist_every = max(persist_every, batch_size)
+        self.checkpoint_path = checkpoint_path or self.source + CHECKPOINT_SUFFIX
+        self.rejects_path = rejects_path or self.source + REJECTS_SUFFIX
+        self.state = self._load_checkpoint()
+        self.started_at = None
+        self.error = None
+        self.thread = None
+
+    def _load_checkpoint(self) -> dict:
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("source") == self.source and state.get("index") == self.manager.index_name:
+                return state
+            print(f"[bulk_import] Ignoring checkpoint {self.checkpoint_path} of another import")
+        except (OSError, ValueError):
+            pass
+        return {"source": self.source, "index": self.manager.index_name, "offset": 0, "line": 0,
+                "imported": 0, "rejected": 0, "rejects_offset": 0, "done": False}
+
+    def _discard_uncommitted(self):
+        prefix = self.import_id + "#"
+        committed_line = self.state["line"]
+        with self.manager.lock:
+            node_ids = [
+                node_id for node_id, node in self.manager.index.docstore.docs.items()
+                if (node.ref_doc_id or "").startswith(prefix)
+                and node.ref_doc_id[len(prefix):].isdigit()
+                and int(node.ref_doc_id[len(prefix):]) > committed_line
+            ]
+        if node_ids:
+            removed = self.manager.remove_node_ids(node_ids)
+            print(f"[bulk_import] Removed {removed} nodes imported after the last checkpoint")
+
+    def _commit(self, offset, line, imported, rejected, rejects):
+        self.manager.persist()
+        rejects.flush()
+        self.state.update(offset=offset, line=line, imported=imported, rejected=rejected,
+                          rejects_offset=rejects.tell(), updated_at=time.time())
+        _write_atomic(self.checkpoint_path, self.state)
+
+    def run(self) -> dict:
+        if self.state["done"]:
+            print(f"[bulk_import] {self.source} was already imported into {self.manager.index_name}")
+            return self.status()
+        self.started_at = time.time()
+        self._discard_uncommitted()
+        offset, line = self.state["offset"], self.state["line"]
+        imported, rejected = self.state["imported"], self.state["rejected"]
+
+        with open_source(self.source) as source, open(self.rejects_path, "a", encoding="utf-8") as rejects:
+            # Rejects written after the checkpoint are written again on this run
+            rejects.truncate(self.state["rejects_offset"])
+            source.seek(offset)
+            batch, since_commit = [], 0
+            for raw in source:
+                line += 1
+                offset += len(raw)
+                if not raw.strip():
+                    continue
+                try:
+                    batch.append(record_to_document(json.loads(raw), doc_id=f"{self.import_id}#{line}"))
+                except ValueError as e:
+                    rejected += 1
+                    rejects.write(json.dumps({"line": line, "error": str(e)}) + "\n")
+                    continue
+
+                if len(batch) >= self.batch_size:
+                    self.manager.add_documents(batch, persist=False)
+                    imported += len(batch)
+                    since_commit += len(batch)
+                    batch = []
+                    if since_commit >= self.persist_every:
+                        self._commit(offset, line, imported, rejected, rejects)
+                        since_commit = 0
+                        print(f"[bulk_import] line {line}: {imported} imported, {rejected} rejected")
+
+            if batch:
+                self.manager.add_documents(batch, persist=False)
+                imported += len(batch)
+            self.state["done"] = True
+            self._commit(offset, line, imported, rejected, rejects)
+
+        print(f"[bulk_import] Finished {self.source}: {imported} imported, {rejected} rejected "
+              f"in {time.time() - self.started_at:.1f}s")
+        return self.status()
+
+    def start(self) -> threading.Thread:
+        """
+        Runs the import on a background thread; progress is visible in status().
+        """
+        def target():
+            try:
+                self.run()
+            except Exception as e:
+                self.error = str(e)
+                print(f"[bulk_import] {self.source} failed: {e}")
+
+        self.thread = threading.Thread(target=target, name=f"bulk-import-{self.manager.index_name}", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def status(self) -> dict:
+        return {
+            "source": self.source,
+            "index": self.manager.index_name,
+            "checkpoint_line": self.state["line"],
+            "imported": self.state["imported"],
+            "rejected": self.state["rejected"],
+            "done": self.state["done"],
+            "running": self.running(),
+            "error": self.error,
+            "rejects": self.rejects_path,
+        }
+
+
+def main():
+    from index_manager import IndexManager
+
+    parser = argparse.ArgumentParser(description="Streaming JSONL(.gz) import into a rag service index.")
+    parser.add_argument("source", help="JSONL file, optionally gzip-compressed.")
+    parser.add_argument("--config", default="data/configuration/config.json")
+    parser.add_argument("--index", default=None, help="Index name (default: the index that ingests JSON).")
+    parser.add_argument("--batch-size", type=int, default=256, help="Documents per parse/embed batch.")
+    parser.add_argument("--persist-every", type=int, default=4096, help="Documents between checkpoints.")
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--rejects", default=None)
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    index_configs = config.get("indexes") or [config["index"]]
+    if args.index:
+        matching = [c for c in index_configs if c["name"] == args.index]
+        if not matching:
+            parser.error(f"Index {args.index} is not configured in {args.config}")
+        index_config = matching[0]
+    else:
+        index_config = next((c for c in index_configs if "json" in c.get("ingest", ())), index_configs[0])
+
+    manager = IndexManager(
+        index_name=index_config["name"],
+        index_dir=index_config["directory"],
+        window_size=index_config["window_size"],
+        rerank_model=None,
+        dedup=index_config.get("dedup", config.get("dedup")),
+        reduced=index_config.get("reduced_index", config.get("reduced_index")),
+    )
+    BulkImport(manager, args.source, args.batch_size, args.persist_every, args.checkpoint, args.rejects).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+# rag_service/dedup.py
+#
+# Near-duplicate detection for IndexManager's ingest path, at two levels:
+#
+#   document  MinHash over word shingles, LSH banding for candidates; a document
+#             whose estimated Jaccard similarity to an indexed one reaches
+#             document_threshold is skipped before it is parsed or embedded
+#             (e.g. StatuteCTU.pdf vs StatuteCTU_highlighted.pdf).
+#   window    64-bit SimHash over word 3-grams of each sentence window (word order
+#             counts, so windows that merely share vocabulary stay apart); a node
+#             whose window is within window_max_distance bits of a window of
+#             another document is skipped.
+#
+# Every skipped document or node is appended to the report (JSONL) together with
+# what it duplicates.
+
+import hashlib
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+DEFAULT_DEDUP_CONFIG = {
+    "enabled": True,
+    "document_threshold": 0.9,
+    "shingle_size": 5,
+    "num_perm": 128,
+    "bands": 32,
+    "window_shingle_size": 3,
+    "window_max_distance": 3,
+    "min_window_tokens": 8,
+    # Shorter documents (e.g. blank PDF pages) are neither checked nor remembered
+    "min_document_tokens": 8,
+    "report": "data/dedup/report.jsonl",
+}
+
+_TOKEN_RE = re.compile(r"\w+")
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def _tokens(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _shingles(words, size):
+    return [" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))]
+
+
+def _hash64(items):
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in items),
+        dtype=np.uint64,
+    )
+
+
+def _describe(node_or_doc):
+    metadata = node_or_doc.metadata
+    for key in ("file_name", "email_id"):
+        if key in metadata:
+            return {key: metadata[key]}
+    return {"id": getattr(node_or_doc, "ref_doc_id", None) or node_or_doc.node_id}
+
+
+class MinHasher:
+    """
+    MinHash signatures of word-shingle sets; the fraction of equal signature
+    slots estimates the Jaccard similarity of two texts.
+    """
+
+    def __init__(self, num_perm=128, shingle_size=5, seed=1):
+        rng = np.random.RandomState(seed)
+        self.shingle_size = shingle_size
+        self.a = rng.randint(1, 1 << 61, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 61, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = _hash64(set(_shingles(_tokens(text), self.shingle_size))) & _MAX_HASH
+        # Wrapping uint64 arithmetic is intended here
+        with np.errstate(over="ignore"):
+            permuted = ((hashes[:, None] * self.a + self.b) % _MERSENNE_PRIME) & _MAX_HASH
+        return permuted.min(axis=0)
+
+
+def simhash(text, shingle_size=3) -> int:
+    words = _tokens(text)
+    if not words:
+        return 0
+    shingles = _shingles(words, shingle_size)
+    bits = np.unpackbits(_hash64(shingles).view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    weights = bits.sum(axis=0).astype(np.int64) * 2 - len(shingles)
+    return int.from_bytes(np.packbits(weights > 0, bitorder="little").tobytes(), "little")
+
+
+class NearDuplicateDetector:
+    """
+    Remembers the documents and sentence windows of one index and filters new
+    ones that nearly duplicate them (or each other). Built from the docstore on
+    first use; IndexManager drops it when nodes are deleted.
+    """
+
+    def __init__(self, index_name, config=None):
+        self.index_name = index_name
+        self.config = {**DEFAULT_DEDUP_CONFIG, **(config or {})}
+        self.minhasher = MinHasher(self.config["num_perm"], self.config["shingle_size"])
+        self.rows = self.config["num_perm"] // self.config["bands"]
+        self.max_distance = self.config["window_max_distance"]
+        self.block_bits = 64 // (self.max_distance + 1)
+        self.doc_signatures = {}  # document key -> (signature, description)
+        self.doc_buckets = {}     # (band, band bytes) -> [document key]
+        self.window_tables = [{} for _ in range(self.max_distance + 1)]  # block -> [(simhash, node, ref_doc_id)]
+        self.skipped_documents = 0
+        self.skipped_nodes = 0
+
+    @classmethod
+    def from_nodes(cls, index_name, config, nodes):
+        detector = cls(index_name, config)
+        documents = {}
+        for node in nodes:
+            documents.setdefault(node.ref_doc_id, []).append(node)
+        for ref_doc_id, doc_nodes in documents.items():
+            text = " ".join(n.metadata.get("original_sentence", n.get_content()) for n in doc_nodes)
+            if len(_tokens(text)) >= detector.config["min_document_tokens"]:
+                detector._add_document(ref_doc_id, detector.minhasher.signature(text), _describe(doc_nodes[0]))
+            for node in doc_nodes:
+                detector._add_window(node)
+        return detector
+
+    def _bands(self, signature):
+        for band in range(self.config["bands"]):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _add_document(self, key, signature, description):
+        self.doc_signatures[key] = (signature, description)
+        for band_key in self._bands(signature):
+            self.doc_buckets.setdefault(band_key, []).append(key)
+
+    def _similar_document(self, signature):
+        candidates = {key for band_key in self._bands(signature) for key in self.doc_buckets.get(band_key, ())}
+        best = None
+        for key in candidates:
+            other, description = self.doc_signatures[key]
+            similarity = float(np.mean(signature == other))
+            if similarity >= self.config["document_threshold"] and (best is None or similarity > best[0]):
+                best = (similarity, description)
+        return best
+
+    def _blocks(self, value):
+        mask = (1 << self.block_bits) - 1
+        return [(value >> (i * self.block_bits)) & mask for i in range(self.max_distance + 1)]
+
+    def _window_text(self, node):
+        return node.metadata.get("window", node.get_content())
+
+    def _add_window(self, node):
+        text = self._window_text(node)
+        if len(_tokens(text)) < self.config["min_window_tokens"]:
+            return
+        value = simhash(text, self.config["window_shingle_size"])
+        entry = (value, node.node_id, node.ref_doc_id)
+        for table, block in zip(self.window_tables, self._blocks(value)):
+            table.setdefault(block, []).append(entry)
+
+    def _similar_window(self, node):
+        text = self._window_text(node)
+        if len(_tokens(text)) < self.config["min_window_tokens"]:
+            return None
+        value = simhash(text, self.config["window_shingle_size"])
+        for table, block in zip(self.window_tables, self._blocks(value)):
+            for other, node_id, ref_doc_id in table.get(block, ()):
+                # Neighbouring windows of one document overlap by design
+                if ref_doc_id != node.ref_doc_id and (value ^ other).bit_count() <= self.max_distance:
+                    return node_id, (value ^ other).bit_count()
+        return None
+
+    def filter_documents(self, docs):
+        """
+        Drops documents that nearly duplicate an indexed or earlier document of the batch.
+        The kept ones are remembered at once; if they then fail to be indexed, the
+        caller must drop the detector.
+        """
+        kept, report = [], []
+        for doc in docs:
+            if len(_tokens(doc.get_content())) < self.config["min_document_tokens"]:
+                kept.append(doc)
+                continue
+            signature = self.minhasher.signature(doc.get_content())
+            match = self._similar_document(signature)
+            if match is not None:
+                report.append({"level": "document", "skipped": _describe(doc),
+                               "duplicate_of": match[1], "similarity": round(match[0], 3)})
+                continue
+            self._add_document(doc.doc_id, signature, _describe(doc))
+            kept.append(doc)
+        self.skipped_documents += len(report)
+        self._write_report(report)
+        return kept
+
+    def filter_nodes(self, nodes):
+        """
+        Drops sentence-window nodes whose window nearly duplicates one of another document.
+        """
+        kept, report = [], []
+        for node in nodes:
+            match = self._similar_window(node)
+            if match is not None:
+                report.append({"level": "window", "skipped": {**_describe(node), "node_id": node.node_id},
+                               "duplicate_of": {"node_id": match[0]}, "distance": match[1]})
+                continue
+            self._add_window(node)
+            kept.append(node)
+        self.skipped_nodes += len(report)
+        self._write_report(report)
+        return kept
+
+    def _write_report(self, entries):
+        path = self.config.get("report")
+        if not entries or not path:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        now = time.time()
+        with open(path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps({"ts": now, "index": self.index_name, **entry}, ensure_ascii=False) + "\n")
+        print(f"[dedup] {self.index_name}: skipped {len(entries)} near-duplicate {entries[0]['level']}(s)")
+
+    def stats(self) -> dict:
+        return {
+            "documents": len(self.doc_signatures),
+            "skipped_documents": self.skipped_documents,
+            "skipped_nodes": self.skipped_nodes,
+        }
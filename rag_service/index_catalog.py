@@ -0,0 +1,172 @@
+# rag_service/index_catalog.py
+
+import json
+import os
+import sqlite3
+
+CATALOG_FILE = "catalog.sqlite3"
+MAX_PAGE_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    node_id TEXT NOT NULL UNIQUE,
+    ref_doc_id TEXT,
+    email_id TEXT,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS nodes_email_id ON nodes (email_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS nodes_fts USING fts5(text, content='nodes', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS nodes_ai AFTER INSERT ON nodes BEGIN
+    INSERT INTO nodes_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS nodes_ad AFTER DELETE ON nodes BEGIN
+    INSERT INTO nodes_fts (nodes_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+
+def _fts_query(text):
+    # Every word must occur; quoting keeps FTS5 operators in user input literal.
+    words = text.split()
+    return " ".join('"' + word.replace('"', '""') + '"' for word in words)
+
+
+def _node_dict(row):
+    return {
+        "node_id": row["node_id"],
+        "ref_doc_id": row["ref_doc_id"],
+        "text": row["text"],
+        "metadata": json.loads(row["metadata"]),
+    }
+
+
+def _row(node):
+    return (
+        node.node_id,
+        node.ref_doc_id,
+        node.metadata.get("email_id"),
+        node.get_content(),
+        json.dumps(node.metadata, ensure_ascii=False),
+    )
+
+
+class IndexCatalog:
+    """
+    SQLite sidecar next to a persisted index that lists its nodes (id, text,
+    metadata) with full-text search. IndexManager keeps it in step with the
+    docstore; browsers read single pages from it without loading the index.
+    """
+
+    def __init__(self, index_path, read_only=False):
+        self.path = os.path.join(index_path, CATALOG_FILE)
+        self.read_only = read_only
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _connect(self, path=None) -> sqlite3.Connection:
+        if self.read_only:
+            connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        else:
+            connection = sqlite3.connect(path or self.path)
+            connection.executescript(_SCHEMA)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def replace_all(self, nodes):
+        """
+        Rebuilds the catalog from scratch in a temporary file that is swapped in
+        atomically, so readers never see a half-written catalog.
+        """
+        tmp_path = self.path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = self._connect(tmp_path)
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT INTO nodes (node_id, ref_doc_id, email_id, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                    (_row(node) for node in nodes),
+                )
+        finally:
+            connection.close()
+        os.replace(tmp_path, self.path)
+
+    def upsert(self, nodes):
+        connection = self._connect()
+        try:
+            with connection:
+                rows = [_row(node) for node in nodes]
+                # Delete + insert rather than REPLACE, so the FTS triggers see both sides.
+                connection.executemany("DELETE FROM nodes WHERE node_id = ?", [(r[0],) for r in rows])
+                connection.executemany(
+                    "INSERT INTO nodes (node_id, ref_doc_id, email_id, text, metadata) VALUES (?, ?, ?, ?, ?)", rows
+                )
+        finally:
+            connection.close()
+
+    def delete(self, node_ids):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany("DELETE FROM nodes WHERE node_id = ?", [(n,) for n in node_ids])
+        finally:
+            connection.close()
+
+    def count(self) -> int:
+        if not self.exists():
+            return 0
+        connection = self._connect()
+        try:
+            return connection.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+        finally:
+            connection.close()
+
+    def list_nodes(self, limit=50, cursor=None, query=None, filters=None):
+        """
+        One page of nodes in insertion order. `cursor` is the value returned as
+        next_cursor by the previous page; `query` is a full-text search over the
+        node text and `filters` ({metadata key: value}) must all match exactly.
+        Returns (nodes, next_cursor); next_cursor is None on the last page.
+        """
+        if not self.exists():
+            return [], None
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        sql = "SELECT nodes.id, node_id, ref_doc_id, nodes.text, metadata FROM nodes"
+        where, params = ["nodes.id > ?"], [int(cursor or 0)]
+        if query and query.strip():
+            sql += " JOIN nodes_fts ON nodes_fts.rowid = nodes.id"
+            where.append("nodes_fts MATCH ?")
+            params.append(_fts_query(query))
+        for key, value in (filters or {}).items():
+            if key == "email_id":
+                where.append("email_id = ?")
+            else:
+                where.append("CAST(json_extract(metadata, ?) AS TEXT) = ?")
+                params.append(f'$."{key}"')
+            params.append(str(value))
+        sql += " WHERE " + " AND ".join(where) + " ORDER BY nodes.id LIMIT ?"
+        params.append(limit + 1)
+
+        connection = self._connect()
+        try:
+            rows = connection.execute(sql, params).fetchall()
+        finally:
+            connection.close()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return [_node_dict(row) for row in rows], (rows[-1]["id"] if has_more else None)
+
+    def get_node(self, node_id):
+        if not self.exists():
+            return None
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT node_id, ref_doc_id, text, metadata FROM nodes WHERE node_id = ?", (node_id,)
+            ).fetchone()
+        finally:
+            connection.close()
+        return _node_dict(row) if row is not None else None
@@ -0,0 +1,286 @@
+# rag_service/index_federation.py
+
+from concurrent.futures import ThreadPoolExecutor
+
+from llama_index.core.schema import QueryBundle
+
+from adaptive_retrieval import FULL, AdaptiveRetrievalPolicy
+from index_manager import RERANK_MODEL_NAME, IndexManager, get_reranker, rerank_nodes_batch
+from metrics import current_request_id, merge_timings, run_in_request, span
+from trace_log import note
+
+INDEX_NAME_KEY = "index_name"
+
+
+def normalize_scores(nodes):
+    """
+    Min-max normalises similarity scores within one index's hits, so indexes whose
+    raw scores live on different scales can be merged. A single hit (or all-equal
+    scores) gets 1.0.
+    """
+    if not nodes:
+        return nodes
+    scores = [n.score or 0.0 for n in nodes]
+    low, high = min(scores), max(scores)
+    for n, score in zip(nodes, scores):
+        n.score = (score - low) / (high - low) if high > low else 1.0
+    return nodes
+
+
+def _tag(nodes, index_name):
+    # Kept out of the text the reranker and the LLM see.
+    for n in nodes:
+        n.node.metadata[INDEX_NAME_KEY] = index_name
+        for keys in (n.node.excluded_embed_metadata_keys, n.node.excluded_llm_metadata_keys):
+            if INDEX_NAME_KEY not in keys:
+                keys.append(INDEX_NAME_KEY)
+    return nodes
+
+
+class FederatedIndex:
+    """
+    Serves several named IndexManagers as one: a query fans out to every index in
+    parallel (each with its own top-k), the per-index hits are score-normalised and
+    merged, and the merged candidates go through one shared cross-encoder rerank.
+
+    Offers the same retrieve_nodes / retrieve_nodes_batch interface as IndexManager,
+    so RAGService does not care whether it talks to one index or many. Each index
+    keeps its own storage and lock, so one can be rebuilt while the others serve.
+
+    With an AdaptiveRetrievalPolicy the raw scores of the first search decide per
+    query whether to stop (out of scope), search deeper, or rerank less.
+    """
+
+    def __init__(self, managers, rerank_model=RERANK_MODEL_NAME, rerank_top_n=4, max_candidates=None, ingest=None,
+                 policy=None):
+        if not managers:
+            raise ValueError("FederatedIndex needs at least one index")
+        self.managers = dict(managers)
+        self.reranker = get_reranker(rerank_model, rerank_top_n) if rerank_model else None
+        self.max_candidates = max_candidates
+        # source ("pdf", "json") -> name of the index new files of that kind go to
+        self.ingest = dict(ingest or {})
+        self.policy = policy
+        self.executor = ThreadPoolExecutor(max_workers=len(self.managers), thread_name_prefix="index-fanout")
+
+    @classmethod
+    def from_config(cls, config, embed_model=None, rerank_model=RERANK_MODEL_NAME, manager_factory=None):
+        """
+        Builds the indexes listed under config["indexes"]; a config with only the
+        older single "index" section gives a federation of one. An index's own
+        "dedup" and "reduced_index" sections override the global ones. `manager_factory`
+        (index config -> IndexManager) replaces opening each index from its directory.
+        """
+        def open_index(index_config):
+            return IndexManager(
+                index_name=index_config["name"],
+                index_dir=index_config["directory"],
+                window_size=index_config["window_size"],
+                embed_model=embed_model,
+                rerank_model=rerank_model,
+                similarity_top_k=index_config.get("top_k", 6),
+                dedup=index_config.get("dedup", config.get("dedup")),
+                reduced=index_config.get("reduced_index", config.get("reduced_index")),
+            )
+
+        index_configs = config.get("indexes") or [config["index"]]
+        managers, ingest = {}, {}
+        for index_config in index_configs:
+            managers[index_config["name"]] = (manager_factory or open_index)(index_config)
+            for source in index_config.get("ingest", ()):
+                ingest.setdefault(source, index_config["name"])
+        retrieval = config.get("retrieval", {})
+        return cls(
+            managers,
+            rerank_model=rerank_model,
+            rerank_top_n=retrieval.get("rerank_top_n", 4),
+            max_candidates=retrieval.get("max_candidates"),
+            ingest=ingest,
+            policy=AdaptiveRetrievalPolicy(config["adaptive_retrieval"]) if "adaptive_retrieval" in config else None,
+        )
+
+    def __getitem__(self, name) -> IndexManager:
+        return self.managers[name]
+
+    def ingest_target(self, source) -> IndexManager:
+        """
+        The index new `source` files are added to; the first index unless configured.
+        """
+        name = self.ingest.get(source)
+        return self.managers[name] if name else next(iter(self.managers.values()))
+
+    def _query_embeddings(self, queries):
+        """
+        Embeds the queries once per distinct embedding model instead of once per index.
+        """
+        embeddings = {}
+        for manager in self.managers.values():
+            key = id(manager.embed_model)
+            if key not in embeddings:
+                embeddings[key] = manager._embed_queries(list(queries))
+        return {name: embeddings[id(m.embed_model)] for name, m in self.managers.items()}
+
+    def _merge(self, per_index, top_k_factor=1, normalize=True):
+        # normalize=False merges on the raw dense scores the policy decided on
+        merged = []
+        for name, nodes in per_index.items():
+            merged.extend(_tag(normalize_scores(nodes) if normalize else nodes, name))
+        merged.sort(key=lambda n: -n.score)
+        return merged[: self.max_candidates * top_k_factor] if self.max_candidates else merged
+
+    @staticmethod
+    def raw_scores(per_index) -> list:
+        """
+        Dense scores of all indexes' hits, best first; read before _merge normalises them.
+        """
+        return sorted((n.score or 0.0 for nodes in per_index.values() for n in nodes), reverse=True)
+
+    def _decide(self, per_index):
+        if self.policy is None or not self.policy.enabled:
+            return FULL
+        return self.policy.decide(self.raw_scores(per_index))
+
+    @staticmethod
+    def _gather(futures) -> dict:
+        # Stages timed on the pool threads are reported in this request as "<index>.<stage>_sec"
+        results = {}
+        for name, future in futures.items():
+            results[name], timings = future.result()
+            merge_timings(timings, prefix=f"{name}.")
+        return results
+
+    def _search(self, query, embeddings, top_k_factor=1):
+        request_id = current_request_id()
+        futures = {
+            name: self.executor.submit(
+                run_in_request, request_id, manager.retrieve_nodes, query, embedding=embeddings[name][0],
+                rerank=False, similarity_top_k=manager.similarity_top_k * top_k_factor,
+            )
+            for name, manager in self.managers.items()
+        }
+        return self._gather(futures)
+
+    def _search_batch(self, queries, embeddings, top_k_factor=1):
+        request_id = current_request_id()
+        futures = {
+            name: self.executor.submit(
+                run_in_request, request_id, manager.retrieve_nodes_batch, queries, query_vectors=embeddings[name],
+                rerank=False, similarity_top_k=manager.similarity_top_k * top_k_factor,
+            )
+            for name, manager in self.managers.items()
+        }
+        return self._gather(futures)
+
+    @staticmethod
+    def _normalize_for(decision) -> bool:
+        # skip_rerank / short_rerank keep (the head of) the dense order the margin was measured on;
+        # per-index normalisation would tie every index's best hit at 1.0.
+        return decision.rerank_candidates is None
+
+    def _candidates(self, nodes, decision):
+        # What the cross-encoder sees; without one (or told to skip it), the dense top-n is the answer.
+        if self.reranker is None or decision.rerank_candidates == 0:
+            return None
+        return nodes[: decision.rerank_candidates] if decision.rerank_candidates else nodes
+
+    def _top_n(self, nodes):
+        return nodes[: self.reranker.top_n] if self.reranker is not None else nodes
+
+    @staticmethod
+    def _dense_scores(per_index) -> dict:
+        # Read before _merge normalises the scores in place
+        return {n.node.node_id: n.score for nodes in per_index.values() for n in nodes}
+
+    @staticmethod
+    def _note_trace(decision, dense, nodes, candidates, reranked):
+        note(action=decision.action, candidates=candidates, nodes=[
+            {
+                "id": n.node.node_id,
+                "index": n.node.metadata.get(INDEX_NAME_KEY),
+                "dense": round(dense[n.node.node_id], 4) if dense.get(n.node.node_id) is not None else None,
+                "rerank": round(float(n.score), 4) if reranked and n.score is not None else None,
+            }
+            for n in nodes
+        ])
+
+    def retrieve_nodes_explained(self, query: str):
+        """
+        retrieve_nodes plus the policy Decision taken for the query.
+        """
+        with span("query_embedding"):
+            embeddings = self._query_embeddings([query])
+
+        with span("federated_search"):
+            per_index = self._search(query, embeddings)
+        decision = self._decide(per_index)
+        if decision.action == "out_of_scope":
+            self._note_trace(decision, {}, [], 0, False)
+            return [], decision
+        if decision.top_k_factor > 1:
+            with span("federated_search_widened"):
+                per_index = self._search(query, embeddings, decision.top_k_factor)
+
+        dense = self._dense_scores(per_index)
+        with span("score_merge"):
+            nodes = self._merge(per_index, decision.top_k_factor, self._normalize_for(decision))
+        candidates = self._candidates(nodes, decision)
+        if candidates is None:
+            top = self._top_n(nodes)
+            self._note_trace(decision, dense, top, len(nodes), False)
+            return top, decision
+        with span("rerank"):
+            reranked = self.reranker.postprocess_nodes(candidates, query_bundle=QueryBundle(query_str=query))
+        self._note_trace(decision, dense, reranked, len(candidates), True)
+        return reranked, decision
+
+    def retrieve_nodes(self, query: str):
+        return self.retrieve_nodes_explained(query)[0]
+
+    def retrieve_nodes_batch(self, queries, rerank_batch_size=64):
+        if not queries:
+            return []
+        queries = list(queries)
+        with span("query_embedding"):
+            embeddings = self._query_embeddings(queries)
+
+        with span("federated_search"):
+            per_index = self._search_batch(queries, embeddings)
+        decisions = [self._decide({name: hits[i] for name, hits in per_index.items()}) for i in range(len(queries))]
+
+        widened = [i for i, d in enumerate(decisions) if d.top_k_factor > 1]
+        if widened:
+            # One deeper search for all flat queries; the factor is the same for all of them
+            with span("federated_search_widened"):
+                deeper = self._search_batch(
+                    [queries[i] for i in widened],
+                    {name: [vectors[i] for i in widened] for name, vectors in embeddings.items()},
+                    decisions[widened[0]].top_k_factor,
+                )
+            for j, i in enumerate(widened):
+                for name in per_index:
+                    per_index[name][i] = deeper[name][j]
+
+        with span("score_merge"):
+            results = [
+                [] if decision.action == "out_of_scope"
+                else self._merge({name: hits[i] for name, hits in per_index.items()}, decision.top_k_factor,
+                                 self._normalize_for(decision))
+                for i, decision in enumerate(decisions)
+            ]
+
+        to_rerank = []
+        for i, decision in enumerate(decisions):
+            candidates = self._candidates(results[i], decision) if results[i] else None
+            if candidates is None:
+                results[i] = self._top_n(results[i])
+            else:
+                results[i] = candidates
+                to_rerank.append(i)
+        if to_rerank:
+            with span("rerank"):
+                reranked = rerank_nodes_batch(
+                    self.reranker, [queries[i] for i in to_rerank], [results[i] for i in to_rerank], rerank_batch_size
+                )
+            for i, nodes in zip(to_rerank, reranked):
+                results[i] = nodes
+        return results
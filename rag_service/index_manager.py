@@ -3,76 +3,325 @@ import threading
 import json
 import shutil
 import PyPDF2  
+import numpy as np
 import torch
 from llama_index.core import Document, VectorStoreIndex, StorageContext, load_index_from_storage
 from llama_index.core.node_parser import SentenceWindowNodeParser
 from llama_index.core.postprocessor import MetadataReplacementPostProcessor
-from llama_index.core.indices.postprocessor import SentenceTransformerRerank
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.embeddings.huggingface.utils import get_query_instruct_for_model_name, get_text_instruct_for_model_name
 from llama_index.core import Settings 
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from sentence_transformers import CrossEncoder
+from dedup import NearDuplicateDetector
+from index_catalog import IndexCatalog
+from reduced_index import ReducedIndex
+from metrics import span
 Settings.llm = None
 
-# One global embedder – use CPU/GPU as you like
-EMBED_MODEL = HuggingFaceEmbedding(
-    model_name="BAAI/bge-small-en",            # ★ your choice
-    device="cuda" if torch.cuda.is_available() else "cpu",
-)
-Settings.embed_model = EMBED_MODEL
-# Make a service-context that every Index / QueryEngine will inherit
+EMBED_MODEL_NAME = "BAAI/bge-small-en"
+RERANK_MODEL_NAME = "BAAI/bge-reranker-base"
+
+_default_embed_model = None
+_default_embed_lock = threading.Lock()
+
+
+def get_default_embed_model():
+    """
+    One global embedder – use CPU/GPU as you like. Created on first use, so tools
+    that bring their own embedder (benchmarks, tests) never load the HF model.
+    """
+    global _default_embed_model
+    with _default_embed_lock:
+        if _default_embed_model is None:
+            _default_embed_model = HuggingFaceEmbedding(
+                model_name=EMBED_MODEL_NAME,            # ★ your choice
+                device="cuda" if torch.cuda.is_available() else "cpu",
+            )
+            # Make it the default that every Index / QueryEngine will inherit
+            Settings.embed_model = _default_embed_model
+        return _default_embed_model
+
+
+def query_instruction(embed_model):
+    """
+    The instruction a HuggingFaceEmbedding puts before queries, if embedding
+    instruction + query as a text gives the query's vector (the model has no
+    text instruction); None otherwise.
+    """
+    if not isinstance(embed_model, HuggingFaceEmbedding):
+        return None
+    if embed_model.text_instruction or get_text_instruct_for_model_name(embed_model.model_name):
+        return None
+    return embed_model.query_instruction or get_query_instruct_for_model_name(embed_model.model_name)
+
+
+class CrossEncoderRerank(BaseNodePostprocessor):
+    """
+    Keeps the `top_n` nodes a cross-encoder scores highest for the query, like
+    llama-index's SentenceTransformerRerank, but owns its model so that
+    rerank_nodes_batch can score many queries' pairs in one call (score_pairs).
+    """
+
+    model: str = Field(description="Cross-encoder model name.")
+    top_n: int = Field(description="Number of nodes to keep.")
+    _cross_encoder: CrossEncoder = PrivateAttr()
+
+    def __init__(self, model=RERANK_MODEL_NAME, top_n=4):
+        super().__init__(model=model, top_n=top_n)
+        self._cross_encoder = CrossEncoder(
+            model, max_length=512, device="cuda" if torch.cuda.is_available() else "cpu", trust_remote_code=True
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CrossEncoderRerank"
+
+    def score_pairs(self, pairs, batch_size=32) -> list:
+        """
+        Relevance scores of (query, text) pairs.
+        """
+        if not pairs:
+            return []
+        return [float(score) for score in self._cross_encoder.predict(pairs, batch_size=batch_size)]
+
+    def _postprocess_nodes(self, nodes, query_bundle=None):
+        if query_bundle is None:
+            raise ValueError("Reranking needs the query bundle")
+        pairs = [(query_bundle.query_str, n.node.get_content(metadata_mode=MetadataMode.EMBED)) for n in nodes]
+        for n, score in zip(nodes, self.score_pairs(pairs)):
+            n.score = score
+        return sorted(nodes, key=lambda n: -n.score)[: self.top_n]
+
+
+_rerankers = {}
+_rerankers_lock = threading.Lock()
+
+
+def get_reranker(model_name=RERANK_MODEL_NAME, top_n=4):
+    """
+    Cross-encoders are loaded once per process and shared by every index using them.
+    """
+    with _rerankers_lock:
+        key = (model_name, top_n)
+        if key not in _rerankers:
+            _rerankers[key] = CrossEncoderRerank(model=model_name, top_n=top_n)
+        return _rerankers[key]
+
+
+def rerank_nodes_batch(reranker, queries, results, batch_size=64):
+    """
+    Scores every (query, node) pair of all queries in one cross-encoder call and
+    keeps each query's `reranker.top_n` best nodes.
+    """
+    pairs = [
+        (query, n.node.get_content(metadata_mode=MetadataMode.EMBED))
+        for query, nodes in zip(queries, results) for n in nodes
+    ]
+    pair_scores = reranker.score_pairs(pairs, batch_size=batch_size)
+    offset = 0
+    for nodes in results:
+        for n in nodes:
+            n.score = float(pair_scores[offset])
+            offset += 1
+    return [sorted(nodes, key=lambda n: -n.score)[: reranker.top_n] for nodes in results]
+
+
+def _text_field(data, key) -> str:
+    value = data[key]
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"'{key}' must be a non-empty string")
+    return value.replace("\n", " ").strip()
+
+
+def record_to_document(data, doc_id=None) -> Document:
+    """
+    Builds the Document for one Q/A or information record (a JSON file in
+    in_database, a line of a bulk import). Raises ValueError saying what is
+    wrong with a record that cannot be indexed.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("record is not a JSON object")
+    if "question" in data and "answer" in data:
+        text = f"Q: {_text_field(data, 'question')}\nA: {_text_field(data, 'answer')}"
+    elif "information" in data:
+        text = f"information: {_text_field(data, 'information')}"
+    else:
+        raise ValueError("expected 'question' and 'answer', or 'information'")
+    for key in ("email_id", "timestamp"):
+        value = data.get(key)
+        if isinstance(value, bool) or not isinstance(value, (str, int)) or not str(value).strip():
+            raise ValueError(f"'{key}' is missing or not a string")
+
+    metadata = {
+        "email_id": data["email_id"],
+        "timestamp": data["timestamp"]
+    }
+    if doc_id is not None:
+        return Document(id_=doc_id, text=text, metadata=metadata)
+    return Document(text=text, metadata=metadata)
+
 
 class IndexManager:
-    def __init__(self, index_name, index_dir, window_size):
+    def __init__(self, index_name, index_dir, window_size, embed_model=None, rerank_model=RERANK_MODEL_NAME,
+                 similarity_top_k=6, dedup=None, reduced=None):
         self.index_name = index_name
         self.index_path = os.path.join(index_dir, index_name)
         self.lock = threading.RLock()
         self.window_size = window_size
+        self.similarity_top_k = similarity_top_k
+        self.embed_model = embed_model or get_default_embed_model()
+        self.catalog = IndexCatalog(self.index_path)
+        # Callbacks (op, payload) for every persisted change: "add" nodes, "delete" node ids, "reset"
+        self.change_listeners = []
+        # Near-duplicate filtering of new documents (see dedup.py); None or {"enabled": false} turns it off.
+        self.dedup_config = dedup if dedup and dedup.get("enabled", True) else None
+        self._dedup = None
         self.index = self._create_or_load_index()
+        # Reduced-dimension scan with full-vector re-scoring (see reduced_index.py); None turns it off.
+        self.reduced = ReducedIndex(self.index_path, reduced) if reduced and reduced.get("enabled", True) else None
+        self._sync_catalog()
+        # Loaded once; rebuilding the engine after every insert must not reload the cross-encoder.
+        # rerank_model=None skips reranking (offline benchmarks).
+        self.window_postprocessor = MetadataReplacementPostProcessor(target_metadata_key="window")
+        self.reranker = get_reranker(rerank_model) if rerank_model else None
         self.query_engine = self._build_sentence_window_engine()
 
     def _create_or_load_index(self) -> VectorStoreIndex:
         if os.path.exists(self.index_path):
             print(f"[IndexManager] Loading existing index: {self.index_name}")
             storage_ctx = StorageContext.from_defaults(persist_dir=self.index_path)
-            return load_index_from_storage(storage_ctx)
+            return load_index_from_storage(storage_ctx, embed_model=self.embed_model)
         else:
             print(f"[IndexManager] Creating new index: {self.index_name}")
             os.makedirs(self.index_path, exist_ok=True)
             print("[IndexManager] Created new index. step2")
-            idx = VectorStoreIndex([])
+            idx = VectorStoreIndex([], embed_model=self.embed_model)
             print("[IndexManager] Created new index. step3")
             idx.storage_context.persist(self.index_path)
             print("[IndexManager] Created new index. step4")
             return idx
 
-    def _build_sentence_window_engine(self):
-        postprocessor = MetadataReplacementPostProcessor(target_metadata_key="window")
-        rerank = SentenceTransformerRerank(
-            top_n=4, 
-            model="BAAI/bge-reranker-base"
-        )
-        
+    def _sync_catalog(self):
+        # Indexes persisted before the catalog existed (or edited outside this class) get a fresh one.
+        docs = self.index.docstore.docs
+        if not self.catalog.exists() or self.catalog.count() != len(docs):
+            self.catalog.replace_all(docs.values())
 
+    def _build_sentence_window_engine(self):
+        self.retriever = self.index.as_retriever(similarity_top_k=self.similarity_top_k)
+        # Every index change rebuilds the engine, so this is where the batch matrix goes stale
+        self._embedding_matrix = None
+        if self.reduced is not None:
+            self.reduced.invalidate()
         engine = self.index.as_query_engine(
-            similarity_top_k=6,
-            node_postprocessors=[postprocessor, rerank],
+            similarity_top_k=self.similarity_top_k,
+            node_postprocessors=[p for p in (self.window_postprocessor, self.reranker) if p is not None],
             response_mode="no_text"
         )
         return engine
 
-    def add_documents(self, docs):
+    def add_documents(self, docs, persist=True):
+        """
+        persist=False leaves writing the index to disk to a later persist() call,
+        for callers adding many batches in a row (bulk_import.py).
+        """
+        with self.lock:
+            nodes = self._add_documents(docs, persist)
+            self._notify("add", nodes)
+
+    def persist(self):
         with self.lock:
-            # Convert to nodes with the sentence window parser
-            parser = SentenceWindowNodeParser.from_defaults(
-                window_size=self.window_size,
-                window_metadata_key="window",
-                original_text_metadata_key="original_sentence",
+            self.index.storage_context.persist(self.index_path)
+
+    def _get_dedup(self):
+        # Built from the docstore on first use and dropped whenever nodes are deleted.
+        if self._dedup is None:
+            self._dedup = NearDuplicateDetector.from_nodes(
+                self.index_name, self.dedup_config, self.index.docstore.docs.values()
             )
+        return self._dedup
+
+    def dedup_stats(self) -> dict:
+        # Does not build the detector just to report on it
+        if not self.dedup_config:
+            return {"enabled": False}
+        detector = self._dedup
+        return {"enabled": True, **(detector.stats() if detector is not None else {})}
+
+    def _add_documents(self, docs, persist=True):
+        if self.dedup_config:
+            # Skipped before parsing, so duplicates are never embedded
+            docs = self._get_dedup().filter_documents(docs)
+        # Convert to nodes with the sentence window parser
+        parser = SentenceWindowNodeParser.from_defaults(
+            window_size=self.window_size,
+            window_metadata_key="window",
+            original_text_metadata_key="original_sentence",
+        )
+        try:
             nodes = parser.get_nodes_from_documents(docs)
+            if self.dedup_config:
+                nodes = self._get_dedup().filter_nodes(nodes)
+            if not nodes:
+                return []
             self.index.insert_nodes(nodes)
+        except BaseException:
+            # The detector already holds these documents; rebuilt from the docstore, it
+            # holds only what was indexed, so a retry is not dropped as a duplicate.
+            self._dedup = None
+            raise
+        if persist:
             self.index.storage_context.persist(self.index_path)
-            # Rebuild the engine so queries see new documents:
+        self.catalog.upsert(nodes)
+        # Rebuild the engine so queries see new documents:
+        self.query_engine = self._build_sentence_window_engine()
+        print(f"[IndexManager] Added {len(docs)} documents.")
+        return nodes
+
+    def _notify(self, op, payload=None):
+        # Called with self.lock held, once the change is persisted (see replication.IndexPublisher).
+        for listener in self.change_listeners:
+            listener(op, payload)
+
+    def insert_embedded_nodes(self, nodes):
+        """
+        Adds nodes that already carry their embeddings, e.g. replicated from a
+        writer. Nothing is re-embedded and nothing is persisted.
+        """
+        with self.lock:
+            self.index.insert_nodes(nodes)
+            self.catalog.upsert(nodes)
             self.query_engine = self._build_sentence_window_engine()
-            print(f"[IndexManager] Added {len(docs)} documents.")
+
+    def delete_node_ids(self, node_ids):
+        """
+        In-memory counterpart of remove_by_email_id for replicated deletes.
+        """
+        with self.lock:
+            self.index.delete_nodes(list(node_ids), delete_from_docstore=True)
+            self.catalog.delete(node_ids)
+            self._dedup = None
+            self.query_engine = self._build_sentence_window_engine()
+
+    def remove_node_ids(self, node_ids) -> int:
+        """
+        Deletes the given nodes (unknown ids are ignored), persists and notifies
+        listeners, like remove_by_email_id.
+        """
+        with self.lock:
+            to_remove = [n for n in node_ids if n in self.index.docstore.docs]
+            if not to_remove:
+                return 0
+            self.index.delete_nodes(to_remove, delete_from_docstore=True)
+            self.index.storage_context.persist(self.index_path)
+            self.catalog.delete(to_remove)
+            self._dedup = None
+            self.query_engine = self._build_sentence_window_engine()
+            self._notify("delete", to_remove)
+            return len(to_remove)
 
     def remove_by_email_id(self, email_id: str) -> int:
         with self.lock:
@@ -84,15 +333,18 @@ class IndexManager:
             if not to_remove:
                 return 0
 
+            self.index.delete_nodes(to_remove, delete_from_docstore=True)
+            self._dedup = None
             for doc_id in to_remove:
-                self.index.delete(node_ids=[doc_id], delete_from_docstore=True)
                 print(f"[IndexManager] Deleted doc_id={doc_id}")
             
             print(f"[IndexManager] Docstore AFTER removing email_id={email_id}, BEFORE persist:")
             print(self.list_documents())
 
             self.index.storage_context.persist(self.index_path)
+            self.catalog.delete(to_remove)
             self.query_engine = self._build_sentence_window_engine()
+            self._notify("delete", to_remove)
             
             print(f"[IndexManager] Docstore AFTER removing email_id={email_id}, AFTER persist & engine rebuild:")
             print(self.list_documents())
@@ -107,8 +359,12 @@ class IndexManager:
                 shutil.rmtree(self.index_path)
             os.makedirs(self.index_path, exist_ok=True)
             
-            self.index = VectorStoreIndex([])
+            self.index = VectorStoreIndex([], embed_model=self.embed_model)
             self.index.storage_context.persist(self.index_path)
+            self.catalog.replace_all([])
+            self._dedup = None
+            if self.reduced is not None:
+                self.reduced.reset()
             
             documents = []
             for filename in os.listdir(in_database_folder):
@@ -117,26 +373,141 @@ class IndexManager:
                     try:
                         with open(file_path, "r", encoding="utf-8") as f:
                             data = json.load(f)
-                        text = f"Q: {data['question']}\nA: {data['answer']}"
-                        metadata = {
-                            "email_id": data["email_id"],
-                            "timestamp": data["timestamp"]
-                        }
-                        documents.append(Document(text=text, metadata=metadata))
+                        documents.append(record_to_document(data))
                     except Exception as e:
                         print(f"Error loading {filename}: {e}")
             
             if documents:
-                self.add_documents(documents)
+                self._add_documents(documents)
             else:
                 print("No documents found in the in_database folder.")
             
             self.query_engine = self._build_sentence_window_engine()
+            # Replicas reload a snapshot instead of replaying the whole rebuild
+            self._notify("reset")
             print("[IndexManager] Rebuilt index from remaining documents.")
 
     def get_query_engine(self):
         return self.query_engine
 
+    def retrieve_nodes(self, query: str, embedding=None, rerank=True, similarity_top_k=None):
+        """
+        Same pipeline as the query engine, run stage by stage so each stage is timed.
+        A precomputed query `embedding` skips the embedding stage; rerank=False
+        returns the window-replaced vector search hits with their similarity scores.
+        """
+        retriever = self.retriever
+        if similarity_top_k and similarity_top_k != self.similarity_top_k:
+            retriever = self.index.as_retriever(similarity_top_k=similarity_top_k)
+        if embedding is None:
+            with span("query_embedding"):
+                embedding = self.embed_model.get_query_embedding(query)
+        query_bundle = QueryBundle(query_str=query, embedding=embedding)
+        with span("vector_search"):
+            nodes = self._reduced_search([embedding], similarity_top_k or self.similarity_top_k)
+            nodes = nodes[0] if nodes is not None else retriever.retrieve(query_bundle)
+        with span("window_replacement"):
+            nodes = self.window_postprocessor.postprocess_nodes(nodes, query_bundle=query_bundle)
+        if rerank and self.reranker is not None:
+            with span("rerank"):
+                nodes = self.reranker.postprocess_nodes(nodes, query_bundle=query_bundle)
+        return nodes
+
+    def _embed_queries(self, queries):
+        instruction = query_instruction(self.embed_model)
+        if instruction is not None:
+            # Batched forward passes; a SentenceTransformer prompt is the instruction prepended
+            return self.embed_model.get_text_embedding_batch([instruction + q for q in queries])
+        return [self.embed_model.get_query_embedding(q) for q in queries]
+
+    def _reduced_search(self, query_vectors, similarity_top_k):
+        """
+        One NodeWithScore list per query from the reduced index, or None when it is
+        off or the index is still too small for it.
+        """
+        if self.reduced is None:
+            return None
+        hits = self.reduced.search(self.index.vector_store.data.embedding_dict, self.lock, query_vectors,
+                                   similarity_top_k)
+        if hits is None:
+            return None
+        results = []
+        for query_hits in hits:
+            nodes = self.index.docstore.get_nodes([node_id for node_id, _ in query_hits])
+            results.append([NodeWithScore(node=node, score=score) for node, (_, score) in zip(nodes, query_hits)])
+        return results
+
+    def reduced_stats(self) -> dict:
+        if self.reduced is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.reduced.stats()}
+
+    def _get_embedding_matrix(self):
+        """
+        All node vectors as one L2-normalised matrix, built once per index version.
+        """
+        matrix = self._embedding_matrix
+        if matrix is None:
+            with self.lock:
+                embedding_dict = self.index.vector_store.data.embedding_dict
+                node_ids = list(embedding_dict.keys())
+                vectors = np.asarray([embedding_dict[n] for n in node_ids], dtype=np.float32)
+            if len(node_ids):
+                vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            matrix = self._embedding_matrix = (node_ids, vectors)
+        return matrix
+
+    def _full_search(self, query_vectors, similarity_top_k):
+        node_ids, matrix = self._get_embedding_matrix()
+        if not node_ids:
+            return []
+        query_vectors /= np.maximum(np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12)
+        scores = query_vectors @ matrix.T
+        k = min(similarity_top_k, len(node_ids))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in enumerate(top):
+            ordered = candidates[np.argsort(-scores[row, candidates])]
+            nodes = self.index.docstore.get_nodes([node_ids[i] for i in ordered])
+            results.append([
+                NodeWithScore(node=node, score=float(scores[row, i])) for node, i in zip(nodes, ordered)
+            ])
+        return results
+
+    def retrieve_nodes_batch(self, queries, similarity_top_k=None, rerank_batch_size=64, query_vectors=None,
+                             rerank=True):
+        """
+        Batched version of retrieve_nodes: one embedding call for all queries, one
+        matrix product for the vector search and one cross-encoder call for all pairs.
+        Returns one node list per query.
+        """
+        if not queries:
+            return []
+        similarity_top_k = similarity_top_k or self.similarity_top_k
+        if query_vectors is None:
+            with span("query_embedding"):
+                query_vectors = self._embed_queries(list(queries))
+        query_vectors = np.array(query_vectors, dtype=np.float32)
+
+        with span("vector_search"):
+            results = self._reduced_search(query_vectors, similarity_top_k)
+            if results is None:
+                results = self._full_search(query_vectors, similarity_top_k)
+        if not results:
+            return [[] for _ in queries]
+
+        bundles = [QueryBundle(query_str=q) for q in queries]
+        with span("window_replacement"):
+            results = [
+                self.window_postprocessor.postprocess_nodes(nodes, query_bundle=bundle)
+                for nodes, bundle in zip(results, bundles)
+            ]
+
+        if rerank and self.reranker is not None:
+            with span("rerank"):
+                results = rerank_nodes_batch(self.reranker, queries, results, rerank_batch_size)
+        return results
+
     def list_documents(self):
         with self.lock:
             return {
@@ -154,22 +525,12 @@ class IndexManager:
                     with open(file_path, "r", encoding="utf-8") as f:
                         data = json.load(f)
 
-                    if "question" in data and "answer" in data:
-                        question = data["question"].replace("\n", " ").strip()
-                        answer = data["answer"].replace("\n", " ").strip()
-                        text = f"Q: {question}\nA: {answer}"
-                    elif "information" in data:
-                        information = data["information"].replace("\n", " ").strip()
-                        text = f"information: {information}"
-                    else:
-                        print(f"File {filename} does not have expected keys.")
+                    try:
+                        document = record_to_document(data)
+                    except ValueError as e:
+                        print(f"File {filename} does not have expected keys: {e}")
                         continue
-
-                    metadata = {
-                        "email_id": data["email_id"],
-                        "timestamp": data["timestamp"]
-                    }
-                    documents.append(Document(text=text, metadata=metadata))
+                    documents.append(document)
 
                     shutil.move(file_path, os.path.join(destination_folder, filename))
                     print(f"Processed and moved file: {filename}")
@@ -0,0 +1,253 @@
+# rag_service/llm_workers.py
+#
+# Multi-process serving for server.py with one physical copy of the model weights.
+#
+#   LLM_WORKERS=4 LLM_THREADS_PER_WORKER=2 python server.py
+#
+# The master process loads the model once, moves every parameter and buffer into
+# shared memory (share_model_memory) and freezes the GC, then binds the listening
+# socket and forks the workers. Each worker serves the same socket (the kernel
+# spreads connections over them) with its own torch thread count and, where the
+# platform allows it, its own slice of the CPUs, so N workers x T threads never
+# oversubscribe the machine. Weights are read-only at inference, so the workers keep
+# mapping the master's pages; what each worker adds is activations and the KV cache.
+#
+# Every worker reports its startup time and memory (RSS, PSS and the shared part)
+# to the master, which prints a table and optionally writes it to LLM_WORKER_REPORT.
+# GET /worker on any worker returns that worker's own numbers. Admission limits
+# (LLM_MAX_IN_FLIGHT, LLM_MAX_QUEUE) and /metrics are per worker.
+
+import gc
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+import torch
+
+
+def cpu_slices(workers, threads_per_worker):
+    """
+    Disjoint CPU sets for the workers, or None per worker when there are not enough
+    CPUs (or no affinity support) to give each worker its own.
+    """
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return [None] * workers
+    if workers * threads_per_worker > len(cpus):
+        return [None] * workers
+    return [set(cpus[i * threads_per_worker:(i + 1) * threads_per_worker]) for i in range(workers)]
+
+
+def default_threads_per_worker(workers):
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return max(1, cpus // workers)
+
+
+def share_model_memory(model):
+    """
+    Moves the model's CPU tensors into shared memory, so forked workers map one
+    copy even if something writes to a tensor. Returns the bytes shared.
+    """
+    shared = 0
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        if tensor.device.type == "cpu":
+            tensor.data.share_memory_()
+            shared += tensor.numel() * tensor.element_size()
+    return shared
+
+
+def memory_usage() -> dict:
+    """
+    This process's memory in MB: rss, pss (shared pages split between their users),
+    shared and private, from /proc (Linux only; empty elsewhere).
+    """
+    usage = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[2] == "kB":
+                    usage[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        return usage
+    return {
+        "rss_mb": usage.get("Rss", 0) / 1024,
+        "pss_mb": usage.get("Pss", 0) / 1024,
+        "shared_mb": (usage.get("Shared_Clean", 0) + usage.get("Shared_Dirty", 0)) / 1024,
+        "private_mb": (usage.get("Private_Clean", 0) + usage.get("Private_Dirty", 0)) / 1024,
+    }
+
+
+class WorkerPool:
+    """
+    Forks `workers` processes serving `app` on one pre-bound socket and restarts
+    any that exit unexpectedly. The model must already be loaded and shared.
+
+    A worker that dies within `min_uptime` seconds of starting is restarted after
+    a delay that doubles each time (up to `max_restart_delay`); after
+    `max_quick_restarts` such deaths in a row it is given up on.
+    """
+
+    min_uptime = 10.0
+    max_restart_delay = 60.0
+    max_quick_restarts = 5
+
+    def __init__(self, app, host, port, workers, threads_per_worker=None, report_path=None):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or default_threads_per_worker(workers)
+        self.cpu_sets = cpu_slices(workers, self.threads_per_worker)
+        self.report_path = report_path
+        self.children = {}  # pid -> worker number
+        self.stats = {}     # worker number -> startup report
+        self.started_at = {}     # worker number -> monotonic time of its last fork
+        self.quick_restarts = {}  # worker number -> deaths soon after start, in a row
+        self.stopping = False
+        self.worker_stats = None  # set in each worker
+
+    def _bind(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(128)
+        sock.set_inheritable(True)
+        return sock
+
+    def _spawn(self, number, sock):
+        read_fd, write_fd = os.pipe()
+        forked_at = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            # Whatever happens, the child never returns into the master's serve()
+            code = 1
+            try:
+                os.close(read_fd)
+                self._run_worker(number, sock, write_fd, forked_at)
+                code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        os.close(write_fd)
+        self.children[pid] = number
+        self.started_at[number] = time.monotonic()
+        return read_fd
+
+    def _restart_delay(self, number):
+        """
+        Seconds to wait before restarting worker `number`, or None to give up on it.
+        """
+        if time.monotonic() - self.started_at.get(number, 0.0) >= self.min_uptime:
+            self.quick_restarts[number] = 0
+            return 0.0
+        quick = self.quick_restarts.get(number, 0) + 1
+        self.quick_restarts[number] = quick
+        if quick > self.max_quick_restarts:
+            return None
+        return min(self.max_restart_delay, 2.0 ** (quick - 1))
+
+    def _run_worker(self, number, sock, report_fd, forked_at):
+        from werkzeug.serving import make_server
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, signal.SIG_DFL)
+        cpus = self.cpu_sets[number]
+        if cpus:
+            os.sched_setaffinity(0, cpus)
+        torch.set_num_threads(self.threads_per_worker)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # the inter-op pool was started before the fork
+        server = make_server(self.host, self.port, self.app, threaded=True, fd=sock.fileno())
+        self.worker_stats = {
+            "worker": number,
+            "pid": os.getpid(),
+            "threads": self.threads_per_worker,
+            "cpus": sorted(cpus) if cpus else None,
+            "startup_sec": time.perf_counter() - forked_at,
+            **memory_usage(),
+        }
+        with os.fdopen(report_fd, "w") as report:
+            report.write(json.dumps(self.worker_stats))
+        server.serve_forever()
+
+    def _collect(self, read_fd):
+        with os.fdopen(read_fd, "r") as report:
+            data = report.read()
+        if data:
+            stats = json.loads(data)
+            self.stats[stats["worker"]] = stats
+
+    def _report(self, master):
+        print(f"[llm_workers] master pid {os.getpid()}: model loaded in {master['load_sec']:.1f}s, "
+              f"{master['shared_weights_mb']:.0f} MB of weights shared, RSS {master.get('rss_mb', 0):.0f} MB")
+        for number in sorted(self.stats):
+            s = self.stats[number]
+            print(f"[llm_workers] worker {number} pid {s['pid']}: ready in {s['startup_sec']:.2f}s, "
+                  f"{s['threads']} threads on CPUs {s['cpus'] or 'any'}, RSS {s.get('rss_mb', 0):.0f} MB "
+                  f"(shared {s.get('shared_mb', 0):.0f}, private {s.get('private_mb', 0):.0f}, "
+                  f"PSS {s.get('pss_mb', 0):.0f})")
+        if self.report_path:
+            os.makedirs(os.path.dirname(self.report_path) or ".", exist_ok=True)
+            with open(self.report_path, "w", encoding="utf-8") as f:
+                json.dump({"master": master, "workers": [self.stats[n] for n in sorted(self.stats)]}, f, indent=2)
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def serve(self, master_stats):
+        """
+        Forks the workers, prints the startup report and supervises them until
+        SIGTERM/SIGINT. `master_stats` describes the preload (load_sec, shared_weights_mb).
+        """
+        # Objects allocated so far never move to a younger generation, so GC passes in
+        # the workers do not write to (and un-share) the pages holding them.
+        gc.collect()
+        gc.freeze()
+        sock = self._bind()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self._stop)
+
+        for read_fd in [self._spawn(number, sock) for number in range(self.workers)]:
+            self._collect(read_fd)
+        self._report({**master_stats, "pid": os.getpid(), **memory_usage()})
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            number = self.children.pop(pid, None)
+            if number is None or self.stopping:
+                continue
+            delay = self._restart_delay(number)
+            if delay is None:
+                print(f"[llm_workers] worker {number} (pid {pid}) exited with status {status}; "
+                      f"it died on start-up more than {self.max_quick_restarts} times in a row, not restarting",
+                      file=sys.stderr)
+                continue
+            print(f"[llm_workers] worker {number} (pid {pid}) exited with status {status}; "
+                  f"restarting in {delay:.1f}s", file=sys.stderr)
+            time.sleep(delay)
+            if self.stopping:
+                continue
+            self._collect(self._spawn(number, sock))
+        sock.close()
@@ -6,9 +6,16 @@ import threading
 import subprocess
 # import webbrowser # Commented out or removed for Docker
 import json
-from index_manager import IndexManager
+from bulk_import import BulkImport
+from index_federation import FederatedIndex
+from replication import IndexPublisher, start_replica
 from rag_service import RAGService # This should import from ./rag_service.py
-from flask import request, jsonify
+from session_cache import ConversationSessionCache
+from trace_log import TraceWriter, begin_trace, end_trace
+from metrics import REGISTRY, client_metrics_collector, current_request_id, current_timings, install_flask_metrics
+from profiler import install_flask_profiler
+from admission import AdmissionController, install_flask_admission
+from flask import Response, request, jsonify
 import sys
 
 if os.name == 'nt':  # Check if the operating system is Windows
@@ -21,16 +28,25 @@ if os.name == 'nt':  # Check if the operating system is Windows
 with open('data/configuration/config.json', 'r', encoding='utf-8') as f:
     config = json.load(f)
 
-INDEX_DIR       = config["index"]["directory"]
-INDEX_NAME      = config["index"]["name"]
-WINDOW_SIZE     = config["index"]["window_size"]
-
 IN_DATABASE_FOLDER = config["folders"]["in_database"]
 TMP_FOLDER = config["folders"]["tmp"]
 SAVE_FOLDER        = config["folders"]["save_folder"]
 SAVE_FOLDER2       = config["folders"]["save_folder2"]
 
 
+BATCH_MAX_WORKERS    = config.get("batch", {}).get("max_workers", 4)
+BATCH_RETRIEVAL_SIZE = config.get("batch", {}).get("retrieval_batch_size", 64)
+BATCH_RERANK_SIZE    = config.get("batch", {}).get("rerank_batch_size", 64)
+BATCH_OVERLOADED_WAIT_SEC = config.get("batch", {}).get("overloaded_wait_sec", 600)
+
+ADMISSION_CONFIG = config.get("admission", {})
+
+# standalone: ingest and serve (default); writer: ingest and publish snapshots plus
+# a change log to the replication directory; replica: serve from those, no ingest.
+RAG_ROLE = os.getenv("RAG_ROLE", "standalone")
+REPLICATION_CONFIG = config.get("replication", {})
+REPLICATION_DIR = os.getenv("REPLICATION_DIR", REPLICATION_CONFIG.get("directory", "data/replication"))
+
 STREAMLIT_PORT  = config["streamlit"]["port"]
 STREAMLIT_URL   = config["streamlit"]["url"] # Still here, but webbrowser.open is removed
 
@@ -40,56 +56,264 @@ FLASK_DEBUG     = config["flask"]["debug"]
 
 from flask import Flask # Removed duplicate import of 'request'
 
-# Create the index manager using configuration values
-# Ensure paths in config (like INDEX_DIR) are relative to /app (e.g., "data/vectorstore/...")
-manager = IndexManager(index_name=INDEX_NAME, index_dir=INDEX_DIR, window_size=WINDOW_SIZE)
+# One IndexManager per entry of "indexes" (or the single "index"), queried together
+# Ensure paths in config (index directories) are relative to /app (e.g., "data/vectorstore/...")
+replica_sync = None
+if RAG_ROLE == "replica":
+    indexes, replica_sync = start_replica(
+        config,
+        REPLICATION_DIR,
+        local_dir=REPLICATION_CONFIG.get("local_directory", "data/replica"),
+        poll_interval=REPLICATION_CONFIG.get("poll_interval_sec", 1.0),
+    )
+    manager = None
+else:
+    indexes = FederatedIndex.from_config(config)
+    # New PDFs from TMP_FOLDER go to the index configured with "ingest": ["pdf"]
+    manager = indexes.ingest_target("pdf")
+    if RAG_ROLE == "writer":
+        publishers = [
+            IndexPublisher(m, REPLICATION_DIR, snapshot_every=REPLICATION_CONFIG.get("snapshot_every", 200))
+            for m in indexes.managers.values()
+        ]
+
+# Create the RAG service on top of all indexes
+rag = RAGService(indexes)
 
-# Create the RAG service using the manager
-rag = RAGService(manager)
+# Per-conversation histories, so Django only needs to send new messages each turn
+sessions = ConversationSessionCache(
+    max_sessions=config.get("sessions", {}).get("max_sessions", 1000),
+    ttl_sec=config.get("sessions", {}).get("ttl_sec", 3600),
+)
 
 FELChat = Flask(__name__) # When run as script, __name__ is '__main__'
 
+# Request ids from Django, per-stage timings and GET /metrics (Prometheus text format)
+install_flask_metrics(FELChat)
+# On-demand sampling profiler under /admin/profile (needs PROFILER_TOKEN)
+install_flask_profiler(FELChat)
+# Deadlines from X-Request-Timeout-Ms, bounded /query concurrency, 503 + Retry-After when full
+admission = AdmissionController(
+    "rag",
+    max_in_flight=ADMISSION_CONFIG.get("max_in_flight", 8),
+    max_queue=ADMISSION_CONFIG.get("max_queue", 32),
+)
+install_flask_admission(FELChat, admission, endpoints=("query",),
+                        default_budget=ADMISSION_CONFIG.get("default_budget_sec"))
+REGISTRY.register_collector(client_metrics_collector(rag.llm_client))
+REGISTRY.register_collector(lambda: [
+    (f"felchat_session_cache_{name}", {}, value) for name, value in sessions.metrics().items()
+])
+if indexes.policy is not None:
+    REGISTRY.register_collector(lambda: [
+        ("felchat_adaptive_retrieval_queries", {"action": action}, count)
+        for action, count in indexes.policy.metrics().items()
+    ])
+
+# Retrieval trace per answered /query, written off the request path (see trace_log.py)
+TRACE_CONFIG = config.get("trace_log", {})
+trace_writer = TraceWriter(TRACE_CONFIG) if TRACE_CONFIG.get("enabled", False) else None
+if trace_writer is not None:
+    REGISTRY.register_collector(lambda: [
+        (f"felchat_trace_log_{name}", {}, value) for name, value in trace_writer.metrics().items()
+    ])
+
 # Ensure these directories exist based on paths relative to /app (e.g., /app/data/evaluation/...)
 # The paths in config.json for these folders should start with "data/"
 os.makedirs(SAVE_FOLDER, exist_ok=True)
 os.makedirs(SAVE_FOLDER2, exist_ok=True)
 os.makedirs(TMP_FOLDER, exist_ok=True) # Make sure TMP_FOLDER also exists
 
-def get_conversation_history():
-    conversation_history = None
+def to_chat_messages(incoming_messages):
+    conversation_history = []
+    for msg in incoming_messages:
+        # Ensure 'sender' and 'text' keys exist to avoid KeyErrors
+        if "sender" in msg and "text" in msg:
+            role = "user" if msg["sender"] == "user" else "assistant"
+            conversation_history.append({"role": role, "content": msg["text"]})
+        else:
+            print(f"Skipping invalid message format: {msg}")
     return conversation_history
 
 @FELChat.route('/query', methods=['POST'])
 def query():
+    """
+    Accepts either the legacy full transcript (a list of messages) or a session delta:
+
+        {"conversation_id": 7, "version": 4, "messages": [...new messages...], "full": false}
+
+    `version` is the number of messages the client believes we already hold for the
+    conversation. If our session is missing or at another version we answer 409 and
+    the client resends the whole transcript with "full": true.
+    """
     print("Received a query request")
     # print("Request data: ", request.data) # request.data can be large, consider logging request.json
 
     incoming_data = request.json
     if not incoming_data: # Simpler check for empty body
         return jsonify({"error": "Request body is empty or not JSON"}), 400
-    if not isinstance(incoming_data, list): # Assuming you expect a list of message objects
+
+    version = None
+    conversation_id = None
+    if isinstance(incoming_data, list):
+        conversation_history = to_chat_messages(incoming_data)
+    elif isinstance(incoming_data, dict) and isinstance(incoming_data.get("messages"), list):
+        conversation_id = incoming_data.get("conversation_id")
+        delta = to_chat_messages(incoming_data["messages"])
+        if incoming_data.get("full"):
+            version, conversation_history = sessions.reset(conversation_id, delta)
+        else:
+            synced = sessions.apply_delta(conversation_id, incoming_data.get("version"), delta)
+            if synced is None:
+                return jsonify({"error": "Unknown conversation version, resend full history", "resync": True}), 409
+            version, conversation_history = synced
+    else:
         return jsonify({"error": "Invalid request format, expected a list of messages"}), 400
 
-    last_user_msg = next((msg for msg in reversed(incoming_data) if msg.get("sender") == "user"), None)
-    if not last_user_msg or "text" not in last_user_msg:
+    if not conversation_history or conversation_history[-1]["role"] != "user":
         return jsonify({"error": "No user message with text found"}), 400
 
-    user_query = last_user_msg["text"]
+    # The history is this request's own list (session_cache hands out copies)
+    user_query = conversation_history.pop()["content"]
 
-    conversation_history = []
-    for msg in incoming_data:
-        # Ensure 'sender' and 'text' keys exist to avoid KeyErrors
-        if "sender" in msg and "text" in msg:
-            role = "user" if msg["sender"] == "user" else "assistant"
-            conversation_history.append({"role": role, "content": msg["text"]})
-        else:
-            print(f"Skipping invalid message format: {msg}")
+    begin_trace(
+        ts=time.time(),
+        request_id=current_request_id(),
+        message_id=incoming_data.get("message_id") if isinstance(incoming_data, dict) else None,
+        conversation_id=conversation_id,
+        question=user_query,
+    )
+    try:
+        answer, docs, context, messages, rag_timings = rag.query(user_query, conversation_history)
+    finally:
+        trace = end_trace()
+    timings = {**current_timings(), **rag_timings}
+    if trace_writer is not None:
+        trace_writer.emit({**trace, "timings": {k: round(v, 4) for k, v in timings.items()}})
+    return jsonify({"answer": answer, "context": context, "version": version, "timings": timings})
+
+@FELChat.route('/query_batch', methods=['POST'])
+def query_batch():
+    """
+    Bulk question answering for offline evaluation:
+
+        {"questions": [{"id": 1, "question": "..."}, ...], "max_workers": 4, "completed_ids": [...]}
+
+    Streams one JSON object per answered question (application/x-ndjson) as soon as it is ready.
+    max_workers is capped at the configured batch.max_workers.
+    """
+    incoming_data = request.json
+    if not isinstance(incoming_data, dict) or not isinstance(incoming_data.get("questions"), list):
+        return jsonify({"error": "Invalid request format, expected {\"questions\": [...]}"}), 400
+
+    questions = incoming_data["questions"]
+    if any(not isinstance(q, dict) or not q.get("question") for q in questions):
+        return jsonify({"error": "Every item needs a \"question\""}), 400
+    max_workers = incoming_data.get("max_workers", BATCH_MAX_WORKERS)
+    if not isinstance(max_workers, int) or isinstance(max_workers, bool) or max_workers < 1:
+        return jsonify({"error": "max_workers must be a positive integer"}), 400
+
+    results = rag.query_batch(
+        questions,
+        # The server's own limit wins; the client may only ask for less.
+        max_workers=min(max_workers, BATCH_MAX_WORKERS),
+        completed_ids=incoming_data.get("completed_ids", []),
+        retrieval_batch_size=BATCH_RETRIEVAL_SIZE,
+        rerank_batch_size=BATCH_RERANK_SIZE,
+        overloaded_wait_sec=BATCH_OVERLOADED_WAIT_SEC,
+    )
+
+    def stream():
+        try:
+            for r in results:
+                yield json.dumps(r, ensure_ascii=False) + "\n"
+        finally:
+            # Werkzeug closes the response when the client goes away; pass that on so the
+            # queued generations are cancelled.
+            results.close()
+
+    return Response(stream(), mimetype="application/x-ndjson")
+
+@FELChat.route('/indexes', methods=['GET'])
+def list_indexes():
+    return jsonify([
+        {"name": name, "nodes": m.catalog.count(), "dedup": m.dedup_stats(),
+         "reduced_index": m.reduced_stats()} for name, m in indexes.managers.items()
+    ])
+
+@FELChat.route('/indexes/<name>/nodes', methods=['GET'])
+def list_index_nodes(name):
+    """
+    Read-only page of an index's nodes from its catalog:
+
+        ?limit=50&cursor=<next_cursor>&q=<full-text search>&filter=email_id:123&filter=source:pdf
+    """
+    if name not in indexes.managers:
+        return jsonify({"error": f"Unknown index {name}"}), 404
+    filters = {}
+    for item in request.args.getlist("filter"):
+        key, sep, value = item.partition(":")
+        if not sep:
+            return jsonify({"error": "filter must look like key:value"}), 400
+        filters[key] = value
+    nodes, next_cursor = indexes[name].catalog.list_nodes(
+        limit=request.args.get("limit", default=50, type=int),
+        cursor=request.args.get("cursor", type=int),
+        query=request.args.get("q"),
+        filters=filters,
+    )
+    return jsonify({"nodes": nodes, "next_cursor": next_cursor})
+
+@FELChat.route('/indexes/<name>/nodes/<node_id>', methods=['GET'])
+def get_index_node(name, node_id):
+    node = indexes[name].catalog.get_node(node_id) if name in indexes.managers else None
+    if node is None:
+        return jsonify({"error": "Not found"}), 404
+    return jsonify(node)
+
+# index name -> its most recent BulkImport
+bulk_imports = {}
+# Makes "no import running" and registering the new one a single step
+bulk_imports_lock = threading.Lock()
+
+@FELChat.route('/indexes/<name>/import', methods=['GET', 'POST'])
+def index_import(name):
+    """
+    POST {"path": "data/...jsonl.gz", "batch_size": 256, "persist_every": 4096} starts a
+    background bulk import (see bulk_import.py) into the index; GET reports its progress.
+    """
+    if name not in indexes.managers:
+        return jsonify({"error": f"Unknown index {name}"}), 404
+    if request.method == 'GET':
+        job = bulk_imports.get(name)
+        return jsonify(job.status()) if job else (jsonify({"error": "No import started"}), 404)
+
+    if RAG_ROLE == "replica":
+        return jsonify({"error": "Replicas are read-only, import on the writer"}), 409
+    body = request.json or {}
+    path = os.path.realpath(str(body.get("path", "")))
+    if not path.startswith(os.path.realpath("data") + os.sep) or not os.path.isfile(path):
+        return jsonify({"error": "path must name a file under data/"}), 400
+    sizes = {"batch_size": body.get("batch_size", 256), "persist_every": body.get("persist_every", 4096)}
+    for key, value in sizes.items():
+        if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+            return jsonify({"error": f"{key} must be a positive integer"}), 400
 
+    with bulk_imports_lock:
+        if name in bulk_imports and bulk_imports[name].running():
+            return jsonify({"error": "An import into this index is already running"}), 409
+        job = BulkImport(indexes[name], path, **sizes)
+        bulk_imports[name] = job
+        job.start()
+    return jsonify(job.status()), 202
 
-    rag.conversation_history = conversation_history[:-1]
+@FELChat.route('/replication', methods=['GET'])
+def replication_status():
+    return jsonify({"role": RAG_ROLE, "indexes": replica_sync.status() if replica_sync else []})
 
-    answer, docs, context, messages, rag_timings = rag.query(user_query)
-    return jsonify({"answer": answer, "context": context}) # Consider also returning timings or docs if needed by client
+@FELChat.route('/metrics/http', methods=['GET'])
+def http_client_metrics():
+    return jsonify({**rag.llm_client.metrics(), "sessions": sessions.metrics(), "admission": admission.metrics()})
 
 def monitor_new_files():
     print(f"Starting monitoring of '{TMP_FOLDER}' for new JSON and PDF files...")
@@ -128,14 +352,16 @@ def run_streamlit():
     print(f"Running Streamlit: {' '.join(streamlit_cmd)}")
     subprocess.run(streamlit_cmd)
 
-streamlit_thread = threading.Thread(target=run_streamlit, daemon=True)
-streamlit_thread.start()
+# Replicas only serve queries: no viewer, and above all no ingest watcher.
+if RAG_ROLE != "replica":
+    streamlit_thread = threading.Thread(target=run_streamlit, daemon=True)
+    streamlit_thread.start()
 
-# The webbrowser.open() line is removed as it's not suitable for Docker.
-# Users will access Streamlit via http://localhost:STREAMLIT_PORT (or mapped port)
+    # The webbrowser.open() line is removed as it's not suitable for Docker.
+    # Users will access Streamlit via http://localhost:STREAMLIT_PORT (or mapped port)
 
-thread_new = threading.Thread(target=monitor_new_files, daemon=True)
-thread_new.start()
+    thread_new = threading.Thread(target=monitor_new_files, daemon=True)
+    thread_new.start()
 
 
 print(f"Starting Flask server on {FLASK_HOST}:{FLASK_PORT}")
@@ -0,0 +1,211 @@
+# rag_service/metrics.py
+
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Seconds; covers everything from a vector lookup to a long CPU generation.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = [(key, list(series)) for key, series in self.series.items()]
+        for key, series in items:
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': bound})} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Minimal Prometheus text-format registry: histograms plus collector callbacks
+    that report gauges (name, labels, value) at scrape time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.collectors = []
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(name, help_text, labelnames, buckets)
+            return self.histograms[name]
+
+    def register_collector(self, collector):
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            histograms = list(self.histograms.values())
+            collectors = list(self.collectors)
+        for histogram in histograms:
+            lines.extend(histogram.render())
+        seen = set()
+        for collector in collectors:
+            for name, labels, value in collector():
+                if name not in seen:
+                    lines.append(f"# TYPE {name} gauge")
+                    seen.add(name)
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "felchat_stage_seconds", "Time spent in each request processing stage.", ("stage",)
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "felchat_http_request_seconds", "Total time spent handling an HTTP request.", ("endpoint", "status")
+)
+
+_request_state = threading.local()
+
+
+def start_request(request_id=None) -> str:
+    """
+    Starts collecting stage timings for the request handled by this thread.
+    """
+    _request_state.request_id = request_id or uuid.uuid4().hex
+    _request_state.timings = {}
+    return _request_state.request_id
+
+
+def current_request_id():
+    return getattr(_request_state, "request_id", None)
+
+
+def current_timings() -> dict:
+    return dict(getattr(_request_state, "timings", {}))
+
+
+def record_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = getattr(_request_state, "timings", None)
+    if timings is not None:
+        timings[f"{stage}_sec"] = timings.get(f"{stage}_sec", 0.0) + seconds
+
+
+@contextmanager
+def span(stage):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - t0)
+
+
+def run_in_request(request_id, fn, *args, **kwargs):
+    """
+    Runs fn on a pool thread as part of request `request_id` and returns (result,
+    the stage timings it recorded), for the submitting thread to merge_timings.
+    """
+    previous = getattr(_request_state, "request_id", None), getattr(_request_state, "timings", None)
+    _request_state.request_id, _request_state.timings = request_id, {}
+    try:
+        return fn(*args, **kwargs), _request_state.timings
+    finally:
+        _request_state.request_id, _request_state.timings = previous
+
+
+def merge_timings(timings, prefix=""):
+    """
+    Adds timings measured on another thread to the current request's, without
+    observing the stage histograms again.
+    """
+    own = getattr(_request_state, "timings", None)
+    if own is None:
+        return
+    for key, seconds in timings.items():
+        own[f"{prefix}{key}"] = own.get(f"{prefix}{key}", 0.0) + seconds
+
+
+def client_metrics_collector(client):
+    """
+    Exposes a http_client.ResilientClient's counters, breaker and pools as gauges.
+    """
+    def collect():
+        m = client.metrics()
+        labels = {"client": m["name"]}
+        yield "felchat_http_client_requests", labels, m["requests"]
+        yield "felchat_http_client_failures", labels, m["failures"]
+        yield "felchat_http_client_retries", labels, m["retries"]
+        yield "felchat_http_client_breaker_open", labels, int(m["breaker"]["state"] != "closed")
+        yield "felchat_http_client_breaker_trips", labels, m["breaker"]["trips"]
+        yield "felchat_http_client_breaker_rejected", labels, m["breaker"]["rejected"]
+        for pool in m["pools"]:
+            pool_labels = {**labels, "host": f"{pool['host']}:{pool['port']}"}
+            yield "felchat_http_client_pool_connections_opened", pool_labels, pool["connections_opened"]
+            yield "felchat_http_client_pool_requests", pool_labels, pool["requests"]
+    return collect
+
+
+def install_flask_metrics(app):
+    """
+    Adds request-id propagation, per-request timing and a GET /metrics endpoint to a Flask app.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_start = time.perf_counter()
+        start_request(request.headers.get(REQUEST_ID_HEADER))
+
+    @app.after_request
+    def _finish_request_timer(response):
+        start = g.pop("metrics_start", None)
+        if start is not None and request.endpoint != "prometheus_metrics":
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start, endpoint=request.endpoint or "unknown", status=response.status_code
+            )
+        request_id = current_request_id()
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+
+    @app.route("/metrics", methods=["GET"], endpoint="prometheus_metrics")
+    def prometheus_metrics():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,233 @@
+# rag_service/profiler.py
+
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILER_TOKEN_ENV = "PROFILER_TOKEN"
+# Not counted towards a "profile the next K requests" session
+ADMIN_ENDPOINTS = ("profile_start", "profile_stop", "profile_report", "profile_collapsed", "prometheus_metrics")
+# Leaf frames (module file, function) of threads waiting for work: werkzeug's
+# select loop, idle executor workers, queue consumers, condition/event waits, joins
+# and child processes. Blocking C calls such as time.sleep leave no frame of their
+# own, so the polling loops of this service are listed by the function that
+# sleeps; while they do work, their leaf is a deeper frame.
+IDLE_FUNCTIONS = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("subprocess.py", "_try_wait"),
+    ("main.py", "monitor_new_files"),
+    ("replication.py", "_run"),
+}
+
+
+def is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FUNCTIONS
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: a background thread snapshots the stacks of all other
+    threads every `interval` seconds via sys._current_frames(). Nothing is hooked
+    into the interpreter, so there is no cost at all while it is not running.
+
+    A session ends after `duration` seconds, or once `requests` more requests have
+    finished (see request_finished), whichever comes first. Threads that are only
+    waiting (is_idle) are counted in idle_samples rather than in the stacks, unless
+    the session is started with include_idle.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = False
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self.include_idle = False
+        self.requests_left = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self, duration=None, requests=None, interval=0.005, include_idle=False):
+        with self.lock:
+            if self.running:
+                raise RuntimeError("A profiling session is already running")
+            self.running = True
+            self.stacks = Counter()
+            self.samples = 0
+            self.idle_samples = 0
+            self.include_idle = include_idle
+            self.requests_left = requests
+            self.stop_event.clear()
+            self.started_at = time.time()
+            self.finished_at = None
+        self.thread = threading.Thread(
+            target=self._run, args=(duration, interval), name="sampling-profiler", daemon=True
+        )
+        self.thread.start()
+
+    def request_finished(self):
+        # Called after every request; a single attribute read when idle.
+        if self.requests_left is None:
+            return
+        with self.lock:
+            if self.requests_left is not None:
+                self.requests_left -= 1
+                if self.requests_left <= 0:
+                    self.stop_event.set()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self, duration, interval):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + duration if duration else None
+        while not self.stop_event.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if not self.include_idle and is_idle(frame):
+                    self.idle_samples += 1
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                with self.lock:
+                    self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(interval)
+        with self.lock:
+            self.running = False
+            self.requests_left = None
+            self.finished_at = time.time()
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "running": self.running,
+                "samples": self.samples,
+                "idle_samples": self.idle_samples,
+                "requests_left": self.requests_left,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+    def collapsed(self) -> str:
+        """
+        Brendan Gregg's collapsed-stack format, ready for flamegraph.pl or speedscope.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks_copy().most_common())
+
+    def _stacks_copy(self) -> Counter:
+        # The sampler keeps adding to self.stacks while a session runs
+        with self.lock:
+            return Counter(self.stacks)
+
+    def top_functions(self, limit=30) -> list:
+        """
+        Per-function sample counts: `self` is time spent in the function itself,
+        `total` includes its callees.
+        """
+        stacks = self._stacks_copy()
+        self_counts, total_counts = Counter(), Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            self_counts[frames[-1]] += count
+            for frame in set(frames):
+                total_counts[frame] += count
+        all_samples = sum(stacks.values()) or 1
+        return [
+            {
+                "function": frame,
+                "self": self_counts[frame],
+                "total": total,
+                "self_pct": round(100.0 * self_counts[frame] / all_samples, 2),
+                "total_pct": round(100.0 * total / all_samples, 2),
+            }
+            for frame, total in sorted(total_counts.items(), key=lambda kv: (-self_counts[kv[0]], -kv[1]))[:limit]
+        ]
+
+
+def install_flask_profiler(app, profiler=None):
+    """
+    Adds token-protected admin endpoints to a Flask app:
+
+        POST /admin/profile/start   {"seconds": 30} or {"requests": 20}, optional "interval"
+                                    and "include_idle"
+        GET  /admin/profile         status and top-functions table
+        GET  /admin/profile/collapsed   collapsed stacks (flame graph input)
+        POST /admin/profile/stop
+
+    Requests need "Authorization: Bearer $PROFILER_TOKEN"; without the env var the
+    endpoints are disabled.
+    """
+    from flask import Response, jsonify, request
+
+    profiler = profiler or SamplingProfiler()
+
+    def authorized():
+        token = os.getenv(PROFILER_TOKEN_ENV)
+        given = request.headers.get("Authorization", "")
+        return bool(token) and hmac.compare_digest(given.encode(), f"Bearer {token}".encode())
+
+    @app.after_request
+    def _count_profiled_request(response):
+        if request.endpoint not in ADMIN_ENDPOINTS:
+            profiler.request_finished()
+        return response
+
+    @app.route("/admin/profile/start", methods=["POST"], endpoint="profile_start")
+    def profile_start():
+        if not authorized():
+            return jsonify({"error": "Unauthorized"}), 401
+        data = request.get_json(silent=True) or {}
+        seconds, requests_ = data.get("seconds"), data.get("requests")
+        if not seconds and not requests_:
+            return jsonify({"error": "Give \"seconds\" or \"requests\""}), 400
+        # A request-count session still gets a time limit so it cannot run forever.
+        duration = float(seconds) if seconds else 600.0
+        try:
+            profiler.start(duration=duration, requests=int(requests_) if requests_ else None,
+                           interval=float(data.get("interval", 0.005)),
+                           include_idle=bool(data.get("include_idle", False)))
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 409
+        return jsonify(profiler.status()), 202
+
+    @app.route("/admin/profile/stop", methods=["POST"], endpoint="profile_stop")
+    def profile_stop():
+        if not authorized():
+            return jsonify({"error": "Unauthorized"}), 401
+        profiler.stop()
+        return jsonify(profiler.status())
+
+    @app.route("/admin/profile", methods=["GET"], endpoint="profile_report")
+    def profile_report():
+        if not authorized():
+            return jsonify({"error": "Unauthorized"}), 401
+        limit = request.args.get("limit", default=30, type=int)
+        return jsonify({**profiler.status(), "top_functions": profiler.top_functions(limit)})
+
+    @app.route("/admin/profile/collapsed", methods=["GET"], endpoint="profile_collapsed")
+    def profile_collapsed():
+        if not authorized():
+            return jsonify({"error": "Unauthorized"}), 401
+        return Response(profiler.collapsed(), mimetype="text/plain",
+                        headers={"Content-Disposition": "attachment; filename=profile.collapsed"})
+
+    return profiler
@@ -1,41 +1,61 @@
 # rag_service/rag_service.py
 
-import requests
 import re
+import threading
 import time
 import os # <--- ADD THIS IMPORT
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from admission import DeadlineExceeded, Overloaded, check_deadline, remaining
+from http_client import LOAD_SHED_HEADER, ResilientClient
+from metrics import REQUEST_ID_HEADER, current_request_id, record_stage, span
+from trace_log import note
 
 class RAGService:
     def __init__(self, index_manager):
         self.index_manager = index_manager
-        self.conversation_history = []
         
         default_llm_server_url = "http://localhost:8003/chat" # Default for local, non-Docker runs
         self.server_url = os.getenv("LLM_CHAT_SERVER_URL", default_llm_server_url)
 
+        # Shared keep-alive pool to the LLM server; generation can be slow, so the
+        # read timeout is generous, but a dead server is detected within seconds.
+        self.llm_client = ResilientClient(
+            "llm",
+            connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", "3")),
+            read_timeout=float(os.getenv("LLM_READ_TIMEOUT", "300")),
+            retries=int(os.getenv("LLM_RETRIES", "2")),
+            pool_maxsize=int(os.getenv("LLM_POOL_MAXSIZE", "10")),
+            failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("LLM_BREAKER_RESET_SEC", "30")),
+        )
+
     def retrieve(self, query: str) -> list:
         """
         Use the manager's (sentence-window) query engine for retrieval.
         """
 
-        engine = self.index_manager.get_query_engine()
-
-        print("[RAGService] docstore at retrieval time:")
+        source_nodes = self.index_manager.retrieve_nodes(query)
+        return self._unique_texts(source_nodes)
 
-        results = engine.query(query)
-
-        unique_email_ids = set()
+    @staticmethod
+    def _unique_texts(source_nodes) -> list:
+        # One text per email; PDF nodes have no email_id and are deduplicated by text.
+        seen = set()
         unique_texts = []
-        for source_node in results.source_nodes:
+        for source_node in source_nodes:
             node = getattr(source_node, "node", source_node)
             email_id = node.metadata.get("email_id")
-            if email_id not in unique_email_ids:
-                unique_email_ids.add(email_id)
+            key = ("email", email_id) if email_id is not None else ("text", node.text)
+            if key not in seen:
+                seen.add(key)
                 unique_texts.append(node.text)
         return unique_texts
 
     
-    def generate_completion(self, query: str, context_docs: list[str]) -> str:
+    def generate_completion(self, query: str, context_docs: list[str], conversation_history=None) -> str:
         """
         Whichever function you used to call OpenAI. For example:
         """
@@ -43,10 +63,10 @@ class RAGService:
         # prompt = build_prompt(query, context_docs, conversation_history)
         # call openai.ChatCompletion.create(...)
         # return that text
-        return self.generate_answer(query, context_docs)
+        return self.generate_answer(query, context_docs, conversation_history)
 
     
-    def query(self, query: str):
+    def query(self, query: str, conversation_history=None):
         timings = {}
 
         # Measure retrieval
@@ -56,23 +76,90 @@ class RAGService:
         timings["retrieval_time_sec"] = t1 - t0
 
         # Measure answer generation
+        check_deadline("generation")
         t2 = time.time()
-        answer, context, messages = self.generate_completion(query, docs)
+        answer, context, messages = self.generate_completion(query, docs, conversation_history)
         t3 = time.time()
         timings["generation_time_sec"] = t3 - t2
 
         timings["rag_total_time_sec"] = t3 - t0
 
         return answer, docs, context, messages, timings
+
+    def query_batch(self, questions, max_workers=4, completed_ids=(), retrieval_batch_size=64, rerank_batch_size=64,
+                    overloaded_wait_sec=600.0):
+        """
+        Answers many independent questions ({"id", "question", ...}) at once.
+        Retrieval is batched per chunk of `retrieval_batch_size` questions and the LLM
+        calls run on a bounded pool. Results are yielded as they complete, in the
+        evaluated_questions_* format; ids in `completed_ids` are skipped (resume).
+        A question that is still shed after `overloaded_wait_sec` ends the batch with
+        Overloaded, and closing the generator cancels the questions not yet started.
+        """
+        completed = {str(i) for i in completed_ids}
+        pending = [q for q in questions if str(q.get("id")) not in completed]
+        closed = threading.Event()
+
+        def generate(item, docs, retrieval_time):
+            t0 = time.time()
+            while True:
+                try:
+                    answer, context, messages = self.generate_completion(item["question"], docs)
+                    break
+                except Overloaded as e:
+                    # Offline work yields to interactive traffic, but not forever.
+                    if closed.is_set() or time.time() + e.retry_after > t0 + overloaded_wait_sec:
+                        raise
+                    closed.wait(e.retry_after)
+            generation_time = time.time() - t0
+            return {
+                **item,
+                "answer_generated": answer,
+                "context": context,
+                "messages": messages,
+                "timing": {
+                    "retrieval_time_sec": retrieval_time,
+                    "generation_time_sec": generation_time,
+                    "rag_total_time_sec": retrieval_time + generation_time,
+                },
+            }
+
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+        futures = []
+        try:
+            for start in range(0, len(pending), retrieval_batch_size):
+                chunk = pending[start:start + retrieval_batch_size]
+                t0 = time.time()
+                node_lists = self.index_manager.retrieve_nodes_batch(
+                    [item["question"] for item in chunk], rerank_batch_size=rerank_batch_size
+                )
+                # Amortised over the chunk, so it stays comparable with single-query runs
+                retrieval_time = (time.time() - t0) / len(chunk)
+                for item, nodes in zip(chunk, node_lists):
+                    futures.append(pool.submit(generate, item, self._unique_texts(nodes), retrieval_time))
+
+                for future in [f for f in futures if f.done()]:
+                    futures.remove(future)
+                    yield future.result()
+
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # Also reached when the client disconnects (GeneratorExit): drop the queued
+            # generations instead of waiting for them; running ones finish on their own.
+            closed.set()
+            pool.shutdown(wait=False, cancel_futures=True)
         
     
-    def generate_answer(self, user_question, retrieved_documents, model_temperature=0.1, model_name="gpt-4o-mini"):
+    def generate_answer(self, user_question, retrieved_documents, conversation_history=None, model_temperature=0.1, model_name="gpt-4o-mini"):
         """
         Generates an answer using OpenAI's API based on retrieved documents.
         This version instructs the LLM to only report the exact data found and its source.
         """
         if not retrieved_documents:
-            return "No relevant documents found to answer the question."
+            return "No relevant documents found to answer the question.", "", []
+
+        prompt_build_start = time.perf_counter()
 
         # Construct the context prompt using the retrieved documents.
         context = "\n\n".join([f"Document {idx + 1}: {doc}" for idx, doc in enumerate(retrieved_documents)])
@@ -105,28 +192,49 @@ class RAGService:
         messages = [{"role": "system", "content": system_message}]
         
         # Append previous conversation history if available
-        if self.conversation_history:
-            messages.extend(self.conversation_history)
+        if conversation_history:
+            messages.extend(conversation_history)
 
         # Add the current user message with the prompt
         messages.append({"role": "user", "content": prompt})
-
-
-
-        import json
-        print("Messages:\n" + json.dumps(messages, indent=4, ensure_ascii=False))
+        record_stage("prompt_build", time.perf_counter() - prompt_build_start)
 
         try:
             answer = self.send_prompt(messages)
             return answer, context, messages
+        except (Overloaded, DeadlineExceeded):
+            raise
         except Exception as e:
-            return f"Error generating response: {str(e)}"
+            return f"Error generating response: {str(e)}", context, messages
      
 
     def send_prompt(self,prompt):
-        response = requests.post(self.server_url, json={"prompt": prompt})
+        headers = {}
+        if current_request_id():
+            headers[REQUEST_ID_HEADER] = current_request_id()
+        # The LLM server gets the rest of our deadline and stops generating early
+        # enough to answer within it.
+        left = remaining()
+        if left is not None:
+            check_deadline("llm_http")
+        with span("llm_http"):
+            try:
+                response = self.llm_client.post(self.server_url, json={"prompt": prompt}, headers=headers, budget=left)
+            except requests.Timeout as e:
+                if left is not None:
+                    raise DeadlineExceeded(f"LLM did not answer within the deadline: {e}") from e
+                raise
+        if response.status_code == 503 and response.headers.get(LOAD_SHED_HEADER):
+            raise Overloaded(f"LLM server overloaded: {response.text}", float(response.headers.get("Retry-After", 1)))
+        if response.status_code == 504:
+            raise DeadlineExceeded(f"LLM server: {response.text}")
         if response.status_code == 200:
-            full_response = response.json()["response"]
+            response_data = response.json()
+            # Stage timings measured inside the LLM server, reported back for this request
+            for stage, seconds in response_data.get("timings", {}).items():
+                record_stage(f"llm_{stage.removesuffix('_sec')}", seconds)
+            note(**response_data.get("usage", {}))
+            full_response = response_data["response"]
             # Find all assistant responses
             matches = re.findall(r"<\|assistant\|>\s*(.*?)(?=<\|user\|>|$)", full_response, re.DOTALL)
             if matches:
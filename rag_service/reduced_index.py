@@ -0,0 +1,202 @@
+# rag_service/reduced_index.py
+#
+# Reduced-dimension scan for IndexManager's vector search. A PCA projection is
+# learned from the index's own (L2-normalised) node vectors; queries are scanned
+# against the projected matrix (e.g. 96 instead of 384 floats per node), and only
+# the best `candidates` hits are re-scored with their full vectors, so the scores
+# returned are the exact cosine similarities of the full search.
+#
+# With x ~ mean + C^T C (x - mean), x.q ~ mean.q + (C (x - mean)).(C q), and mean.q
+# is the same for every node of one query, so ranking by (C (x - mean)).(C q) is
+# enough to pick the candidates.
+#
+# The projection is persisted next to the index (reduced_projection.npz) and refit
+# when the corpus has changed a lot: it grew or shrank by more than refit_growth,
+# or the share of the corpus' variance it captures fell by more than refit_drift.
+
+import os
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_REDUCED_CONFIG = {
+    "enabled": True,
+    "dimensions": 96,
+    # Candidates re-scored with full vectors: max(candidate_factor * top_k, min_candidates)
+    "candidate_factor": 4,
+    "min_candidates": 24,
+    # Below this many nodes the full scan is cheap enough; the projection is not used.
+    "min_nodes": 2000,
+    # At most this many node vectors are used to fit the projection.
+    "fit_sample": 50000,
+    "refit_growth": 0.5,
+    "refit_drift": 0.05,
+}
+
+PROJECTION_FILE = "reduced_projection.npz"
+
+
+def _normalize(vectors):
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return vectors
+
+
+def fit_projection(vectors, dimensions, sample=None, seed=0):
+    """
+    PCA of (normalised) `vectors`: returns (mean, components, explained) where
+    components is (dimensions, full dimension) and explained the share of the
+    variance the components capture.
+    """
+    if sample and len(vectors) > sample:
+        rows = np.random.RandomState(seed).choice(len(vectors), sample, replace=False)
+        vectors = vectors[rows]
+    mean = vectors.mean(axis=0)
+    centered = vectors - mean
+    covariance = centered.T @ centered / max(1, len(vectors) - 1)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    order = np.argsort(eigenvalues)[::-1][:dimensions]
+    total = float(eigenvalues.clip(min=0).sum())
+    explained = float(eigenvalues[order].clip(min=0).sum()) / total if total > 0 else 1.0
+    return mean.astype(np.float32), eigenvectors[:, order].T.astype(np.float32), explained
+
+
+def captured_variance(vectors, mean, components):
+    centered = vectors - mean
+    total = float(np.einsum("ij,ij->", centered, centered))
+    if total <= 0:
+        return 1.0
+    projected = centered @ components.T
+    return float(np.einsum("ij,ij->", projected, projected)) / total
+
+
+class ReducedIndex:
+    """
+    The projected scan matrix of one IndexManager. The matrix is dropped with every
+    index change (invalidate) and rebuilt from the vector store on the next search;
+    the projection survives changes until the refit checks say otherwise.
+    """
+
+    def __init__(self, index_path, config=None):
+        self.config = {**DEFAULT_REDUCED_CONFIG, **(config or {})}
+        self.path = os.path.join(index_path, PROJECTION_FILE)
+        self.lock = threading.Lock()
+        self.projection = self._load()
+        self.matrix = None  # (node ids, projected rows, projection) of the current index version
+        self.fits = 0
+
+    def _load(self):
+        try:
+            with np.load(self.path) as data:
+                projection = {key: data[key] for key in data.files}
+        except (OSError, ValueError):
+            return None
+        if projection["components"].shape[0] != self.config["dimensions"]:
+            return None
+        return {
+            "mean": projection["mean"],
+            "components": projection["components"],
+            "explained": float(projection["explained"]),
+            "nodes": int(projection["nodes"]),
+            "fitted_at": float(projection["fitted_at"]),
+        }
+
+    def _save(self):
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path, **self.projection)
+        os.replace(tmp_path, self.path)
+
+    def invalidate(self):
+        self.matrix = None
+
+    def reset(self):
+        """
+        Forgets the projection too (the index was rebuilt from scratch).
+        """
+        with self.lock:
+            self.projection = None
+            self.matrix = None
+
+    def _needs_refit(self, vectors):
+        projection = self.projection
+        if projection is None:
+            return True
+        growth = abs(len(vectors) - projection["nodes"]) / max(1, projection["nodes"])
+        if growth > self.config["refit_growth"]:
+            return True
+        sample = vectors
+        if self.config["fit_sample"] and len(vectors) > self.config["fit_sample"]:
+            rows = np.random.RandomState(1).choice(len(vectors), self.config["fit_sample"], replace=False)
+            sample = vectors[rows]
+        captured = captured_variance(sample, projection["mean"], projection["components"])
+        return projection["explained"] - captured > self.config["refit_drift"]
+
+    def _refit(self, vectors):
+        t0 = time.perf_counter()
+        mean, components, explained = fit_projection(
+            vectors, self.config["dimensions"], self.config["fit_sample"]
+        )
+        self.projection = {
+            "mean": mean, "components": components, "explained": explained,
+            "nodes": len(vectors), "fitted_at": time.time(),
+        }
+        self.fits += 1
+        self._save()
+        print(f"[ReducedIndex] Fitted {len(components)}-dim projection on {len(vectors)} nodes "
+              f"({explained:.1%} of the variance) in {time.perf_counter() - t0:.2f}s")
+
+    def get_matrix(self, embedding_dict, index_lock):
+        """
+        (node ids, projected rows, projection), or None while the index is below min_nodes.
+        `index_lock` (the IndexManager's) is held while the matrix is built, so the
+        vector store does not change underneath.
+        """
+        matrix = self.matrix
+        if matrix is None:
+            with index_lock, self.lock:
+                if self.matrix is None:
+                    if len(embedding_dict) < max(self.config["min_nodes"], self.config["dimensions"] + 1):
+                        return None
+                    node_ids = list(embedding_dict.keys())
+                    vectors = _normalize(np.asarray([embedding_dict[n] for n in node_ids], dtype=np.float32))
+                    if self._needs_refit(vectors):
+                        self._refit(vectors)
+                    projection = self.projection
+                    rows = (vectors - projection["mean"]) @ projection["components"].T
+                    self.matrix = (node_ids, np.ascontiguousarray(rows, dtype=np.float32), projection)
+                matrix = self.matrix
+        return matrix
+
+    def search(self, embedding_dict, index_lock, query_vectors, k):
+        """
+        Top-k node ids and exact cosine scores per query: reduced scan, then
+        re-scoring of the candidates with the full vectors. None if not active.
+        """
+        matrix = self.get_matrix(embedding_dict, index_lock)
+        if matrix is None:
+            return None
+        node_ids, rows, projection = matrix
+        query_vectors = _normalize(np.array(query_vectors, dtype=np.float32))
+        approx = (query_vectors @ projection["components"].T) @ rows.T
+        n_candidates = min(len(node_ids), max(k * self.config["candidate_factor"], self.config["min_candidates"], k))
+        top = np.argpartition(-approx, n_candidates - 1, axis=1)[:, :n_candidates]
+
+        results = []
+        for query, candidates in zip(query_vectors, top):
+            # Nodes deleted since the matrix was taken are dropped
+            candidate_ids = [node_ids[i] for i in candidates if node_ids[i] in embedding_dict]
+            full = _normalize(np.asarray([embedding_dict[n] for n in candidate_ids], dtype=np.float32))
+            scores = full @ query
+            order = np.argsort(-scores)[:k]
+            results.append([(candidate_ids[i], float(scores[i])) for i in order])
+        return results
+
+    def stats(self) -> dict:
+        projection, matrix = self.projection, self.matrix
+        stats = {"dimensions": self.config["dimensions"], "active": matrix is not None, "fits": self.fits}
+        if projection is not None:
+            stats.update(explained=round(projection["explained"], 4), fitted_nodes=projection["nodes"],
+                         fitted_at=projection["fitted_at"])
+        if matrix is not None:
+            stats["scan_matrix_mb"] = round(matrix[1].nbytes / 2**20, 2)
+        return stats
@@ -0,0 +1,331 @@
+# rag_service/replication.py
+#
+# Writer/replica split for the rag service (RAG_ROLE=writer|replica). Per index the
+# shared directory holds:
+#
+#   <directory>/<index>/snapshots/<version>/   copy of the persisted index
+#   <directory>/<index>/LATEST                  {"version": ..., "ts": ...} of the newest snapshot
+#   <directory>/<index>/changes.jsonl           changes after that snapshot, one JSON line each
+#
+# Every change gets the next sequence number; a snapshot's version is the sequence
+# number of the last change it contains. Publishing a snapshot starts a new, empty
+# change log (a new file, so followers notice the switch).
+
+import json
+import os
+import shutil
+import threading
+import time
+
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+
+from index_manager import IndexManager
+
+SNAPSHOTS_DIR = "snapshots"
+LATEST_FILE = "LATEST"
+CHANGES_FILE = "changes.jsonl"
+
+
+def _write_atomic(path, text):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_latest(index_root):
+    try:
+        with open(os.path.join(index_root, LATEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class IndexPublisher:
+    """
+    Writer side: listens to an IndexManager's changes, appends them to the change
+    log and publishes a fresh snapshot every `snapshot_every` changes and after a
+    rebuild. Old snapshots beyond `keep_snapshots` are removed.
+    """
+
+    def __init__(self, manager, directory, snapshot_every=200, keep_snapshots=2):
+        self.manager = manager
+        self.root = os.path.join(directory, manager.index_name)
+        self.snapshot_every = snapshot_every
+        self.keep_snapshots = keep_snapshots
+        os.makedirs(os.path.join(self.root, SNAPSHOTS_DIR), exist_ok=True)
+        self.seq = self._last_published_seq()
+        self.changes_since_snapshot = 0
+        with manager.lock:
+            manager.change_listeners.append(self.on_change)
+            # Whatever happened while no writer was running is captured by a new snapshot.
+            self.seq += 1
+            self.publish_snapshot()
+
+    def _last_published_seq(self) -> int:
+        seq = (read_latest(self.root) or {}).get("version", 0)
+        try:
+            with open(os.path.join(self.root, CHANGES_FILE), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        seq = max(seq, json.loads(line)["seq"])
+                    except (ValueError, KeyError):
+                        continue
+        except OSError:
+            pass
+        return seq
+
+    def _node_record(self, node):
+        record = doc_to_json(node)
+        embedding_dict = self.manager.index.vector_store.data.embedding_dict
+        return {"node": record, "embedding": embedding_dict.get(node.node_id)}
+
+    def on_change(self, op, payload=None):
+        self.seq += 1
+        if op == "reset":
+            self.publish_snapshot()
+            return
+        entry = {"seq": self.seq, "ts": time.time(), "op": op}
+        if op == "add":
+            entry["nodes"] = [self._node_record(node) for node in payload]
+        elif op == "delete":
+            entry["node_ids"] = list(payload)
+        with open(os.path.join(self.root, CHANGES_FILE), "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.changes_since_snapshot += 1
+        if self.changes_since_snapshot >= self.snapshot_every:
+            self.publish_snapshot()
+
+    def publish_snapshot(self):
+        with self.manager.lock:
+            snapshots = os.path.join(self.root, SNAPSHOTS_DIR)
+            target = os.path.join(snapshots, f"{self.seq:012d}")
+            tmp_target = os.path.join(snapshots, f".tmp-{self.seq:012d}")
+            if not os.path.exists(target):
+                # Batches added with persist=False must be in the snapshot too
+                self.manager.persist()
+                shutil.rmtree(tmp_target, ignore_errors=True)
+                shutil.copytree(self.manager.index_path, tmp_target)
+                os.replace(tmp_target, target)
+            _write_atomic(os.path.join(self.root, LATEST_FILE), json.dumps({"version": self.seq, "ts": time.time()}))
+            _write_atomic(os.path.join(self.root, CHANGES_FILE), "")
+            self.changes_since_snapshot = 0
+
+            versions = sorted(d for d in os.listdir(snapshots) if not d.startswith("."))
+            for old in versions[:-self.keep_snapshots]:
+                shutil.rmtree(os.path.join(snapshots, old), ignore_errors=True)
+            print(f"[replication] {self.manager.index_name}: published snapshot {self.seq}")
+
+
+class IndexFollower:
+    """
+    Replica side of one index: loads the newest snapshot into a private local
+    copy and applies the change log on top of it. `on_swap(manager)` is called
+    whenever a new snapshot replaces the served IndexManager; the replaced copy is
+    deleted `retire_after_sec` later, once requests still holding it are done.
+    """
+
+    def __init__(self, index_config, directory, local_dir, on_swap=None, retire_after_sec=60.0, **manager_kwargs):
+        self.index_config = index_config
+        self.name = index_config["name"]
+        self.root = os.path.join(directory, self.name)
+        self.local_dir = local_dir
+        self.on_swap = on_swap
+        self.retire_after_sec = retire_after_sec
+        self.manager_kwargs = manager_kwargs
+        self.manager = None
+        self.seq = 0
+        self.snapshot_version = None
+        self.log_inode = None
+        self.log_offset = 0
+        self.caught_up_at = None
+        self.reloads = 0
+        self.applied = 0
+        # (retired at, local directory) of replaced snapshot copies
+        self.retired = []
+
+    def load_latest(self) -> bool:
+        latest = read_latest(self.root)
+        if latest is None:
+            raise RuntimeError(f"No snapshot published for index {self.name} in {self.root}")
+        version = latest["version"]
+        local_root = os.path.join(self.local_dir, f"{version:012d}")
+        shutil.rmtree(local_root, ignore_errors=True)
+        try:
+            shutil.copytree(os.path.join(self.root, SNAPSHOTS_DIR, f"{version:012d}"),
+                            os.path.join(local_root, self.name))
+        except FileNotFoundError:
+            # Pruned between reading LATEST and copying; a newer LATEST is already there.
+            shutil.rmtree(local_root, ignore_errors=True)
+            return False
+
+        manager = IndexManager(
+            index_name=self.name,
+            index_dir=local_root,
+            window_size=self.index_config["window_size"],
+            similarity_top_k=self.index_config.get("top_k", 6),
+            **self.manager_kwargs,
+        )
+        previous = self.manager
+        self.manager = manager
+        self.seq = self.snapshot_version = version
+        self.log_inode, self.log_offset = None, 0
+        self.reloads += 1
+        if previous is not None and self.on_swap is not None:
+            self.on_swap(manager)
+        if previous is not None:
+            self.retired.append((time.time(), os.path.dirname(previous.index_path)))
+        print(f"[replication] {self.name}: serving snapshot {version}")
+        return True
+
+    def _remove_retired(self):
+        while self.retired and time.time() - self.retired[0][0] >= self.retire_after_sec:
+            _, local_root = self.retired.pop(0)
+            shutil.rmtree(local_root, ignore_errors=True)
+
+    def poll(self):
+        """
+        Applies new change-log entries; reloads a snapshot when entries were missed.
+        """
+        self._remove_retired()
+        log_path = os.path.join(self.root, CHANGES_FILE)
+        try:
+            f = open(log_path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self.log_inode:
+                latest = read_latest(self.root) or {}
+                if latest.get("version", 0) > self.seq:
+                    # A newer snapshot covers whatever the old log still had for us.
+                    self.load_latest()
+                    return
+                self.log_inode, self.log_offset = inode, 0
+            f.seek(self.log_offset)
+            while True:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break  # EOF, or a line the writer is still appending
+                self.log_offset += len(line)
+                entry = json.loads(line)
+                if entry["seq"] <= self.seq:
+                    continue
+                if entry["seq"] != self.seq + 1:
+                    self.load_latest()
+                    return
+                self._apply(entry)
+                self.seq = entry["seq"]
+                self.applied += 1
+        self.caught_up_at = time.time()
+
+    def _apply(self, entry):
+        if entry["op"] == "add":
+            nodes = []
+            for record in entry["nodes"]:
+                node = json_to_doc(record["node"])
+                node.embedding = record["embedding"]
+                nodes.append(node)
+            self.manager.insert_embedded_nodes(nodes)
+        elif entry["op"] == "delete":
+            self.manager.delete_node_ids(entry["node_ids"])
+
+    def lag(self):
+        """
+        How far the served index is behind the writer: (changes published but not
+        applied yet, seconds since the oldest of them was published). Reads only the
+        part of the change log past what poll() has consumed.
+        """
+        seq, inode, offset = self.seq, self.log_inode, self.log_offset
+        head, oldest_ts = seq, None
+        latest = read_latest(self.root) or {}
+        if latest.get("version", 0) > seq:
+            head, oldest_ts = latest["version"], latest.get("ts")
+        try:
+            with open(os.path.join(self.root, CHANGES_FILE), "rb") as f:
+                if os.fstat(f.fileno()).st_ino != inode:
+                    offset = 0
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry["seq"] > seq:
+                        head = max(head, entry["seq"])
+                        oldest_ts = min(oldest_ts, entry["ts"]) if oldest_ts is not None else entry["ts"]
+        except OSError:
+            pass
+        return head - seq, (max(0.0, time.time() - oldest_ts) if oldest_ts is not None else 0.0)
+
+    def status(self) -> dict:
+        lag_changes, lag_sec = self.lag()
+        return {
+            "index": self.name,
+            "seq": self.seq,
+            "snapshot_version": self.snapshot_version,
+            "applied_changes": self.applied,
+            "snapshot_loads": self.reloads,
+            "lag_changes": lag_changes,
+            # 0 when every change the writer published is visible here
+            "staleness_sec": lag_sec,
+            "last_poll_sec": time.time() - self.caught_up_at if self.caught_up_at else None,
+        }
+
+
+class ReplicaSync:
+    """
+    Polls all followers of a replica on a background thread.
+    """
+
+    def __init__(self, followers, poll_interval=1.0):
+        self.followers = followers
+        self.poll_interval = poll_interval
+        self.thread = threading.Thread(target=self._run, name="replica-sync", daemon=True)
+
+    def start(self):
+        for follower in self.followers:
+            follower.poll()
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            for follower in self.followers:
+                try:
+                    follower.poll()
+                except Exception as e:
+                    print(f"[replication] {follower.name}: sync failed: {e}")
+            time.sleep(self.poll_interval)
+
+    def status(self) -> list:
+        return [follower.status() for follower in self.followers]
+
+
+def start_replica(config, directory, local_dir, poll_interval=1.0, **manager_kwargs):
+    """
+    Builds a FederatedIndex served from the writer's snapshots and keeps it in sync.
+    Returns (indexes, sync).
+    """
+    from index_federation import FederatedIndex
+
+    followers = {}
+
+    def follow(index_config):
+        # Replicas do not ingest (no dedup) but search like the writer does
+        reduced = index_config.get("reduced_index", config.get("reduced_index"))
+        follower = IndexFollower(index_config, directory, local_dir, reduced=reduced, **manager_kwargs)
+        while not follower.load_latest():
+            time.sleep(poll_interval)
+        followers[index_config["name"]] = follower
+        return follower.manager
+
+    indexes = FederatedIndex.from_config(config, manager_factory=follow, **manager_kwargs)
+    for name, follower in followers.items():
+        follower.on_swap = lambda manager, name=name: indexes.managers.__setitem__(name, manager)
+    sync = ReplicaSync(list(followers.values()), poll_interval).start()
+    return indexes, sync
@@ -1,7 +1,12 @@
 import os
+import time
 import torch
 from flask import Flask, request, jsonify
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteria, StoppingCriteriaList
+from metrics import current_timings, install_flask_metrics, record_stage, span
+from profiler import install_flask_profiler
+from admission import AdmissionController, install_flask_admission, remaining
+from llm_workers import WorkerPool, memory_usage, share_model_memory
 
 # Setup
 print("Setting up environment and GPU...")
@@ -11,8 +16,9 @@ device = "cuda" if torch.cuda.is_available() else "cpu"
 print(f"Using device: {device}")
 
 # Choose ONE model to load
-model_name = "tiiuae/falcon-rw-1b"  # or "microsoft/phi-2", "distilgpt2"
+model_name = os.getenv("LLM_MODEL_NAME", "tiiuae/falcon-rw-1b")  # or "microsoft/phi-2", "distilgpt2"
 print(f"Loading model {model_name}. Please wait...")
+load_start = time.perf_counter()
 
 # Load model and tokenizer
 try:
@@ -23,15 +29,48 @@ try:
         device_map="auto",  # Auto-assign model to available device
     )
     tokenizer = AutoTokenizer.from_pretrained(model_name)
-    print("Model and tokenizer successfully loaded!")
+    model.eval()
+    print(f"Model and tokenizer successfully loaded in {time.perf_counter() - load_start:.1f}s!")
 except Exception as e:
     print("Error loading model:", e)
     raise e
 
 # Initialize Flask app
 app = Flask(__name__)
+install_flask_metrics(app)
+install_flask_profiler(app)
+# One generate() at a time by default: concurrent generations on one device only
+# slow each other down. Callers past the queue get 503 + Retry-After straight away.
+admission = AdmissionController(
+    "llm",
+    max_in_flight=int(os.getenv("LLM_MAX_IN_FLIGHT", "1")),
+    max_queue=int(os.getenv("LLM_MAX_QUEUE", "8")),
+)
+install_flask_admission(app, admission, endpoints=("chat",),
+                        default_budget=float(os.getenv("LLM_DEFAULT_BUDGET_SEC", "300")))
+# Time kept back from the deadline for detokenization and the response itself
+GENERATION_MARGIN_SEC = float(os.getenv("LLM_GENERATION_MARGIN_SEC", "0.5"))
+# LLM_WORKERS > 1 forks that many workers sharing the weights loaded above (see llm_workers.py)
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "1"))
+LLM_THREADS_PER_WORKER = int(os.getenv("LLM_THREADS_PER_WORKER", "0")) or None
+pool = None
 print("Flask app initialized.")
 
+
+class FirstTokenTimer(StoppingCriteria):
+    """
+    Never stops generation; only notes when the first new token was produced,
+    which splits generate() into prefill and decode time.
+    """
+
+    def __init__(self):
+        self.first_token_at = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
 # Chat endpoint
 @app.route("/chat", methods=["POST"])
 def chat():
@@ -47,27 +86,59 @@ def chat():
     print("Chat template applied, resulting text:\n", text)
 
     # Tokenize and move inputs to model device
-    inputs = tokenizer([text], return_tensors="pt").to(model.device)
+    with span("tokenization"):
+        inputs = tokenizer([text], return_tensors="pt").to(model.device)
     print("Inputs converted to tensor and moved to model device.")
 
-    # Generate output
+    # Generate output, cut short when the caller's deadline would otherwise pass
     print("Generating response...")
+    left = remaining()
+    max_time = max(0.0, left - GENERATION_MARGIN_SEC) if left is not None else None
+    first_token_timer = FirstTokenTimer()
+    generate_start = time.perf_counter()
     with torch.no_grad():
         outputs = model.generate(
             **inputs,
             max_new_tokens=1024,
-            pad_token_id=tokenizer.eos_token_id
+            max_time=max_time,
+            pad_token_id=tokenizer.eos_token_id,
+            stopping_criteria=StoppingCriteriaList([first_token_timer]),
         )
+    generate_end = time.perf_counter()
+    truncated = max_time is not None and generate_end - generate_start >= max_time
+    first_token_at = first_token_timer.first_token_at or generate_end
+    record_stage("prefill", first_token_at - generate_start)
+    record_stage("decode", generate_end - first_token_at)
     print("Response generation completed.")
 
     # Decode output
-    answer = tokenizer.decode(outputs[0], skip_special_tokens=True)
+    with span("detokenization"):
+        answer = tokenizer.decode(outputs[0], skip_special_tokens=True)
     print("Response decoding completed.")
     print("Final response:\n", answer)
 
-    return jsonify({"response": answer})
+    prompt_tokens = inputs["input_ids"].shape[1]
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": outputs.shape[1] - prompt_tokens}
+    return jsonify({"response": answer, "truncated": truncated, "timings": current_timings(), "usage": usage})
+
+
+@app.route("/worker", methods=["GET"])
+def worker():
+    stats = pool.worker_stats if pool is not None else {"worker": 0, "threads": torch.get_num_threads()}
+    return jsonify({**(stats or {}), "pid": os.getpid(), "now": memory_usage()})
 
 # Start the server
 if __name__ == "__main__":
-    print("Starting Flask server locally...")
-    app.run(host="0.0.0.0", port=8003, debug=True)
+    if LLM_WORKERS > 1 and device == "cpu":
+        print(f"Starting {LLM_WORKERS} workers sharing one copy of the weights...")
+        pool = WorkerPool(app, "0.0.0.0", 8003, LLM_WORKERS, LLM_THREADS_PER_WORKER,
+                          report_path=os.getenv("LLM_WORKER_REPORT"))
+        shared_bytes = share_model_memory(model)
+        pool.serve({"load_sec": time.perf_counter() - load_start, "shared_weights_mb": shared_bytes / 2**20})
+    else:
+        if LLM_WORKERS > 1:
+            print("LLM_WORKERS > 1 needs the model on the CPU (CUDA does not survive fork); serving one process.")
+        if LLM_THREADS_PER_WORKER:
+            torch.set_num_threads(LLM_THREADS_PER_WORKER)
+        print("Starting Flask server locally...")
+        app.run(host="0.0.0.0", port=8003, debug=True)
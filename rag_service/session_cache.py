@@ -0,0 +1,68 @@
+# rag_service/session_cache.py
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class ConversationSessionCache:
+    """
+    Bounded LRU cache of conversation histories keyed by conversation id.
+
+    The client tells us how many messages it believes we already hold (`version`)
+    and sends only the messages after that. If our copy is missing, expired or at
+    a different version, the delta is refused and the client must resync with the
+    full transcript.
+    """
+
+    def __init__(self, max_sessions=1000, ttl_sec=3600):
+        self.max_sessions = max_sessions
+        self.ttl_sec = ttl_sec
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()  # conversation_id -> (version, history, last_used)
+        self.hits = 0
+        self.misses = 0
+
+    def _evict(self, now):
+        while self.sessions:
+            oldest_id, (_, _, last_used) = next(iter(self.sessions.items()))
+            if len(self.sessions) <= self.max_sessions and now - last_used < self.ttl_sec:
+                break
+            del self.sessions[oldest_id]
+
+    def apply_delta(self, conversation_id, base_version, messages):
+        """
+        Appends `messages` to the session if it is at `base_version`.
+        Returns (new_version, a copy of the history) or None on a cache miss.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self._evict(now)
+            session = self.sessions.get(conversation_id)
+            if session is None or session[0] != base_version:
+                self.misses += 1
+                return None
+            self.hits += 1
+            history = session[1]
+            history.extend(messages)
+            version = base_version + len(messages)
+            self.sessions[conversation_id] = (version, history, now)
+            self.sessions.move_to_end(conversation_id)
+            # The cached list keeps growing; the request gets its own snapshot
+            return version, list(history)
+
+    def reset(self, conversation_id, messages):
+        """
+        Replaces the session with the full transcript. Returns (version, a copy of the history).
+        """
+        now = time.monotonic()
+        history = list(messages)
+        with self.lock:
+            self.sessions[conversation_id] = (len(history), history, now)
+            self.sessions.move_to_end(conversation_id)
+            self._evict(now)
+            return len(history), list(history)
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {"sessions": len(self.sessions), "hits": self.hits, "misses": self.misses}
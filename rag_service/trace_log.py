@@ -0,0 +1,142 @@
+# rag_service/trace_log.py
+#
+# One compact JSON line per answered /query: which nodes (with their dense and
+# rerank scores) the answer was built from, the adaptive retrieval action, the
+# prompt and completion token counts and the stage timings.
+#
+#   {"ts": ..., "request_id": "...", "message_id": 812, "conversation_id": 77,
+#    "question": "...", "action": "full", "candidates": 12,
+#    "nodes": [{"id": "...", "index": "index_fel_pdf_data", "dense": 0.83, "rerank": 4.1}, ...],
+#    "prompt_tokens": 911, "completion_tokens": 64, "timings": {...}}
+#
+# message_id is the bot Message the answer was written to, so traces join with
+# AnswerRating.message_id; request_id is the X-Request-ID shared with the Django and
+# LLM server logs. Records with a question can be replayed as a workload:
+#
+#   python benchmarks/load_test.py --questions data/traces/trace.jsonl
+#
+# The request thread only puts the record on a bounded queue; a background thread
+# appends batches to the file. When the queue is full the record is dropped and
+# counted rather than slowing the request down.
+
+import json
+import os
+import queue
+import threading
+import time
+
+DEFAULT_TRACE_CONFIG = {
+    "enabled": True,
+    "path": "data/traces/trace.jsonl",
+    "flush_interval_sec": 1.0,
+    "max_batch": 256,
+    "max_queue": 10000,
+    # The file is renamed to <path>.<unix time> once it grows past this; None never rotates.
+    "max_bytes": 100 * 2**20,
+    # Without the question text a trace cannot be replayed, but holds no user input.
+    "include_question": True,
+}
+
+_trace_state = threading.local()
+
+
+def begin_trace(**fields) -> dict:
+    """
+    Starts the trace of the request handled by this thread; note() adds to it.
+    """
+    _trace_state.trace = dict(fields)
+    return _trace_state.trace
+
+
+def current_trace():
+    return getattr(_trace_state, "trace", None)
+
+
+def end_trace():
+    trace = current_trace()
+    _trace_state.trace = None
+    return trace
+
+
+def note(**fields):
+    """
+    Adds fields to the current request's trace; a no-op outside a traced request.
+    """
+    trace = current_trace()
+    if trace is not None:
+        trace.update(fields)
+
+
+class TraceWriter:
+    """
+    Batched, append-only JSONL writer running on its own daemon thread.
+    """
+
+    def __init__(self, config=None):
+        self.config = {**DEFAULT_TRACE_CONFIG, **(config or {})}
+        self.path = self.config["path"]
+        self.queue = queue.Queue(maxsize=self.config["max_queue"])
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.stopping = threading.Event()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self.thread.start()
+
+    def emit(self, record):
+        if not self.config["include_question"]:
+            record.pop("question", None)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self):
+        # The first record opens a batch; it is written flush_interval_sec later or when full
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=self.config["flush_interval_sec"]))
+            deadline = time.monotonic() + self.config["flush_interval_sec"]
+            while len(batch) < self.config["max_batch"] and not self.stopping.is_set():
+                batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+        except queue.Empty:
+            pass
+        return batch
+
+    def _rotate(self):
+        max_bytes = self.config["max_bytes"]
+        try:
+            if max_bytes and os.path.getsize(self.path) >= max_bytes:
+                os.replace(self.path, f"{self.path}.{int(time.time())}")
+        except OSError:
+            pass
+
+    def _write(self, batch):
+        lines = "".join(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n" for record in batch)
+        try:
+            self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+            self.written += len(batch)
+            self.batches += 1
+        except OSError as e:
+            self.dropped += len(batch)
+            print(f"[trace_log] Could not write {len(batch)} traces to {self.path}: {e}")
+
+    def _run(self):
+        while not (self.stopping.is_set() and self.queue.empty()):
+            batch = self._drain()
+            if batch:
+                self._write(batch)
+
+    def close(self, timeout=5.0):
+        """
+        Writes what is still queued and stops the thread.
+        """
+        self.stopping.set()
+        self.thread.join(timeout)
+
+    def metrics(self) -> dict:
+        return {"written": self.written, "dropped": self.dropped, "batches": self.batches,
+                "queued": self.queue.qsize()}
@@ -1,48 +1,82 @@
 import streamlit as st
 import os
-from llama_index.core import load_index_from_storage, StorageContext
+import json
+from index_catalog import IndexCatalog, MAX_PAGE_SIZE
 
+# Where an index that is not in the config is looked for
 INDEX_DIR = "data/vectorstore/index_storage/"
 
-@st.cache_data  # Ensures cache is cleared when reloading
-def load_index(name):
+with open("data/configuration/config.json", "r", encoding="utf-8") as f:
+    _config = json.load(f)
+# The indexes the rag service hosts (name -> directory); any other name can still be typed in.
+INDEX_DIRECTORIES = {c["name"]: c["directory"] for c in (_config.get("indexes") or [_config["index"]])}
+CONFIGURED_INDEXES = list(INDEX_DIRECTORIES)
+
+
+def open_catalog(name):
     """
-    Loads an index from storage.
+    Read-only catalog of a persisted index; pages are read from disk on demand,
+    the index itself is never loaded.
     """
-    index_path = os.path.join(INDEX_DIR, name)
-    if not os.path.exists(index_path):
-        st.error(f"Index '{name}' does not exist.")
+    index_path = os.path.join(INDEX_DIRECTORIES.get(name, INDEX_DIR), name)
+    catalog = IndexCatalog(index_path, read_only=True)
+    if not catalog.exists():
+        st.error(f"Index '{name}' does not exist or has no catalog yet (start the rag service once).")
         return None
-    
-    storage_context = StorageContext.from_defaults(persist_dir=index_path)
-    index = load_index_from_storage(storage_context)
-    return index
+    return catalog
+
 
-def display_index(name):
+def display_page(name, catalog, query, filters, page_size):
     """
-    Displays stored document information from the specified index.
+    Displays one page of stored nodes from the specified index.
     """
-    index = load_index(name)
-    if index is None:
-        return
-    
-    st.title(f"📂 Documents in Index: {name}")
+    # Cursors of the pages seen so far, so "Previous" works with keyset pagination.
+    state_key = (name, query, tuple(sorted(filters.items())), page_size)
+    if st.session_state.get("browse_key") != state_key:
+        st.session_state.browse_key = state_key
+        st.session_state.cursors = [None]
 
-    documents = index.docstore.docs  # Retrieve stored documents
+    cursor = st.session_state.cursors[-1]
+    nodes, next_cursor = catalog.list_nodes(limit=page_size, cursor=cursor, query=query, filters=filters)
 
-    if not documents:
+    st.title(f"📂 Documents in Index: {name}")
+    st.caption(f"{catalog.count()} nodes in total · page {len(st.session_state.cursors)}")
+
+    if not nodes:
         st.warning("No documents found in this index.")
-        return
-    
-    for doc_id, doc in documents.items():
-        with st.expander(f"📜 Document ID: {doc_id}"):
-            st.write(f"**Content:** {doc.text[:500]}...")  # Show first 500 characters
-            st.json(doc.metadata)
+
+    for node in nodes:
+        with st.expander(f"📜 Node ID: {node['node_id']}"):
+            st.write(f"**Content:** {node['text'][:500]}")
+            window = node["metadata"].pop("window", None)
+            if window:
+                st.write(f"**Window:** {window[:1000]}")
+            st.json(node["metadata"])
+
+    previous_col, next_col = st.columns(2)
+    if previous_col.button("⬅ Previous", disabled=len(st.session_state.cursors) == 1):
+        st.session_state.cursors.pop()
+        st.rerun()
+    if next_col.button("Next ➡", disabled=next_cursor is None):
+        st.session_state.cursors.append(next_cursor)
+        st.rerun()
+
 
 # Streamlit UI
 st.sidebar.title("Index Viewer")
-index_name = st.sidebar.text_input("Enter Index Name", "index_email")
+index_name = st.sidebar.selectbox("Configured Indexes", CONFIGURED_INDEXES)
+index_name = st.sidebar.text_input("Enter Index Name", index_name)
+search = st.sidebar.text_input("Search text")
+filter_key = st.sidebar.text_input("Metadata key (e.g. email_id, file_name)")
+filter_value = st.sidebar.text_input("Metadata value")
+page_size = st.sidebar.number_input("Page size", min_value=1, max_value=MAX_PAGE_SIZE, value=25)
 
-if st.sidebar.button("Load Index"):
-    st.cache_data.clear()  # 🔄 Clear cache to force reload
-    display_index(index_name)
\ No newline at end of file
+catalog = open_catalog(index_name)
+if catalog is not None:
+    display_page(
+        index_name,
+        catalog,
+        search,
+        {filter_key: filter_value} if filter_key and filter_value else {},
+        int(page_size),
+    )